@@ -0,0 +1,89 @@
+"""
+Benchmark of the per-user history construction used by `create_recommendation_model`.
+
+Times `history_builder.build_histories` on synthetic interactions at several user counts and, for the
+smaller scales, the per-user scan loop it replaced.
+
+    python -m src.benchmarks.history_builder_benchmark --users 500 50000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.models import history_builder
+
+
+def make_interactions(num_users, books_per_user=5, num_books=10000, seed=0):
+    """Generates a `books_data`-style interaction frame with `books_per_user` rows per user."""
+    rng = np.random.default_rng(seed)
+    num_rows = num_users * books_per_user
+    book = rng.integers(0, num_books, num_rows)
+    titles = np.array([f"Title {i}" for i in range(num_books)], dtype=object)
+    descriptions = np.array([f"Description of book {i}." for i in range(num_books)], dtype=object)
+    isbns = np.array([f"{i:010d}" for i in range(num_books)], dtype=object)
+    return pd.DataFrame({
+        "user_id": rng.permutation(np.repeat(np.arange(1, num_users + 1), books_per_user)),
+        "isbn": isbns[book],
+        "title": titles[book],
+        "description": descriptions[book],
+        "rating": rng.integers(1, 6, num_rows),
+    })
+
+
+def legacy_build_histories(frame, users):
+    """The per-user scan loop formerly inlined in `create_recommendation_model`, kept for comparison."""
+    histories = []
+    isbns = []
+    for user in users:
+        temp = frame[frame["user_id"] == user][history_builder.HISTORY_COLUMNS]
+        temp["combined"] = frame.apply(
+            lambda x: str(x["user_id"]) + str(x["description"]) + str(x["title"]) + str(x['rating']), axis=1)
+        isbns.append(temp["isbn"].tolist())
+        histories.append(temp["combined"].tolist())
+    return histories, isbns
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def run(user_counts, books_per_user=5, legacy_max_users=500):
+    """
+    Runs the benchmark and returns one result dict per user count.
+
+    The legacy loop is only timed up to `legacy_max_users` users since it is quadratic in the number of users.
+    """
+    results = []
+    for num_users in user_counts:
+        frame = make_interactions(num_users, books_per_user)
+        users = list(range(1, num_users + 1))
+        seconds, (histories, isbns) = time_call(history_builder.build_histories, frame, users)
+        result = {"users": num_users, "rows": len(frame), "groupby_seconds": seconds, "legacy_seconds": None}
+
+        if num_users <= legacy_max_users:
+            result["legacy_seconds"], legacy = time_call(legacy_build_histories, frame, users)
+            if legacy != (histories, isbns):
+                raise AssertionError(f"History outputs differ from the legacy loop at {num_users} users")
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[500, 50000, 1000000])
+    parser.add_argument("--books-per-user", type=int, default=5)
+    parser.add_argument("--legacy-max-users", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'users':>10} {'rows':>10} {'groupby (s)':>12} {'legacy (s)':>12}")
+    for result in run(args.users, args.books_per_user, args.legacy_max_users):
+        legacy = "-" if result["legacy_seconds"] is None else f"{result['legacy_seconds']:.3f}"
+        print(f"{result['users']:>10} {result['rows']:>10} {result['groupby_seconds']:>12.3f} {legacy:>12}")
+
+
+if __name__ == "__main__":
+    main()
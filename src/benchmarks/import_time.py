@@ -0,0 +1,135 @@
+"""
+Startup-time report: how long importing the package's entry points takes, and where that time goes.
+
+    python -m src.benchmarks.import_time
+    python -m src.benchmarks.import_time src.serving.http_service --top 15 --max-ms 1500
+
+Every module is imported in a fresh `python -X importtime` interpreter, so nothing is shared between
+measurements, the way a forked worker or a CLI starts. For every module the report gives the wall time of
+the interpreter, the cumulative import time of the module, the import time per top-level package (the time
+spent in that package's own modules, so the packages add up to the total) and which of `HEAVY_PACKAGES` got
+imported. Those are meant to load on first use only: faiss and LangChain when a model is built or loaded,
+sentence-transformers when texts are embedded and Gradio when the demo is created, just like the MongoDB
+client, created by the first query (see `dbwrapper.get_connection`).
+
+With `--max-ms` the exit status is 1 when any module takes longer to import, so the budget can be checked
+in CI.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = (
+    "src.instrumentation",
+    "src.dbutils.dbwrapper",
+    "src.preprocessing_data.jaykishan_build_features",
+    "src.data.pipeline",
+    "src.data.synthetic",
+    "src.models.jaykishan_model_building",
+    "src.models.evaluation",
+    "src.serving.recommender",
+    "src.serving.http_service",
+    "src.main",
+)
+HEAVY_PACKAGES = ("faiss", "langchain_core", "langchain_community", "sentence_transformers", "transformers", "torch",
+                  "gradio")
+
+
+def parse_importtime(output):
+    """
+    Parses the `-X importtime` lines of an interpreter's stderr.
+
+    Args:
+        output (str): The stderr of the interpreter.
+
+    Returns:
+        list: One `(module, self_us, cumulative_us, depth)` tuple per imported module, in the order the
+              imports finished; `depth` is 0 for imports made by the top-level code.
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def measure_import(module, python=sys.executable, repeat=3):
+    """
+    Imports `module` in fresh interpreters and breaks down the fastest run.
+
+    Args:
+        module (str): Dotted name of the module to import.
+        python (str, optional): Interpreter to run. Defaults to the current one.
+        repeat (int, optional): Interpreters started; the fastest one is reported, to filter out noise.
+
+    Returns:
+        dict: `module`, `wall_ms`, `import_ms`, `packages` (`{package: ms}`, slowest first), `heavy` (the
+              `HEAVY_PACKAGES` imported) and `error` (the last line of the traceback, or None).
+    """
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        process = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                                 capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        if best is None or wall < best[0]:
+            best = (wall, process)
+    wall, process = best
+
+    entries = parse_importtime(process.stderr)
+    packages = {}
+    for name, self_us, _, _ in entries:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    imported = {name.split(".")[0] for name, _, _, _ in entries}
+    error = None
+    if process.returncode:
+        lines = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+        error = lines[-1] if lines else f"exit status {process.returncode}"
+    return {
+        "module": module,
+        "wall_ms": wall * 1000,
+        "import_ms": next((cumulative / 1000 for name, _, cumulative, depth in reversed(entries)
+                           if name == module and depth == 0), None),
+        "packages": {package: us / 1000 for package, us in sorted(packages.items(), key=lambda item: -item[1])},
+        "heavy": [package for package in HEAVY_PACKAGES if package in imported],
+        "error": error,
+    }
+
+
+def format_report(results, top=10):
+    """Renders `measure_import` results as a plain text table, with the `top` slowest packages of each module."""
+    lines = [f"{'module':<50} {'wall ms':>9} {'import ms':>10}  heavy"]
+    for result in results:
+        import_ms = f"{result['import_ms']:.0f}" if result["import_ms"] is not None else "-"
+        lines.append(f"{result['module']:<50} {result['wall_ms']:>9.0f} {import_ms:>10}  "
+                     f"{', '.join(result['heavy']) or '-'}")
+        if result["error"]:
+            lines.append(f"    error: {result['error']}")
+        for package, ms in list(result["packages"].items())[:top]:
+            lines.append(f"    {package:<46} {ms:>9.1f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_MODULES), help="modules to import")
+    parser.add_argument("--top", type=int, default=10, help="packages listed per module")
+    parser.add_argument("--repeat", type=int, default=3, help="interpreters started per module")
+    parser.add_argument("--max-ms", type=float, help="fail when a module takes longer to import")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = [measure_import(module, repeat=args.repeat) for module in args.modules]
+    print(json.dumps(results, indent=2) if args.json else format_report(results, args.top))
+    if args.max_ms is not None and any(result["error"] or result["import_ms"] > args.max_ms for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Recall-vs-latency report of the FAISS index types in `index_factory` against the exact flat index.
+
+Vectors are drawn from a mixture of Gaussians on the unit sphere, which mimics the clustered structure of
+sentence embeddings better than uniform noise.
+
+    python -m src.benchmarks.index_benchmark --vectors 100000 1000000 --dim 384
+"""
+import argparse
+
+import numpy as np
+
+from src.models import index_factory
+
+
+def make_vectors(num_vectors, dim, num_clusters=256, spread=0.35, seed=0):
+    """Returns `num_vectors` L2-normalized float32 vectors clustered around `num_clusters` centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((num_clusters, dim), dtype=np.float32)
+    vectors = centres[rng.integers(0, num_clusters, num_vectors)]
+    vectors += spread * rng.standard_normal((num_vectors, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index-types", nargs="+", default=list(index_factory.INDEX_TYPES))
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'vectors':>9} {'index':>9} {'build (s)':>10} {'recall@k':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'batch qps':>10}")
+    for num_vectors in args.vectors:
+        data = make_vectors(num_vectors + args.queries, args.dim)
+        vectors, queries = data[:num_vectors], data[num_vectors:]
+        report = index_factory.recall_latency_report(vectors, queries, k=args.k, index_types=args.index_types,
+                                                     nprobe=args.nprobe, ef_search=args.ef_search)
+        for row in report:
+            print(f"{num_vectors:>9} {row['index_type']:>9} {row['build_seconds']:>10.2f} {row['recall_at_k']:>9.3f} "
+                  f"{row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['batch_qps']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
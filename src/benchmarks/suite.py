@@ -0,0 +1,242 @@
+"""
+End-to-end benchmark of the build, query and database paths on synthetic data at several scales.
+
+For every scale a raw catalog and `synthetic.generate_synthetic_data` interactions are generated from a
+fixed seed, then `build_features`, `randomize_data`, `create_recommendation_model`, single and batch
+collaborative and content recommendations, fitting and querying the item-item engine of `item_cf`, and
+`dbwrapper` bulk writes and fetches are timed. Every stage
+reports p50/p95/p99 latency over its calls, throughput in items per second and the peak RSS of the
+process so far, as JSON:
+
+    python -m src.benchmarks.suite --books 1000 10000 --mongomock --output results.json
+
+Translation uses the no-op backend, so no network is needed. `--mongomock` runs the database stages
+against an in-memory mongomock client instead of `MONGO_URI`; without it or `--no-db` they need a server.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data import synthetic
+from src.dbutils import dbwrapper
+from src.dbutils.connect_database import ConnectDatabase
+from src.models import artifacts, batch_recommend, item_cf, jaykishan_model_building, jaykishan_recommend_book
+from src.preprocessing_data import jaykishan_build_features, jaykishan_randomize_data, translation
+from src.serving.recommender import Recommender
+
+BENCHMARK_COLLECTION = "benchmark_books_data"
+WORDS = np.array("the a of in to and story love war city night house world life death secret king girl boy "
+                 "river dark light time lost found home journey history science magic family friend".split())
+
+
+def make_catalog(num_books, seed=0):
+    """Generates a raw catalog with the columns `build_features` expects."""
+    rng = np.random.default_rng(seed)
+    words = WORDS[rng.integers(0, len(WORDS), (num_books, 30))]
+    book_ids = np.arange(1, num_books + 1)
+    return pd.DataFrame({
+        "isbn": [f"{i:010d}" for i in book_ids],
+        "title": [f"{' '.join(row[:3]).title()} {i}" for i, row in zip(book_ids, words)],
+        "description": [" ".join(row) for row in words],
+        "authors": [f"Author {i}" for i in rng.integers(1, max(2, num_books // 10), num_books)],
+        "book_id": book_ids.astype(str),
+        "image_url": [f"https://images.gr-assets.com/books/{1300000000 + i}m/{i}.jpg" for i in book_ids],
+        "publication_year": rng.integers(1900, 2024, num_books).astype(str),
+        "publication_month": rng.integers(1, 13, num_books).astype(str),
+        "average_rating": rng.uniform(2.5, 4.8, num_books).round(2).astype(str),
+        "ratings_count": rng.integers(0, 100000, num_books).astype(str),
+        "language_code": rng.choice(["eng", "en-US", "spa", ""], num_books),
+        "country_code": "US",
+        "num_pages": rng.integers(50, 900, num_books).astype(str),
+        "publisher": [f"Publisher {i}" for i in rng.integers(1, 200, num_books)],
+        "text_reviews_count": rng.integers(0, 5000, num_books).astype(str),
+    })
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def measure(stage, func, calls=1, items=1):
+    """
+    Calls `func` `calls` times and summarizes the latencies.
+
+    Args:
+        stage (str): Name of the stage in the results.
+        func (callable): Called with the call number.
+        calls (int, optional): Number of calls.
+        items (int or callable, optional): Items (rows, queries, documents) handled per call, for the
+                                           throughput, or a function computing them from the return value.
+
+    Returns:
+        tuple: `(result, last return value of func)`.
+    """
+    latencies = np.empty(calls)
+    value = None
+    for call in range(calls):
+        start = time.perf_counter()
+        value = func(call)
+        latencies[call] = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    if callable(items):
+        items = items(value)
+    result = {
+        "stage": stage,
+        "calls": calls,
+        "items_per_call": items,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "mean_ms": latencies.mean() * 1000,
+        "throughput": calls * items / latencies.sum() if latencies.sum() else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    return result, value
+
+
+def use_mongomock(database="benchmark"):
+    """Points `dbwrapper` at an in-memory mongomock database."""
+    import mongomock
+
+    connection = ConnectDatabase(connect=False)
+    connection.connection = mongomock.MongoClient()
+    connection.database = connection.connection[database]
+    dbwrapper.set_connection(connection)
+
+
+def run_scale(num_books, num_users, queries=200, batch_size=100, seed=0, db=True):
+    """Runs every stage at one scale and returns their results."""
+    results = []
+
+    def record(stage, func, calls=1, items=1):
+        result, value = measure(stage, func, calls, items)
+        result.update(books=num_books, users=num_users)
+        results.append(result)
+        return value
+
+    raw = make_catalog(num_books, seed)
+    cache = translation.TranslationCache(":memory:")
+    df = record("build_features", lambda _: jaykishan_build_features.build_features(
+        raw.copy(), translation_backend=translation.NoopBackend(), translation_cache=cache), items=num_books)
+    df = df.reset_index(drop=True)
+    cache.close()
+
+    user_book_df = record("generate_synthetic_data", lambda _: synthetic.generate_synthetic_data(
+        df, num_users=num_users, seed=seed), items=len)
+    user_book_df = user_book_df[jaykishan_model_building.INTERACTION_COLUMNS]
+
+    def randomize(_):
+        # `randomize_data` shuffles with the global `random` generator.
+        random.seed(seed)
+        return jaykishan_randomize_data.randomize_data(user_book_df)
+
+    users_train, users_val, train_df, validation_df = record("randomize_data", randomize, items=len(user_book_df))
+    collab, content, books_data, user_vectors = record(
+        "create_recommendation_model", lambda _: jaykishan_model_building.create_recommendation_model(
+            df, users_train, users_val, train_df, validation_df), items=num_books + len(users_train) + len(users_val))
+
+    bundle = artifacts.ModelBundle(collab, content, books_data, artifacts.catalog_table(df), users_train, users_val,
+                                   user_vectors, artifacts.compute_data_hash(df, user_book_df))
+    recommender = Recommender(bundle, user_book_df, use_precomputed=False, cache=None)
+    rng = np.random.default_rng(seed)
+    users = rng.choice(np.asarray(users_train + users_val), queries).tolist()
+    titles = df["title"].to_numpy(dtype=object)[rng.integers(0, len(df), queries)].tolist()
+    try:
+        record("recommend_book_collab", lambda call: recommender.recommend_user(users[call]), calls=queries)
+        record("recommend_book_content", lambda call: recommender.recommend_title(titles[call]), calls=queries)
+        batches = max(1, queries // batch_size)
+        record("recommend_books_collab_batch", lambda call: recommender.recommend_users(
+            users[call * batch_size:(call + 1) * batch_size]), calls=batches, items=batch_size)
+        record("recommend_books_content_batch", lambda call: recommender.recommend_titles(
+            titles[call * batch_size:(call + 1) * batch_size]), calls=batches, items=batch_size)
+    finally:
+        recommender.close()
+
+    catalog = bundle.catalog
+    model = record("item_cf.fit", lambda _: item_cf.ItemCF.fit(user_book_df, catalog), items=len(user_book_df))
+    record("recommend_book_collab_item_cf", lambda call: jaykishan_recommend_book.recommend_book_collab(
+        users[call], None, None, catalog, None, item_cf=model), calls=queries)
+    record("recommend_books_item_cf_batch", lambda call: batch_recommend.recommend_books_item_cf_batch(
+        users[call * batch_size:(call + 1) * batch_size], model, catalog), calls=batches, items=batch_size)
+
+    if db:
+        dbwrapper.get_connection().run("drop", lambda database: database[BENCHMARK_COLLECTION].drop())
+        record("dbwrapper.bulk_write", lambda _: dbwrapper.bulk_write(BENCHMARK_COLLECTION, user_book_df),
+               items=len(user_book_df))
+        record("dbwrapper.fetch_dataframe", lambda _: dbwrapper.fetch_dataframe(
+            BENCHMARK_COLLECTION, jaykishan_model_building.INTERACTION_COLUMNS), items=len(user_book_df))
+        dbwrapper.get_connection().run("drop", lambda database: database[BENCHMARK_COLLECTION].drop())
+    return results
+
+
+def run(book_counts, users_per_book=0.5, queries=200, batch_size=100, seed=0, db=True):
+    """
+    Runs the suite at every scale.
+
+    Args:
+        book_counts (list): Catalog sizes to benchmark.
+        users_per_book (float, optional): Users generated per book, at least 50.
+        queries (int, optional): Single queries timed per recommendation stage.
+        batch_size (int, optional): Queries per batch call.
+        seed (int, optional): Seed of all generated data.
+        db (bool, optional): Run the database stages.
+
+    Returns:
+        dict: `environment` details and one entry per stage and scale under `results`.
+    """
+    import faiss
+
+    results = []
+    for num_books in book_counts:
+        results.extend(run_scale(num_books, max(50, int(users_per_book * num_books)), queries, batch_size, seed, db))
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "faiss": getattr(faiss, "__version__", None),
+            "seed": seed,
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--users-per-book", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongomock", action="store_true", help="run the database stages against mongomock")
+    parser.add_argument("--no-db", action="store_true", help="skip the database stages")
+    parser.add_argument("--output", help="file to write the JSON results to instead of stdout")
+    args = parser.parse_args()
+
+    if args.mongomock:
+        use_mongomock()
+    report = run(args.books, args.users_per_book, args.queries, args.batch_size, args.seed, not args.no_db)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Streaming preprocessing of raw book dumps too large to load at once.
+
+    python -m src.data.pipeline data/raw/goodreads_books.json.gz --output data/processed/books
+
+The dump (CSV, or JSON lines optionally gzipped, like the Goodreads dumps) is read in chunks. Every chunk
+goes through `build_features`, is deduplicated on isbn and title against all earlier chunks through a
+SQLite seen-set, written as one Parquet partition and upserted into `all_books`. Memory use depends on the
+chunk size only. The seen-set is kept next to the partitions, so an interrupted run picks up where it
+stopped: rows already written are recognised and skipped.
+
+A partition is written to a temporary file and renamed into place, and only counts once its name is committed
+to the seen-set together with its keys. A run interrupted between the two leaves a partition that was never
+committed; the next run deletes it and writes its rows again, so no row is lost or written twice.
+"""
+import argparse
+import glob
+import logging
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from src.dbutils import dbwrapper
+from src.preprocessing_data import jaykishan_build_features, translation
+
+DEFAULT_CHUNK_SIZE = int(os.getenv("PIPELINE_CHUNK_SIZE", 50000))
+SEEN_FILE = "seen.sqlite"
+# Columns of the dump `build_features` uses. CSV dumps are read with these columns only; JSON lines have to be
+# parsed whole, and every chunk is narrowed to them right after (shelves, similar books, ... are dropped).
+RAW_COLUMNS = ['isbn', 'title', 'description', 'authors', 'book_id', 'image_url', 'publication_year',
+               'publication_month', 'average_rating', 'ratings_count', 'language_code', 'country_code',
+               'num_pages', 'publisher', 'text_reviews_count']
+
+
+def iter_raw_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Reads a raw dump in chunks of `chunk_size` rows, restricted to `RAW_COLUMNS`.
+
+    Only the CSV reader skips the other columns; JSON lines are parsed in full before being restricted.
+
+    Args:
+        path (str): A `.csv` file, or a JSON lines file (`.json`, `.jsonl`, optionally `.gz`).
+        chunk_size (int, optional): Rows per chunk.
+
+    Yields:
+        DataFrame: The next chunk, with every column of `RAW_COLUMNS`.
+    """
+    if ".csv" in os.path.basename(path):
+        reader = pd.read_csv(path, chunksize=chunk_size, usecols=lambda column: column in RAW_COLUMNS,
+                             dtype={"isbn": str})
+    else:
+        reader = pd.read_json(path, lines=True, chunksize=chunk_size, dtype=False, compression="infer")
+    with reader:
+        for chunk in reader:
+            yield chunk.reindex(columns=RAW_COLUMNS)
+
+
+def _authors_text(authors):
+    # The Goodreads dump lists authors as [{"author_id": ..., "role": ...}].
+    if isinstance(authors, list):
+        return ", ".join(str(author.get("author_id", "") if isinstance(author, dict) else author)
+                         for author in authors)
+    return authors
+
+
+class SeenSet:
+    """
+    Keys (isbns, titles) already written by earlier chunks or runs, and the partitions holding them, in SQLite.
+
+    New keys only become permanent with `commit`, called once their chunk is written, in the same transaction
+    as the partition they were written to, so a crash mid-chunk neither marks rows as written that never were
+    nor keeps a partition whose rows will be written again.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS seen (kind TEXT, key TEXT, PRIMARY KEY (kind, key))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS partitions (name TEXT PRIMARY KEY)")
+
+    def add_new(self, kind, keys):
+        """
+        Records `keys` of `kind` and tells which of them were not seen before.
+
+        Args:
+            kind (str): Key namespace, e.g. 'isbn' or 'title'.
+            keys (Series): Keys, unique within the series.
+
+        Returns:
+            ndarray: Boolean mask over `keys`, True for keys seen for the first time.
+        """
+        keys = keys.astype(str)
+        seen = set()
+        values = keys.tolist()
+        # Stays below SQLite's limit on the number of query parameters.
+        for start in range(0, len(values), 900):
+            chunk = values[start:start + 900]
+            rows = self.connection.execute(
+                f"SELECT key FROM seen WHERE kind = ? AND key IN ({','.join('?' * len(chunk))})", [kind, *chunk])
+            seen.update(row[0] for row in rows)
+        new = ~keys.isin(seen).to_numpy()
+        self.connection.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?)",
+                                    ((kind, key) for key in keys[new].tolist()))
+        return new
+
+    def partitions(self):
+        """Returns the file names of the committed partitions, in order."""
+        return [row[0] for row in self.connection.execute("SELECT name FROM partitions ORDER BY name")]
+
+    def commit(self, partition=None):
+        """Makes the keys added since the last commit permanent, along with the partition they were written to."""
+        if partition is not None:
+            self.connection.execute("INSERT INTO partitions VALUES (?)", (partition,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def process_chunk(chunk, seen, translation_backend=None, translation_cache=None):
+    """
+    Cleans one chunk of the raw dump and drops the books already seen in earlier chunks.
+
+    Deduplication matches `build_features` on the whole dump: the first row of every isbn is kept, then the
+    first of those rows for every title.
+
+    Args:
+        chunk (DataFrame): Raw rows, see `iter_raw_chunks`.
+        seen (SeenSet): Isbns and titles of the earlier chunks, updated with the ones of this chunk.
+        translation_backend, translation_cache: Forwarded to `build_features`.
+
+    Returns:
+        DataFrame: The new books, with the columns returned by `build_features`, or an empty frame.
+    """
+    chunk = chunk[chunk["isbn"].notna() & (chunk["isbn"].astype(str) != "")]
+    chunk = chunk.assign(authors=chunk["authors"].map(_authors_text)).drop_duplicates(subset="isbn")
+    chunk = chunk[seen.add_new("isbn", chunk["isbn"])].reset_index(drop=True)
+    if chunk.empty:
+        return chunk
+
+    features = jaykishan_build_features.build_features(chunk, translation_backend=translation_backend,
+                                                       translation_cache=translation_cache)
+    return features[seen.add_new("title", features["title"])].reset_index(drop=True)
+
+
+def _remove_uncommitted(output_dir, committed):
+    # Partitions renamed into place by a run that stopped before committing them, and unfinished temporary files.
+    committed = set(committed)
+    for path in glob.glob(os.path.join(output_dir, "part-*.parquet*")):
+        if os.path.basename(path) not in committed:
+            logging.info("Removing uncommitted partition %s", path)
+            os.remove(path)
+
+
+def run_pipeline(source, output_dir, chunk_size=DEFAULT_CHUNK_SIZE, collection_name="all_books", to_mongo=True,
+                 translation_backend=None):
+    """
+    Preprocesses a raw dump chunk by chunk into Parquet partitions and MongoDB.
+
+    Args:
+        source (str): The raw dump, see `iter_raw_chunks`.
+        output_dir (str): Directory of the `part-*.parquet` partitions and the seen-set. Partitions of
+                          earlier runs are kept and new ones numbered after them; partitions an interrupted
+                          run did not commit are removed.
+        chunk_size (int, optional): Rows read per chunk.
+        collection_name (str, optional): Collection the books are upserted into, by isbn.
+        to_mongo (bool, optional): Write to MongoDB as well as Parquet. Defaults to `True`.
+        translation_backend (optional): Forwarded to `build_features`.
+
+    Returns:
+        dict: Number of `chunks`, rows `read` and `written`, the `partitions` written and the `seconds` taken.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    seen = SeenSet(os.path.join(output_dir, SEEN_FILE))
+    cache = translation.TranslationCache()
+    committed = seen.partitions()
+    _remove_uncommitted(output_dir, committed)
+    next_part = len(committed)
+    summary = {"chunks": 0, "read": 0, "written": 0, "partitions": []}
+    start = time.perf_counter()
+    try:
+        for chunk in iter_raw_chunks(source, chunk_size):
+            features = process_chunk(chunk, seen, translation_backend, cache)
+            partition = None
+            if len(features):
+                partition = f"part-{next_part:05d}.parquet"
+                path = os.path.join(output_dir, partition)
+                features.to_parquet(path + ".tmp", index=False)
+                os.replace(path + ".tmp", path)
+                # Upserts by isbn, so writing the rows again after a crash before the commit changes nothing.
+                if to_mongo:
+                    dbwrapper.bulk_write(collection_name, features, mode="upsert", key="isbn")
+                summary["partitions"].append(path)
+                next_part += 1
+            seen.commit(partition)
+            summary["chunks"] += 1
+            summary["read"] += len(chunk)
+            summary["written"] += len(features)
+            elapsed = time.perf_counter() - start
+            logging.info("Chunk %d: %d rows read, %d books written in total (%.0f rows/sec)", summary["chunks"],
+                         summary["read"], summary["written"], summary["read"] / elapsed if elapsed else 0.0)
+    finally:
+        seen.close()
+        cache.close()
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def read_partitions(output_dir, columns=None):
+    """Reads the partitions committed by `run_pipeline` back into one DataFrame."""
+    seen_path = os.path.join(output_dir, SEEN_FILE)
+    paths = []
+    if os.path.exists(seen_path):
+        seen = SeenSet(seen_path)
+        try:
+            paths = [os.path.join(output_dir, name) for name in seen.partitions()]
+        finally:
+            seen.close()
+    if not paths:
+        return pd.DataFrame(columns=columns)
+    return pd.concat((pd.read_parquet(path, columns=columns) for path in paths), ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="raw dump, .csv or JSON lines (.json, .jsonl, optionally .gz)")
+    parser.add_argument("--output", default="data/processed/books", help="directory of the Parquet partitions")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--collection", default="all_books")
+    parser.add_argument("--no-mongo", action="store_true", help="only write Parquet")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    summary = run_pipeline(args.source, args.output, args.chunk_size, args.collection, not args.no_mongo)
+    logging.info("Wrote %d of %d rows to %d partitions in %.1fs", summary["written"], summary["read"],
+                 len(summary["partitions"]), summary["seconds"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,180 @@
-# put the function of synthetic data generation and store synthethic data in mongo
-import pandas as pd
+"""
+Synthetic user/book interactions (`books_data`) for development and load testing.
+
+Every book gets a normally distributed number of readers, drawn from the users with replacement, and every
+reader rates it around the book's average rating. All draws happen in bulk with NumPy, one chunk of books at
+a time, so 10^7-10^8 interactions can be streamed to Parquet or MongoDB in bounded memory:
+
+    python -m src.data.synthetic data/processed/books --users 1000000 --parquet data/interim/books_data
+
+The same seed and chunk size always produce the same interactions.
+"""
+import argparse
+import glob
+import logging
+import os
+import time
+
 import numpy as np
+import pandas as pd
+
+from src.dbutils import dbwrapper
+
+DEFAULT_BOOKS_PER_CHUNK = int(os.getenv("SYNTHETIC_BOOKS_PER_CHUNK", 10000))
+# Average rating assumed for every book when the catalog has none at all.
+DEFAULT_AVERAGE_RATING = 3.0
+SYNTHETIC_COLUMNS = ["user_id", "isbn", "title", "rating", "description", "image_url"]
+
+
+def popularity_weights(size, skew, rng):
+    """
+    Zipf-like weights with mean 1, `rank ** -skew` assigned to the items in random order.
+
+    A `skew` of 0 weighs every item the same; around 1 a few items dominate, like real reading data.
+    """
+    weights = np.arange(1, size + 1, dtype=np.float64) ** -skew
+    weights *= size / weights.sum()
+    return rng.permutation(weights)
+
+
+def iter_synthetic_chunks(df, num_users=500, readers_per_book=50, readers_std=6.5, book_skew=0.0, user_skew=0.0,
+                          seed=None, books_per_chunk=DEFAULT_BOOKS_PER_CHUNK):
+    """
+    Generates interactions for the books of `df`, one chunk of books at a time.
+
+    Args:
+        df (DataFrame): The book catalog, with `isbn`, `title`, `description`, `new_image_url` and
+                        `average_rating` columns. Books without a numeric average rating are rated around
+                        the mean of the others.
+        num_users (int, optional): Users numbered 1 to `num_users`.
+        readers_per_book (float, optional): Mean number of readers per book, the density of the
+                                            interactions: `readers_per_book / num_users` of the user/book pairs.
+        readers_std (float, optional): Standard deviation of the number of readers per book.
+        book_skew (float, optional): Popularity skew of the books, see `popularity_weights`. Scales the number
+                                     of readers of every book, keeping their mean.
+        user_skew (float, optional): Activity skew of the users, how unevenly readers are drawn.
+        seed (int, optional): Seed of the random generator. None draws a fresh one.
+        books_per_chunk (int, optional): Books per generated chunk.
+
+    Yields:
+        DataFrame: Interactions with the `SYNTHETIC_COLUMNS` columns.
+    """
+    rng = np.random.default_rng(seed)
+    num_books = len(df)
+    counts = (readers_per_book + readers_std * rng.standard_normal(num_books)).clip(min=0)
+    if book_skew:
+        counts *= popularity_weights(num_books, book_skew, rng)
+    # Truncated towards zero like `int()`, as are the ratings.
+    counts = counts.astype(np.int64)
+    user_p = popularity_weights(num_users, user_skew, rng) / num_users if user_skew else None
+
+    isbns = df["isbn"].to_numpy(dtype=object)
+    titles = df["title"].to_numpy(dtype=object)
+    descriptions = df["description"].to_numpy(dtype=object)
+    image_urls = df["new_image_url"].to_numpy(dtype=object)
+    averages = pd.to_numeric(df["average_rating"], errors="coerce").to_numpy(dtype=np.float64, copy=True)
+    # A NaN mean would make every rating NaN, which the int8 cast silently turns into 0.
+    missing = np.isnan(averages)
+    if missing.any():
+        averages[missing] = DEFAULT_AVERAGE_RATING if missing.all() else averages[~missing].mean()
+        logging.info("%d of %d books have no average rating, using %.2f", missing.sum(), num_books,
+                     averages[missing][0])
+
+    for start in range(0, num_books, books_per_chunk):
+        chunk_counts = counts[start:start + books_per_chunk]
+        books = np.repeat(np.arange(start, start + len(chunk_counts)), chunk_counts)
+        if user_p is None:
+            users = rng.integers(1, num_users + 1, len(books), dtype=np.int32)
+        else:
+            users = rng.choice(num_users, len(books), p=user_p).astype(np.int32) + 1
+        average = averages[books]
+        ratings = rng.normal(average, (5 - average) / 3).astype(np.int8)
+        yield pd.DataFrame({
+            "user_id": users,
+            "isbn": isbns[books],
+            "title": titles[books],
+            "rating": ratings,
+            "description": descriptions[books],
+            "image_url": image_urls[books],
+        })
+
+
+def generate_synthetic_data(df, num_users=500, **kwargs):
+    """
+    Generates interactions for the books of `df` as one DataFrame, see `iter_synthetic_chunks`.
+
+    Returns:
+        DataFrame: Interactions with the `SYNTHETIC_COLUMNS` columns.
+    """
+    chunks = list(iter_synthetic_chunks(df.reset_index(drop=True), num_users=num_users, **kwargs))
+    if not chunks:
+        return pd.DataFrame(columns=SYNTHETIC_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def stream_synthetic_data(df, parquet_dir=None, collection_name=None, **kwargs):
+    """
+    Generates interactions chunk by chunk into Parquet partitions and/or a MongoDB collection.
+
+    Args:
+        df (DataFrame): The book catalog, see `iter_synthetic_chunks`.
+        parquet_dir (str, optional): Directory the `part-*.parquet` partitions are written to.
+        collection_name (str, optional): Collection the interactions are inserted into, e.g. `books_data`.
+        **kwargs: Forwarded to `iter_synthetic_chunks`.
+
+    Returns:
+        int: Number of interactions generated.
+    """
+    if parquet_dir:
+        os.makedirs(parquet_dir, exist_ok=True)
+        next_part = len(glob.glob(os.path.join(parquet_dir, "part-*.parquet")))
+    total = 0
+    start = time.perf_counter()
+    for chunk in iter_synthetic_chunks(df.reset_index(drop=True), **kwargs):
+        if parquet_dir:
+            chunk.to_parquet(os.path.join(parquet_dir, f"part-{next_part:05d}.parquet"), index=False)
+            next_part += 1
+        if collection_name:
+            dbwrapper.bulk_write(collection_name, chunk)
+        total += len(chunk)
+        elapsed = time.perf_counter() - start
+        logging.info("%d interactions generated (%.0f rows/sec)", total, total / elapsed if elapsed else 0.0)
+    return total
+
+
+def read_catalog(path):
+    """Reads a catalog from a CSV file, a Parquet file or a directory of Parquet partitions."""
+    if path.endswith(".csv"):
+        return pd.read_csv(path)
+    if os.path.isdir(path):
+        paths = sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+        return pd.concat((pd.read_parquet(part) for part in paths), ignore_index=True)
+    return pd.read_parquet(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("catalog", help="books: .csv, .parquet or a directory of Parquet partitions")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--readers-per-book", type=float, default=50)
+    parser.add_argument("--readers-std", type=float, default=6.5)
+    parser.add_argument("--book-skew", type=float, default=0.0)
+    parser.add_argument("--user-skew", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--books-per-chunk", type=int, default=DEFAULT_BOOKS_PER_CHUNK)
+    parser.add_argument("--parquet", help="directory to write Parquet partitions to")
+    parser.add_argument("--collection", help="MongoDB collection to insert into, e.g. books_data")
+    args = parser.parse_args()
+    if not args.parquet and not args.collection:
+        parser.error("give --parquet and/or --collection")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    total = stream_synthetic_data(
+        read_catalog(args.catalog), args.parquet, args.collection, num_users=args.users,
+        readers_per_book=args.readers_per_book, readers_std=args.readers_std, book_skew=args.book_skew,
+        user_skew=args.user_skew, seed=args.seed, books_per_chunk=args.books_per_chunk)
+    logging.info("Generated %d interactions", total)
 
 
-def generate_synthetic_data(df):
-    # Creating a synthetic user dataset
-    num_users = 500
-
-    user_book_list = []
-    u_ids = [i for i in range(1, 1 + num_users)]
-    for i in range(len(df)):
-        n_users = int(50 + (6.5) * np.random.standard_normal())
-        reader_ids = np.random.choice(u_ids, n_users, replace=True)
-        row = df.loc[i]
-        for reader in reader_ids:
-            user_r = row['average_rating'].astype(float)
-            r_scale = (5 - user_r) / 3
-            user_rating = int(np.random.normal(loc=user_r, scale=r_scale))
-            user_book_list.append({
-                "user_id": reader,
-                "isbn": row["isbn"],
-                "title": row["title"],
-                "rating": user_rating,
-                "description": row['description'],
-                "image_url": row['new_image_url'],
-            })
-
-    user_book_df = pd.DataFrame(user_book_list)
-
-    return user_book_df
+if __name__ == "__main__":
+    main()
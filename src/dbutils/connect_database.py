@@ -1,33 +1,118 @@
+import logging
 import os
+import threading
+import time
+import pymongo
 from pymongo import MongoClient
-from dotenv import load_env
-load_env()
+from pymongo.errors import ConnectionFailure, PyMongoError
+from dotenv import load_dotenv
+from src.instrumentation import span
+load_dotenv()
+
+# Connection pool of the client, see the pymongo `MongoClient` options of the same name.
+MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+# Retries of an operation failing with a transient error, waiting INITIAL_WAIT, 2 * INITIAL_WAIT, ... seconds
+# between attempts, at most MAX_WAIT.
+MAX_RETRIES = int(os.getenv("MONGO_MAX_RETRIES", 5))
+INITIAL_WAIT = float(os.getenv("MONGO_RETRY_INITIAL_WAIT", 5))
+MAX_WAIT = float(os.getenv("MONGO_RETRY_MAX_WAIT", 40))
+# Settings of operations made while answering a request, see `ConnectDatabase.run`: a request should fail
+# fast (callers fall back to the live search) rather than wait through the batch job backoff above. Every
+# attempt, server selection included, is bounded by `timeout` seconds (pymongo's server monitoring rounds it
+# up to about half a second) and a failure is retried without the ping and reconnect, so with the defaults an
+# outage costs a request one to two seconds instead of three server selection timeouts.
+REQUEST_RETRY = {
+    "max_retries": int(os.getenv("MONGO_REQUEST_MAX_RETRIES", 1)),
+    "initial_wait": float(os.getenv("MONGO_REQUEST_RETRY_INITIAL_WAIT", 0.05)),
+    "max_wait": float(os.getenv("MONGO_REQUEST_RETRY_MAX_WAIT", 0.2)),
+    "timeout": float(os.getenv("MONGO_REQUEST_TIMEOUT", 0.5)),
+    "check_connection": False,
+}
+
+
+def is_transient(error):
+    """Returns True for errors worth retrying: lost connections, timeouts and errors labelled retryable."""
+    if isinstance(error, ConnectionFailure):
+        return True
+    return isinstance(error, PyMongoError) and (error.has_error_label("RetryableWriteError")
+                                                or error.has_error_label("TransientTransactionError"))
+
+
+class OperationMetrics:
+    """
+    Latency and error counters of one kind of database operation.
+
+    Attributes:
+        count (int): Finished operations, successful or not.
+        errors (int): Operations that failed after all retries.
+        retries (int): Retried attempts.
+        total_seconds (float): Summed latency, including retries and backoff.
+        max_seconds (float): Slowest operation.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "mean_ms": 1000 * self.total_seconds / self.count if self.count else 0.0,
+            "max_ms": 1000 * self.max_seconds,
+        }
+
 
 class ConnectDatabase:
     """
-    Manages the connection to a MongoDB database, including establishing, checking, 
+    Manages the connection to a MongoDB database, including establishing, checking,
     reconnecting, and closing the connection.
 
+    The client keeps a connection pool configured from the environment, so operations reuse pooled
+    connections instead of checking the server before every call. Health is only checked after an
+    operation failed, with a cheap `ping`.
+
     Attributes:
         connection (MongoClient): The MongoDB client connection instance.
         database (Database): The database instance for the connected MongoDB database.
+        metrics (dict): `OperationMetrics` per operation name passed to `run`.
 
     Methods:
         connect_to_database(): Establishes a connection to the MongoDB database based on the specified URI.
         close_connection(): Closes the active MongoDB connection, if any.
         reconnect(): Re-establishes the connection to the MongoDB server by closing and reopening the connection.
-        check_connection(): Checks if the current MongoDB connection is active and retrieves server information.
+        check_connection(): Checks if the current MongoDB connection is active with a ping.
+        run(): Runs an operation with retries and records its latency.
     """
 
-    def __init__(self):
-        """Initializes the ConnectDatabase instance and connects to the database."""
+    def __init__(self, max_retries=MAX_RETRIES, initial_wait=INITIAL_WAIT, max_wait=MAX_WAIT, connect=True):
+        """Initializes the ConnectDatabase instance and, unless `connect` is False, connects to the database."""
         self.connection = None
         self.database = None
-        self.connect_to_database()
+        self.max_retries = max_retries
+        self.initial_wait = initial_wait
+        self.max_wait = max_wait
+        self.metrics = {}
+        self.lock = threading.Lock()
+        if connect:
+            self.connect_to_database()
 
     def connect_to_database(self):
         """Establish a connection to the MongoDB server."""
-        self.connection = MongoClient(os.getenv("MONGO_URI"))
+        self.connection = MongoClient(
+            os.getenv("MONGO_URI"),
+            maxPoolSize=MAX_POOL_SIZE,
+            minPoolSize=MIN_POOL_SIZE,
+            maxIdleTimeMS=MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+        )
         self.database = self.connection[os.getenv("DATABASE")]
 
     def close_connection(self):
@@ -38,26 +123,86 @@ class ConnectDatabase:
 
     def reconnect(self):
         """Re-establish the connection to the MongoDB server."""
-        self.close_connection()  # Close the existing connection if it exists
-        self.connect_to_database()  # Create a new MongoClient instance
+        with self.lock:
+            self.close_connection()  # Close the existing connection if it exists
+            self.connect_to_database()  # Create a new MongoClient instance
 
     def check_connection(self):
         """
-        Checks if the MongoDB connection is active by retrieving server information.
-        
+        Checks if the MongoDB connection is active with a `ping` command.
+
         Returns:
             bool: True if the connection is active, False otherwise.
-
-        Raises:
-            Exception: If unable to retrieve server information, indicating a connection issue.
         """
         try:
-            # Try to retrieve server information
-            server_info = self.connection.server_info()
-            print("MongoDB connection is active.")
-            print("Server Info:", server_info)
+            self.connection.admin.command("ping")
             return True
-        
+
         except Exception as e:
-            print(f"MongoDB connection is not active: {e}")
-            return False
\ No newline at end of file
+            logging.warning(f"MongoDB connection is not active: {e}")
+            return False
+
+    def run(self, name, operation, max_retries=None, initial_wait=None, max_wait=None, timeout=None,
+            check_connection=True):
+        """
+        Runs a database operation, retrying transient errors with bounded exponential backoff.
+
+        After a transient error the connection is pinged and, if the ping fails as well, re-established
+        before the next attempt, unless `check_connection` is False. Other errors are raised immediately. The operation should return its
+        results fully read (e.g. `list(cursor)`), since reads made later by the caller are neither retried
+        nor timed.
+
+        Args:
+            name (str): Name of the operation, the key of its entry in `metrics`.
+            operation (callable): Called with the `Database` and returning the result.
+            max_retries (int, optional): Overrides `self.max_retries` for this call.
+            initial_wait (float, optional): Overrides `self.initial_wait` for this call.
+            max_wait (float, optional): Overrides `self.max_wait` for this call.
+            timeout (float, optional): Seconds every attempt may take, server selection and all round trips
+                                       included (`pymongo.timeout`). Defaults to the client's own timeouts.
+            check_connection (bool, optional): Ping and, if needed, reconnect before retrying. The ping waits
+                                               for server selection, up to `SERVER_SELECTION_TIMEOUT_MS`.
+
+        Returns:
+            The result of `operation`.
+
+        Raises:
+            Exception: The last error if the operation fails after `max_retries` retries, or any
+                       non-transient error.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        initial_wait = self.initial_wait if initial_wait is None else initial_wait
+        max_wait = self.max_wait if max_wait is None else max_wait
+        metrics = self.metrics.get(name)
+        if metrics is None:
+            metrics = self.metrics.setdefault(name, OperationMetrics())
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            with span(f"db.{name}"):
+                while True:
+                    try:
+                        if timeout is None:
+                            return operation(self.database)
+                        with pymongo.timeout(timeout):
+                            return operation(self.database)
+                    except Exception as e:
+                        if not is_transient(e) or attempt >= max_retries:
+                            metrics.errors += 1
+                            raise
+                        wait = min(initial_wait * 2 ** attempt, max_wait)
+                        attempt += 1
+                        metrics.retries += 1
+                        logging.warning(f"{name} failed ({e}), retry {attempt}/{max_retries} in {wait:.2f}s")
+                        time.sleep(wait)
+                        if check_connection and not self.check_connection():
+                            self.reconnect()
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.count += 1
+            metrics.total_seconds += elapsed
+            metrics.max_seconds = max(metrics.max_seconds, elapsed)
+
+    def latency_report(self):
+        """Returns the metrics of every operation as plain dicts, keyed by operation name."""
+        return {name: metrics.as_dict() for name, metrics in self.metrics.items()}
@@ -1,11 +1,56 @@
 import datetime
+import itertools
 import logging
 import os
+import threading
+import time
 import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import pandas as pd
 from bson import ObjectId
-from connect_database import ConnectDatabase
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from src.dbutils.connect_database import ConnectDatabase
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def get_connection():
+    """
+    Returns the `ConnectDatabase` shared by all operations of this module, creating it on first use.
+
+    Importing the module does not create a client, so tools that never touch the database do not need one.
+    """
+    global _connection
+    if _connection is None:
+        with _connection_lock:
+            if _connection is None:
+                _connection = ConnectDatabase()
+    return _connection
+
+
+def set_connection(connection):
+    """
+    Replaces the shared connection, e.g. with one to a test database.
+
+    Args:
+        connection (ConnectDatabase): The connection used by every later operation.
+
+    Returns:
+        ConnectDatabase: The previous connection, or None if none was created yet.
+    """
+    global _connection
+    with _connection_lock:
+        previous, _connection = _connection, connection
+    return previous
+
+
+def __getattr__(name):
+    # `db_connection` used to be created at import; it is still reachable, created on first access.
+    if name == "db_connection":
+        return get_connection()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-db_connection = ConnectDatabase()
 
 def insert_documents(collection_name, documents_to_insert, many=None):
     """
@@ -31,33 +76,20 @@ def insert_documents(collection_name, documents_to_insert, many=None):
         Exception: If the insertion fails after the maximum number of retry attempts or due to other errors.
 
     """
-    try:
-        if db_connection.check_connection():
-            collection = db_connection.database[collection_name]
-            # condition used for documents insert using inser_many fuction
-            if many:
-                inserted_docs = collection.insert_many(documents_to_insert)
-                id = inserted_docs.inserted_ids
-                return id
-            else:
-                inserted_docs = collection.insert_one(documents_to_insert)
-                id = inserted_docs.inserted_id
-                return id
+    def insert(database):
+        collection = database[collection_name]
+        # condition used for documents insert using inser_many fuction
+        if many:
+            inserted_docs = collection.insert_many(documents_to_insert)
+            id = inserted_docs.inserted_ids
+            return id
         else:
-            print("retry")
-            logging.info("retry")
-            db_connection.reconnect()
-            collection = db_connection.database[collection_name]
-            # condition used for documents insert using inser_many fuction
-            if many:
-                inserted_docs = collection.insert_many(documents_to_insert)
-                id = inserted_docs.inserted_ids
-                return id
-            else:
-                inserted_docs = collection.insert_one(documents_to_insert)
-                id = inserted_docs.inserted_id
-                return id
-        # print list of the _id values of the inserted documents:
+            inserted_docs = collection.insert_one(documents_to_insert)
+            id = inserted_docs.inserted_id
+            return id
+
+    try:
+        return get_connection().run("insert_documents", insert)
 
     # Handle exceptions:
     except Exception as e:
@@ -65,7 +97,8 @@ def insert_documents(collection_name, documents_to_insert, many=None):
 
 
 def fetch_documents(
-    collection_name, limit_count=None,condition=None, one=None, columns=None, sort_condition=None,distinct= None,key=None
+    collection_name, limit_count=None,condition=None, one=None, columns=None, sort_condition=None,distinct= None,key=None,
+    retry=None
 ):
     """
     Fetches documents from a specified MongoDB collection with automatic retries in case of failure.
@@ -85,6 +118,8 @@ def fetch_documents(
         sort_condition (tuple, optional): A tuple `(field, direction)` to sort the documents by. The direction is either 1 (ascending) or -1 (descending). Defaults to `None`.
         distinct (bool, optional): If `True`, retrieves distinct values of a specific field. Defaults to `None`.
         key (str, optional): The field to retrieve distinct values from. Required if `distinct` is `True`.
+        retry (dict, optional): Retry settings overriding the connection's, see `ConnectDatabase.run`, e.g.
+                                `connect_database.REQUEST_RETRY` for reads made while answering a request.
 
     Returns:
         list or dict: If `distinct` is specified, a list of distinct values is returned. If `one` is specified, a single document is returned.
@@ -94,187 +129,110 @@ def fetch_documents(
         Exception: If the fetch operation fails after the maximum number of retry attempts or due to other errors.
 
     Workflow:
-        1. Checks the database connection using `db_connection.check_connection()`.
-        2. If the connection is successful, fetches the documents based on the provided parameters.
-        3. If the connection fails, attempts to reconnect and retries the fetch operation.
-        4. If the fetch operation is successful, returns the requested documents or values.
-        5. In case of any exception, the function raises the error.
+        1. Fetches the documents based on the provided parameters through `get_connection().run`, reading
+           the whole cursor inside it so every round trip is retried and timed.
+        2. If the fetch fails with a transient error, pings the server, reconnects if needed and retries.
+        3. If the fetch operation is successful, returns the requested documents or values.
+        4. In case of any other exception, or once the retries are exhausted, the function raises the error.
 
 
     """
-    try:
-        if db_connection.check_connection():
-            collection = db_connection.database[collection_name]
-            # condition used for documents fetch using condition or not
-            if one:
-                if not sort_condition:
+    def fetch(database):
+        collection = database[collection_name]
+        # condition used for documents fetch using condition or not
+        if one:
+            if not sort_condition:
+                if condition and columns:
+                    documents = collection.find_one(condition, columns)
+                    return documents
+                elif condition:
+                    documents = collection.find_one(condition)
+                    return documents
+            else:
+                if condition and columns:
+                    documents = collection.find_one(filter=condition,sort=[(sort_condition[0],sort_condition[1])],projection=columns)
+                    return documents
+                elif condition:
+                    documents = collection.find_one(filter=condition,sort=[(sort_condition[0],sort_condition[1])])
+                    return documents
+        elif distinct:
+            if condition and key:
+                documents = collection.distinct(key,condition)
+                return documents
+            elif key:
+                documents = collection.distinct(key)
+                return documents
+        else:
+            if limit_count:
+                if sort_condition:
                     if condition and columns:
-                        documents = collection.find_one(condition, columns)
+                        documents = collection.find(condition, columns).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
                         return documents
                     elif condition:
-                        documents = collection.find_one(condition)
+                        documents = collection.find(condition).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
+                        return documents
+                    elif columns:
+                        documents = collection.find(projection=columns).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
+                        return documents
+                    else:
+                        documents = collection.find().sort( sort_condition[0], sort_condition[1]).limit(limit_count)
                         return documents
                 else:
                     if condition and columns:
-                        documents = collection.find_one(filter=condition,sort=[(sort_condition[0],sort_condition[1])],projection=columns)
+                        documents = collection.find(condition, columns).limit(limit_count)
                         return documents
                     elif condition:
-                        documents = collection.find_one(filter=condition,sort=[(sort_condition[0],sort_condition[1])])
+                        documents = collection.find(condition).limit(limit_count)
+                        return documents
+                    elif columns:
+                        documents = collection.find(projection=columns).limit(limit_count)
                         return documents
-            elif distinct:
-                if condition and key:
-                    documents = collection.distinct(key,condition)
-                    return documents
-                elif key:
-                    documents = collection.distinct(key)
-                    return documents
-            else:
-                if limit_count:
-                    if sort_condition:
-                        if condition and columns:
-                            documents = collection.find(condition, columns).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
-                            return documents
-                        elif condition:
-                            documents = collection.find(condition).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
-                            return documents
-                        elif columns:
-                            documents = collection.find(projection=columns).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
-                            return documents
-                        else:
-                            documents = collection.find().sort( sort_condition[0], sort_condition[1]).limit(limit_count)
-                            return documents
-                    else:
-                        if condition and columns:
-                            documents = collection.find(condition, columns).limit(limit_count)
-                            return documents
-                        elif condition:
-                            documents = collection.find(condition).limit(limit_count)
-                            return documents
-                        elif columns:
-                            documents = collection.find(projection=columns).limit(limit_count)
-                            return documents
-                        else:
-                            documents = collection.find().limit(limit_count)
-                            return documents
-                else:
-                    if sort_condition:
-                        if condition and columns:
-                            documents = collection.find(condition, columns).sort( sort_condition[0], sort_condition[1])
-                            return documents
-                        elif condition:
-                            documents = collection.find(condition).sort( sort_condition[0], sort_condition[1])
-                            return documents
-                        elif columns:
-                            documents = collection.find(projection=columns).sort( sort_condition[0], sort_condition[1])
-                            return documents
-                        else:
-                            documents = collection.find().sort( sort_condition[0], sort_condition[1])
-                            return documents
                     else:
-                        if condition and columns:
-                            documents = collection.find(condition, columns)
-                            return documents
-                        elif condition:
-                            documents = collection.find(condition)
-                            return documents
-                        elif columns:
-                            documents = collection.find(projection=columns)
-                            return documents
-                        else:
-                            documents = collection.find()
-                            return documents
-                
-        else:
-            print("retry")
-            logging.info("retry")
-            db_connection.reconnect()
-            collection = db_connection.database[collection_name]
-            # condition used for documents fetch using condition or not
-            if one:
-                if not sort_condition:
+                        documents = collection.find().limit(limit_count)
+                        return documents
+            else:
+                if sort_condition:
                     if condition and columns:
-                        documents = collection.find_one(condition, columns)
+                        documents = collection.find(condition, columns).sort( sort_condition[0], sort_condition[1])
                         return documents
                     elif condition:
-                        documents = collection.find_one(condition)
+                        documents = collection.find(condition).sort( sort_condition[0], sort_condition[1])
+                        return documents
+                    elif columns:
+                        documents = collection.find(projection=columns).sort( sort_condition[0], sort_condition[1])
+                        return documents
+                    else:
+                        documents = collection.find().sort( sort_condition[0], sort_condition[1])
                         return documents
                 else:
                     if condition and columns:
-                        documents = collection.find_one(filter=condition,sort=[(sort_condition[0],sort_condition[1])],projection=columns)
+                        documents = collection.find(condition, columns)
                         return documents
                     elif condition:
-                        documents = collection.find_one(filter=condition,sort=[(sort_condition[0],sort_condition[1])])
+                        documents = collection.find(condition)
+                        return documents
+                    elif columns:
+                        documents = collection.find(projection=columns)
                         return documents
-            elif distinct:
-                if condition and key:
-                    documents = collection.distinct(key,condition)
-                    return documents
-                elif key:
-                    documents = collection.distinct(key)
-                    return documents
-            else:
-                if limit_count:
-                    if sort_condition:
-                        if condition and columns:
-                            documents = collection.find(condition, columns).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
-                            return documents
-                        elif condition:
-                            documents = collection.find(condition).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
-                            return documents
-                        elif columns:
-                            documents = collection.find(projection=columns).sort( sort_condition[0], sort_condition[1]).limit(limit_count)
-                            return documents
-                        else:
-                            documents = collection.find().sort( sort_condition[0], sort_condition[1]).limit(limit_count)
-                            return documents
-                    else:
-                        if condition and columns:
-                            documents = collection.find(condition, columns).limit(limit_count)
-                            return documents
-                        elif condition:
-                            documents = collection.find(condition).limit(limit_count)
-                            return documents
-                        elif columns:
-                            documents = collection.find(projection=columns).limit(limit_count)
-                            return documents
-                        else:
-                            documents = collection.find().limit(limit_count)
-                            return documents
-                else:
-                    if sort_condition:
-                        if condition and columns:
-                            documents = collection.find(condition, columns).sort( sort_condition[0], sort_condition[1])
-                            return documents
-                        elif condition:
-                            documents = collection.find(condition).sort( sort_condition[0], sort_condition[1])
-                            return documents
-                        elif columns:
-                            documents = collection.find(projection=columns).sort( sort_condition[0], sort_condition[1])
-                            return documents
-                        else:
-                            documents = collection.find().sort( sort_condition[0], sort_condition[1])
-                            return documents
                     else:
-                        if condition and columns:
-                            documents = collection.find(condition, columns)
-                            return documents
-                        elif condition:
-                            documents = collection.find(condition)
-                            return documents
-                        elif columns:
-                            documents = collection.find(projection=columns)
-                            return documents
-                        else:
-                            documents = collection.find()
-                            return documents
-           
+                        documents = collection.find()
+                        return documents
+
+    def fetch_all(database):
+        documents = fetch(database)
+        if one or distinct:
+            return documents
+        return list(documents)
+
+    try:
+        return get_connection().run("fetch_documents", fetch_all, **(retry or {}))
+
     # Handle exceptions:
     except Exception as e:
-        print(e)
         raise Exception(e)
 
 
-def update_docs(collection_name, condition, update_query, upsert=None, many=None):
+def update_docs(collection_name, condition, update_query, upsert=None, many=None, retry=None):
     """
     Updates documents in a specified MongoDB collection based on a given condition and update query, with retry functionality.
 
@@ -288,6 +246,7 @@ def update_docs(collection_name, condition, update_query, upsert=None, many=None
         update_query (dict): The update query that defines the modifications to apply to the matching documents.
         upsert (bool, optional): If `True`, inserts a new document if no document matches the condition. Defaults to `None`.
         many (bool, optional): If `True`, updates multiple documents that match the condition. If `False`, updates only the first matching document. Defaults to `None`.
+        retry (dict, optional): Retry settings overriding the connection's, see `fetch_documents`.
 
     Returns:
         bool: `True` if the update operation is successfully performed.
@@ -296,70 +255,33 @@ def update_docs(collection_name, condition, update_query, upsert=None, many=None
         Exception: Raises an exception if the update operation fails after all retries.
 
     Workflow:
-        1. Checks if there is an active database connection using `db_connection.check_connection()`.
-        2. If connected, it performs the update operation based on the provided parameters (`upsert` and `many`).
+        1. Performs the update operation through `get_connection().run`, based on the provided parameters (`upsert` and `many`).
             - If `many` is `True`, `update_many` is used to update all matching documents.
             - If `many` is `False` (or not specified), `update_one` is used to update the first matching document.
             - If `upsert` is `True`, inserts a new document if none match the specified condition.
-        3. If the connection is not established, it retries the connection and reattempts the update.
-        4. Upon success, it returns `True`. In case of failure, it raises an exception.
+        2. If the update fails with a transient error, it pings the server, reconnects if needed and reattempts the update.
+        3. Upon success, it returns `True`. In case of failure, it raises an exception.
 
     """
-    try:
-        if db_connection.check_connection():
-            if many:
-                if upsert:
-                    collection = db_connection.database[collection_name]
-                    updated_docs = collection.update_many(
-                        condition, update_query, upsert=upsert
-                    )
-                    return True
-                else:
-                    collection = db_connection.database[collection_name]
-                    updated_docs = collection.update_many(condition, update_query)
-                    return True
+    def update(database):
+        collection = database[collection_name]
+        if many:
+            if upsert:
+                updated_docs = collection.update_many(condition, update_query, upsert=upsert)
             else:
-                if upsert:
-                    collection = db_connection.database[collection_name]
-                    updated_docs = collection.update_one(
-                        condition, update_query, upsert=upsert
-                    )
-                    return True
-                else:
-                    collection = db_connection.database[collection_name]
-                    updated_docs = collection.update_one(condition, update_query)
-                    return True
+                updated_docs = collection.update_many(condition, update_query)
         else:
-            print("retry")
-            logging.info("retry")
-            db_connection.reconnect()
-            if many:
-                if upsert:
-                    collection = db_connection.database[collection_name]
-                    updated_docs = collection.update_many(
-                        condition, update_query, upsert=upsert
-                    )
-                    return True
-                else:
-                    collection = db_connection.database[collection_name]
-                    updated_docs = collection.update_many(condition, update_query)
-                    return True
+            if upsert:
+                updated_docs = collection.update_one(condition, update_query, upsert=upsert)
             else:
-                if upsert:
-                    collection = db_connection.database[collection_name]
-                    updated_docs = collection.update_one(
-                        condition, update_query, upsert=upsert
-                    )
-                    return True
-                else:
-                    collection = db_connection.database[collection_name]
-                    updated_docs = collection.update_one(condition, update_query)
-                    return True
-    
-    
+                updated_docs = collection.update_one(condition, update_query)
+        return True
+
+    try:
+        return get_connection().run("update_docs", update, **(retry or {}))
+
     # Handle exceptions:
     except Exception as e:
-
         raise Exception(e)
 
 def get_document_count(collection_name, condition={}):
@@ -381,27 +303,231 @@ def get_document_count(collection_name, condition={}):
         Exception: Raises an exception if the count operation fails after all retries.
 
     Workflow:
-        1. Verifies the database connection using `db_connection.check_connection()`.
-        2. If connected, retrieves the count of documents that match the specified `condition`.
-        3. If not connected, retries by reconnecting to the database and then reattempting the count.
-        4. Returns the document count if successful.
+        1. Retrieves the count of documents that match the specified `condition` through `get_connection().run`.
+        2. If the count fails with a transient error, pings the server, reconnects if needed and reattempts the count.
+        3. Returns the document count if successful.
 
 
     """
     try:
-        if db_connection.check_connection():
-            collection = db_connection.database[collection_name]
-            count = collection.count_documents(condition)
-            return count
+        return get_connection().run("get_document_count",
+                                 lambda database: database[collection_name].count_documents(condition))
+
+    # Handle exceptions:
+    except Exception as e:
+        raise Exception(e)
+
+
+DEFAULT_WRITE_CHUNK_SIZE = int(os.getenv("MONGO_WRITE_CHUNK_SIZE", 5000))
+DEFAULT_WRITE_WORKERS = int(os.getenv("MONGO_WRITE_WORKERS", 4))
+WRITE_OPERATIONS = (InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany)
+
+
+def iter_document_chunks(documents, chunk_size=DEFAULT_WRITE_CHUNK_SIZE):
+    """
+    Splits documents into lists of at most `chunk_size` items without materializing them all.
+
+    Args:
+        documents (DataFrame or iterable): A DataFrame, converted to dicts one chunk of rows at a time, or
+                                           any iterable of documents or write operations.
+        chunk_size (int, optional): Items per chunk.
+
+    Yields:
+        list: The next chunk.
+    """
+    if isinstance(documents, pd.DataFrame):
+        for start in range(0, len(documents), chunk_size):
+            yield documents.iloc[start:start + chunk_size].to_dict("records")
+        return
+    iterator = iter(documents)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _to_operation(document, mode, key):
+    if isinstance(document, WRITE_OPERATIONS):
+        return document
+    if mode == "upsert":
+        return UpdateOne({key: document[key]}, {"$set": {k: v for k, v in document.items() if k != "_id"}},
+                         upsert=True)
+    if mode == "replace":
+        return ReplaceOne({key: document[key]}, document, upsert=True)
+    return InsertOne(document)
+
+
+def bulk_write(collection_name, documents, mode="insert", key="_id", chunk_size=DEFAULT_WRITE_CHUNK_SIZE,
+               workers=DEFAULT_WRITE_WORKERS):
+    """
+    Writes a large number of documents to a specified MongoDB collection in chunks of unordered bulk writes.
+
+    The documents are converted chunk by chunk, so a DataFrame or a generator of tens of millions of rows
+    never exists as one list of dicts. Up to `workers` chunks are written concurrently, each as a single
+    unordered `bulk_write` retried through `get_connection().run`, and at most `workers` further chunks are
+    converted ahead. Progress and throughput are logged after every chunk.
+
+    Args:
+        collection_name (str): The name of the MongoDB collection to write to.
+        documents (DataFrame or iterable): The documents to write. Items that already are pymongo write
+                                           operations (`InsertOne`, `UpdateOne`, ...) are written as they
+                                           are, so one call can mix upserts, updates and deletes.
+        mode (str, optional): How plain documents are written: `"insert"`, `"upsert"` (`$set` the fields of
+                              the document with the same `key`) or `"replace"` (replace it). Defaults to `"insert"`.
+        key (str, optional): The field identifying a document for upserts and replacements. Defaults to `_id`.
+        chunk_size (int, optional): Documents per bulk write.
+        workers (int, optional): Chunks written in parallel. 1 writes sequentially.
+
+    Returns:
+        dict: Counts of `inserted`, `upserted`, `modified`, `deleted` and `processed` documents, and the `seconds` taken.
+
+    Raises:
+        Exception: Raises an exception if a bulk write fails after all retries.
+    """
+    if mode not in ("insert", "upsert", "replace"):
+        raise ValueError(f"Unknown bulk write mode {mode!r}")
+    summary = {"inserted": 0, "upserted": 0, "modified": 0, "deleted": 0, "processed": 0}
+    start = time.perf_counter()
+
+    def write(chunk):
+        requests = [_to_operation(document, mode, key) for document in chunk]
+        result = get_connection().run("bulk_write",
+                                   lambda database: database[collection_name].bulk_write(requests, ordered=False))
+        return len(requests), result
+
+    def record(count, result):
+        summary["inserted"] += result.inserted_count
+        summary["upserted"] += result.upserted_count
+        summary["modified"] += result.modified_count
+        summary["deleted"] += result.deleted_count
+        summary["processed"] += count
+        elapsed = time.perf_counter() - start
+        logging.info(f"{collection_name}: {summary['processed']} documents written "
+                     f"({summary['processed'] / elapsed if elapsed else 0:.0f} docs/sec)")
+
+    try:
+        chunks = iter_document_chunks(documents, chunk_size)
+        if workers <= 1:
+            for chunk in chunks:
+                record(*write(chunk))
         else:
-            print("retry")
-            logging.info("retry")
-            db_connection.reconnect()
-            collection = db_connection.database[collection_name]
-            count = collection.count_documents(condition)
-            return count
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = set()
+                for chunk in chunks:
+                    pending.add(executor.submit(write, chunk))
+                    if len(pending) >= 2 * workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            record(*future.result())
+                for future in pending:
+                    record(*future.result())
+
     # Handle exceptions:
     except Exception as e:
+        raise Exception(e)
 
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def bulk_upsert(collection_name, documents, key="_id"):
+    """
+    Upserts many documents into a specified MongoDB collection with unordered bulk writes.
+
+    Every document replaces the fields of the existing document with the same `key` value, or is inserted if
+    no such document exists. See `bulk_write`.
+
+    Args:
+        collection_name (str): The name of the MongoDB collection to write to.
+        documents (DataFrame or iterable): The documents to upsert. Each one must contain `key`.
+        key (str, optional): The field identifying a document. Defaults to `_id`.
+
+    Returns:
+        int: The number of documents inserted or modified.
+
+    Raises:
+        Exception: Raises an exception if the bulk write fails.
+    """
+    summary = bulk_write(collection_name, documents, mode="upsert", key=key)
+    return summary["upserted"] + summary["modified"]
+
+
+DEFAULT_FETCH_BATCH_SIZE = int(os.getenv("MONGO_FETCH_BATCH_SIZE", 10000))
+
+
+def iter_dataframes(collection_name, columns=None, condition=None, batch_size=DEFAULT_FETCH_BATCH_SIZE):
+    """
+    Streams a MongoDB collection as a sequence of DataFrames of at most `batch_size` rows.
+
+    The collection is read in pages of `batch_size` documents in `_id` order, each page a query resuming
+    after the last `_id` of the previous one and read completely inside `get_connection().run`. Every
+    round trip is therefore retried on transient errors and timed, and a retried page starts where the
+    failed one did instead of from the beginning. The projection is applied by the server, so only the
+    requested fields are transferred. `_id` values are expected to be of one type, like the default
+    ObjectIds, since MongoDB compares them with `$gt` only within a type.
+
+    Args:
+        collection_name (str): The name of the MongoDB collection to read.
+        columns (list, optional): Fields to load. All fields are loaded if not specified. `_id` is only
+                                  included when it is listed.
+        condition (dict, optional): A filter condition to apply to the documents. Defaults to `None`.
+        batch_size (int, optional): Documents per page and per yielded DataFrame.
+
+    Yields:
+        DataFrame: The next chunk of documents. With `columns`, every chunk has exactly these columns in
+                   this order, fields missing from a document being None.
+
+    Raises:
+        Exception: Raises an exception if the read fails after all retries.
+    """
+    projection = None
+    if columns:
+        # `_id` is always read, it is the position of the next page.
+        projection = {column: 1 for column in columns}
+        projection["_id"] = 1
+    query = condition or {}
+    try:
+        while True:
+            documents = get_connection().run(
+                "iter_dataframes", lambda database: list(database[collection_name].find(query, projection)
+                                                         .sort("_id", 1).limit(batch_size)))
+            if not documents:
+                return
+            last_id, last_page = documents[-1]["_id"], len(documents) < batch_size
+
+            data = {column: [] for column in columns or []}
+            for row, document in enumerate(documents):
+                if not columns:
+                    for column in document:
+                        if column not in data:
+                            data[column] = [None] * row
+                for column, values in data.items():
+                    values.append(document.get(column))
+            del documents
+            yield pd.DataFrame(data, columns=columns or list(data))
+            if last_page:
+                return
+
+            after = {"_id": {"$gt": last_id}}
+            query = {"$and": [condition, after]} if condition else after
+
+    # Handle exceptions:
+    except Exception as e:
         raise Exception(e)
 
+
+def fetch_dataframe(collection_name, columns=None, condition=None, batch_size=DEFAULT_FETCH_BATCH_SIZE):
+    """
+    Loads a MongoDB collection into a single DataFrame, streaming it in chunks.
+
+    See `iter_dataframes` for the arguments. At most one page of documents exists as Python dicts at a
+    time, but the chunks are only concatenated at the end, so peak memory is about twice the final frame.
+
+    Returns:
+        DataFrame: All matching documents, with `columns` as columns when given.
+    """
+    chunks = list(iter_dataframes(collection_name, columns, condition, batch_size))
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
@@ -0,0 +1,397 @@
+"""
+Lightweight timing of the recommendation, model build and database stages.
+
+    with instrumentation.span("collab.search"):
+        ...
+
+    @instrumentation.timed("build.load_or_build")
+    def load_or_build_model(...):
+
+Every span feeds a latency histogram and error counter named after it, exported in the Prometheus text
+format by `render` (served on `/metrics` by `src.serving.http_service`). With `METRICS_LOG_SPANS=1` every
+finished span is also logged as one JSON line carrying its parent span and a per-request trace id.
+
+Disabled (`METRICS_ENABLED=0`, the default), `span` returns a shared no-op context manager and `timed`
+calls straight through after one flag check, so instrumented code pays next to nothing.
+
+The registry lives in one process. Pre-forked workers call `share` with a directory they have in common: each
+then writes its metrics to a file there, and `render` exports the sum of all of them, so a scrape answered by
+any worker covers the requests of every worker.
+"""
+import bisect
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+LOG_SPANS = os.getenv("METRICS_LOG_SPANS", "0") == "1"
+# Directory shared by the workers of `http_service`; a fresh temporary one when unset.
+MULTIPROCESS_DIR = os.getenv("METRICS_MULTIPROCESS_DIR")
+# Seconds between writes of a worker's metrics to its file, how far behind the other workers a scrape may be.
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 1))
+METRIC_PREFIX = "book_recommender"
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger("instrumentation")
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with a count and a sum, like a Prometheus histogram."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            self.errors += error
+
+    def quantile(self, q):
+        """Estimates the `q` quantile as the upper bound of the bucket it falls in."""
+        with self.lock:
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= rank and seen:
+                    return bound
+        return float("inf") if self.count else 0.0
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": 1000 * self.sum / self.count if self.count else 0.0,
+            "p50_ms": 1000 * self.quantile(0.5),
+            "p99_ms": 1000 * self.quantile(0.99),
+        }
+
+
+class _Span:
+    __slots__ = ("registry", "name", "start", "parent", "trace")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        stack = self.registry.stack()
+        self.parent = stack[-1] if stack else None
+        self.trace = self.parent.trace if self.parent else uuid.uuid4().hex[:16]
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        self.registry.stack().pop()
+        self.registry.observe(self.name, seconds, error=exc_type is not None)
+        if self.registry.log_spans:
+            logger.info(json.dumps({
+                "span": self.name,
+                "ms": round(seconds * 1000, 3),
+                "parent": self.parent.name if self.parent else None,
+                "trace": self.trace,
+                "error": exc_type.__name__ if exc_type else None,
+            }))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Registry:
+    """
+    Histograms of span latencies and plain counters.
+
+    Attributes:
+        enabled (bool): Record spans and counters; when False they are no-ops.
+        log_spans (bool): Log every finished span as a JSON line.
+        histograms (dict): Span name to `Histogram`.
+        counters (dict): Counter name to value.
+    """
+
+    def __init__(self, enabled=ENABLED, log_spans=LOG_SPANS):
+        self.enabled = enabled
+        self.log_spans = log_spans
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def span(self, name):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name)
+
+    def observe(self, name, seconds, error=False):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        histogram.observe(seconds, error)
+
+    def inc(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def state(self):
+        """Returns the bucket counts, sum and errors of every histogram and the counters, JSON serializable."""
+        histograms = {}
+        for name, histogram in list(self.histograms.items()):
+            with histogram.lock:
+                histograms[name] = {"counts": list(histogram.counts), "count": histogram.count,
+                                    "sum": histogram.sum, "errors": histogram.errors}
+        with self.lock:
+            counters = dict(self.counters)
+        return {"histograms": histograms, "counters": counters}
+
+    def snapshot(self):
+        """Returns the counters and a summary of every histogram as plain dicts."""
+        return {
+            "spans": {name: histogram.as_dict() for name, histogram in sorted(self.histograms.items())},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def render(self, gauges=None):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Args:
+            gauges (dict, optional): Extra `{name: value}` gauges to export, e.g. cache statistics.
+
+        Returns:
+            str: The exposition text.
+        """
+        return render_state(self.state(), gauges)
+
+
+def _metric_name(name):
+    return "".join(char if char.isalnum() else "_" for char in name)
+
+
+def merge_states(states):
+    """Adds up `Registry.state` dicts, e.g. of several processes, into one."""
+    merged = {"histograms": {}, "counters": {}}
+    for state in states:
+        for name, histogram in state["histograms"].items():
+            total = merged["histograms"].get(name)
+            if total is None:
+                merged["histograms"][name] = dict(histogram, counts=list(histogram["counts"]))
+                continue
+            total["counts"] = [a + b for a, b in zip(total["counts"], histogram["counts"])]
+            for key in ("count", "sum", "errors"):
+                total[key] += histogram[key]
+        for name, value in state["counters"].items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+    return merged
+
+
+def render_state(state, gauges=None, worker_gauges=None):
+    """
+    Renders a `Registry.state` dict in the Prometheus text exposition format.
+
+    Args:
+        state (dict): Histograms and counters, see `Registry.state`.
+        gauges (dict, optional): Extra `{name: value}` gauges to export, e.g. cache statistics.
+        worker_gauges (dict, optional): `{worker: {name: value}}` gauges of several processes, exported with a
+                                        `worker` label since values like hit rates or percentiles do not add up.
+
+    Returns:
+        str: The exposition text.
+    """
+    histograms = sorted(state["histograms"].items())
+    lines = [
+        f"# TYPE {METRIC_PREFIX}_span_seconds histogram",
+    ]
+    for name, histogram in histograms:
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, histogram["counts"]):
+            cumulative += bucket_count
+            lines.append(f'{METRIC_PREFIX}_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_PREFIX}_span_seconds_bucket{{span="{name}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {histogram["sum"]}')
+        lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {histogram["count"]}')
+    lines.append(f"# TYPE {METRIC_PREFIX}_span_errors_total counter")
+    for name, histogram in histograms:
+        lines.append(f'{METRIC_PREFIX}_span_errors_total{{span="{name}"}} {histogram["errors"]}')
+    for name, value in sorted(state["counters"].items()):
+        metric = f"{METRIC_PREFIX}_{_metric_name(name)}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, value in sorted((gauges or {}).items()):
+        metric = f"{METRIC_PREFIX}_{_metric_name(name)}"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    by_name = {}
+    for worker, values in sorted((worker_gauges or {}).items()):
+        for name, value in values.items():
+            by_name.setdefault(name, []).append((worker, value))
+    for name, values in sorted(by_name.items()):
+        metric = f"{METRIC_PREFIX}_{_metric_name(name)}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines += [f'{metric}{{worker="{worker}"}} {value}' for worker, value in values]
+    return "\n".join(lines) + "\n"
+
+
+class SharedMetrics:
+    """
+    Metrics of several worker processes, exchanged through files in a common directory.
+
+    Every worker writes the state of its registry, and its gauges, to `<directory>/<pid>.json` every
+    `interval` seconds and whenever it renders. `render` adds up the histograms and counters of all the files,
+    so the other workers' numbers are at most `interval` seconds old. Files of exited workers are kept, so the
+    counters never go down while the service runs.
+
+    Attributes:
+        directory (str): The common directory.
+        registry (Registry): This process's registry.
+        gauges (callable): Returns this process's `{name: value}` gauges, or None.
+        interval (float): Seconds between writes.
+    """
+
+    def __init__(self, directory, registry, gauges=None, interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.registry = registry
+        self.gauges = gauges
+        self.interval = interval
+        self.path = os.path.join(directory, f"{os.getpid()}.json")
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.flush()
+        self.thread = threading.Thread(target=self._flush_loop, name="flush-metrics", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Writing metrics to %s failed: %s", self.path, e)
+
+    def flush(self, gauges=None):
+        """Writes this process's metrics to its file, atomically."""
+        state = self.registry.state()
+        if gauges is None:
+            gauges = self.gauges() if self.gauges is not None else {}
+        state["gauges"] = gauges
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def render(self, gauges=None):
+        """Renders the metrics of all workers, see `render_state`."""
+        self.flush(gauges)
+        states = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    states[os.path.basename(path)[:-len(".json")]] = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping metrics file %s: %s", path, e)
+        return render_state(merge_states(states.values()),
+                            worker_gauges={worker: state.get("gauges", {}) for worker, state in states.items()})
+
+
+registry = Registry()
+# Set by `share` in pre-forked workers.
+shared = None
+
+
+def span(name):
+    """Times the enclosed block as the span `name` of the default registry."""
+    return registry.span(name)
+
+
+def inc(name, amount=1):
+    registry.inc(name, amount)
+
+
+def timed(name):
+    """Decorator timing every call of the function as the span `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            with registry.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def share(directory, gauges=None, interval=FLUSH_INTERVAL):
+    """
+    Exports the metrics of all processes sharing `directory` from `render`, see `SharedMetrics`.
+
+    Call it in every worker after forking. Forked workers should `reset` the registry first, so what it
+    recorded before the fork is counted once, by the parent, and not once per worker.
+
+    Args:
+        directory (str): Directory common to the workers, holding nothing else.
+        gauges (callable, optional): Returns this process's `{name: value}` gauges.
+        interval (float, optional): Seconds between writes of this process's metrics.
+
+    Returns:
+        SharedMetrics: The started exporter.
+    """
+    global shared
+    if shared is not None:
+        shared.stop()
+    shared = SharedMetrics(directory, registry, gauges, interval).start()
+    return shared
+
+
+def render(gauges=None):
+    """Renders the default registry, or the metrics of every worker once `share` was called."""
+    if shared is not None:
+        return shared.render(gauges)
+    return registry.render(gauges)
+
+
+def configure(enabled=True, log_spans=None):
+    """Turns recording (and optionally span logging) on or off at runtime."""
+    registry.enabled = enabled
+    if log_spans is not None:
+        registry.log_spans = log_spans
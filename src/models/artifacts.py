@@ -0,0 +1,221 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.models.catalog import CatalogLookup
+from src.models.locks import ReadWriteLock
+from src.models.user_vectors import UserVectorCache
+
+# Bump whenever the on-disk layout of a bundle changes so stale bundles are rebuilt.
+BUNDLE_FORMAT_VERSION = 2
+DEFAULT_ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+CATALOG_COLUMNS = ["isbn", "title", "authors", "description", "new_image_url"]
+
+MANIFEST_FILE = "manifest.json"
+COLLAB_INDEX_FILE = "collab.faiss"
+CONTENT_INDEX_FILE = "content.faiss"
+COLLAB_DOCSTORE_FILE = "collab_docstore.pkl"
+CONTENT_DOCSTORE_FILE = "content_docstore.pkl"
+BOOKS_DATA_FILE = "books_data.pkl"
+CATALOG_FILE = "catalog.pkl"
+USERS_TRAIN_FILE = "users_train.npy"
+USERS_VAL_FILE = "users_val.npy"
+
+
+class ModelBundle:
+    """
+    Everything the serving path needs to answer recommendation requests without retraining.
+
+    Attributes:
+        collab_vector_store (FAISS): Vector store over user reading histories.
+        content_vector_store (FAISS): Vector store over book descriptions.
+        books_data (dict): Mapping of user id to the concatenated history text of that user.
+        catalog (CatalogLookup): Book metadata (isbn, title, authors, description, image url) by ISBN or title.
+        users_train (list): User ids indexed in the collaborative store.
+        users_val (list): User ids held out for validation.
+        user_vectors (UserVectorCache): Precomputed history embedding of every train and validation user.
+        data_hash (str): Hash of the input collections the bundle was built from.
+        path (str): Directory the bundle lives in, or None if it was never saved.
+        lock (ReadWriteLock): Held for reading while serving and for writing while applying incremental updates.
+    """
+
+    def __init__(self, collab_vector_store, content_vector_store, books_data, catalog, users_train, users_val,
+                 user_vectors, data_hash, path=None):
+        self.collab_vector_store = collab_vector_store
+        self.content_vector_store = content_vector_store
+        self.books_data = books_data
+        self.catalog = catalog if isinstance(catalog, CatalogLookup) else CatalogLookup(catalog)
+        self.users_train = list(users_train)
+        self.users_val = list(users_val)
+        self.user_vectors = user_vectors
+        self.data_hash = data_hash
+        self.path = path
+        self.lock = ReadWriteLock()
+
+
+def compute_data_hash(*frames):
+    """
+    Computes a stable content hash of the input collections.
+
+    Args:
+        *frames (DataFrame): The collections the model is built from, e.g. `all_books` and `books_data`.
+
+    Returns:
+        str: Hex digest that changes whenever any row, column or value of the inputs changes.
+    """
+    digest = hashlib.sha256()
+    for frame in frames:
+        digest.update(",".join(map(str, frame.columns)).encode("utf-8"))
+        digest.update(str(len(frame)).encode("utf-8"))
+        digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def bundle_path(data_hash, artifact_dir=DEFAULT_ARTIFACT_DIR, model_key=None):
+    """Returns the directory a bundle for `data_hash` (and model configuration) is stored in."""
+    key = hashlib.sha256(f"{BUNDLE_FORMAT_VERSION}:{model_key}:{data_hash}".encode("utf-8")).hexdigest()
+    return os.path.join(artifact_dir, f"v{BUNDLE_FORMAT_VERSION}-{key[:16]}")
+
+
+def save_bundle(bundle, artifact_dir=DEFAULT_ARTIFACT_DIR, model_key=None):
+    """
+    Writes a bundle to disk atomically.
+
+    The bundle is first written to a temporary sibling directory and renamed into place, so a crash
+    mid-write never leaves a half written bundle that later passes validation.
+
+    Args:
+        bundle (ModelBundle): The bundle to persist.
+        artifact_dir (str): Root directory holding all bundles.
+        model_key (str, optional): Embedding model and index configuration, recorded in the manifest and the
+                                   bundle key.
+
+    Returns:
+        str: The directory the bundle was written to.
+    """
+    import faiss
+
+    path = bundle_path(bundle.data_hash, artifact_dir, model_key)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    faiss.write_index(bundle.collab_vector_store.index, os.path.join(tmp_path, COLLAB_INDEX_FILE))
+    faiss.write_index(bundle.content_vector_store.index, os.path.join(tmp_path, CONTENT_INDEX_FILE))
+    for store, name in ((bundle.collab_vector_store, COLLAB_DOCSTORE_FILE),
+                        (bundle.content_vector_store, CONTENT_DOCSTORE_FILE)):
+        with open(os.path.join(tmp_path, name), "wb") as f:
+            pickle.dump((store.docstore, store.index_to_docstore_id), f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(tmp_path, BOOKS_DATA_FILE), "wb") as f:
+        pickle.dump(bundle.books_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    bundle.catalog.table().to_pickle(os.path.join(tmp_path, CATALOG_FILE))
+    np.save(os.path.join(tmp_path, USERS_TRAIN_FILE), np.asarray(bundle.users_train))
+    np.save(os.path.join(tmp_path, USERS_VAL_FILE), np.asarray(bundle.users_val))
+    bundle.user_vectors.save(tmp_path)
+
+    # The manifest is written last: its presence marks the bundle as complete.
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "data_hash": bundle.data_hash,
+        "model_key": model_key,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    bundle.path = path
+    logging.info("Saved model bundle to %s", path)
+    return path
+
+
+def read_manifest(path):
+    """Returns the manifest of the bundle at `path`, or None if the bundle is missing or incomplete."""
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_bundle_valid(path, data_hash, model_key=None):
+    """Checks that the bundle at `path` is complete and was built from the same data and model configuration."""
+    manifest = read_manifest(path)
+    return (manifest is not None
+            and manifest.get("format_version") == BUNDLE_FORMAT_VERSION
+            and manifest.get("data_hash") == data_hash
+            and manifest.get("model_key") == model_key)
+
+
+def read_index(path, mmap=True):
+    """
+    Reads a FAISS index, memory-mapping its vectors when the FAISS build supports it.
+
+    A memory-mapped index is read-only and its pages are shared between processes loading the same file.
+    """
+    import faiss
+
+    if mmap:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, flag)
+        except RuntimeError:
+            logging.warning("Memory-mapping %s is not supported for this index type, reading it into memory", path)
+    return faiss.read_index(path)
+
+
+def load_bundle(path, embeddings, mmap=True):
+    """
+    Loads a bundle previously written by `save_bundle`.
+
+    Args:
+        path (str): Bundle directory.
+        embeddings (Embeddings): Embedding function attached to both vector stores for query embedding.
+        mmap (bool, optional): Memory-map the FAISS indexes and user vectors instead of reading them into memory.
+                               Defaults to `True`.
+
+    Returns:
+        ModelBundle: The loaded bundle.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No complete model bundle at {path}")
+
+    stores = []
+    for index_file, docstore_file in ((COLLAB_INDEX_FILE, COLLAB_DOCSTORE_FILE),
+                                      (CONTENT_INDEX_FILE, CONTENT_DOCSTORE_FILE)):
+        index = read_index(os.path.join(path, index_file), mmap=mmap)
+        with open(os.path.join(path, docstore_file), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        stores.append(FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+        ))
+
+    with open(os.path.join(path, BOOKS_DATA_FILE), "rb") as f:
+        books_data = pickle.load(f)
+    catalog = pd.read_pickle(os.path.join(path, CATALOG_FILE))
+    users_train = np.load(os.path.join(path, USERS_TRAIN_FILE)).tolist()
+    users_val = np.load(os.path.join(path, USERS_VAL_FILE)).tolist()
+    user_vectors = UserVectorCache.load(path, mmap=mmap)
+
+    return ModelBundle(stores[0], stores[1], books_data, catalog, users_train, users_val, user_vectors,
+                       manifest["data_hash"], path=path)
+
+
+def catalog_table(df):
+    """Returns the subset of the book catalog needed at serving time, with a clean positional index."""
+    columns = [column for column in CATALOG_COLUMNS if column in df.columns]
+    return df[columns].reset_index(drop=True)
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+RESULT_COLUMNS = ["query", "rank", "isbn", "title", "image_url", "score"]
+
+
+def _query_matrix(store, texts):
+    embeddings = store.embedding_function
+    if hasattr(embeddings, "encode"):
+        return embeddings.encode(texts)
+    return np.asarray(embeddings.embed_documents(list(texts)), dtype=np.float32)
+
+
+def _docstore_ids(store, found):
+    """Maps index positions returned by a search to docstore ids (None for empty result slots)."""
+    return [store.index_to_docstore_id[pos] if pos >= 0 else None for pos in found.ravel().tolist()]
+
+
+def rank_items(query_of, items, num_items, n, exclude_of=None, exclude_items=None, skip=0):
+    """
+    Counts item votes per query and keeps the `n` best items of every query.
+
+    Items are ranked by vote count, ties keeping the order in which they were first seen, which matches the
+    dict-and-stable-sort ranking of the single item recommenders.
+
+    Args:
+        query_of (ndarray): Query index of every vote.
+        items (ndarray): Catalog position of every vote, in the order the votes were seen.
+        num_items (int): Size of the catalog.
+        n (int): Items kept per query.
+        exclude_of, exclude_items (ndarray, optional): `(query, item)` pairs that must not be recommended.
+        skip (int, optional): Number of top ranked items dropped per query before keeping `n`. Defaults to 0.
+
+    Returns:
+        tuple: `(query, item, score, rank)` arrays sorted by query then rank.
+    """
+    keys = query_of.astype(np.int64) * num_items + items
+    if exclude_of is not None and len(exclude_of):
+        keys = keys[~np.isin(keys, exclude_of.astype(np.int64) * num_items + exclude_items)]
+
+    unique_keys, first_seen, counts = np.unique(keys, return_index=True, return_counts=True)
+    query = unique_keys // num_items
+    order = np.lexsort((first_seen, -counts, query))
+    query, item, score = query[order], (unique_keys % num_items)[order], counts[order]
+
+    group_start = np.searchsorted(query, query, side="left")
+    rank = np.arange(len(query)) - group_start - skip
+    keep = (rank >= 0) & (rank < n)
+    return query[keep], item[keep], score[keep], rank[keep]
+
+
+def _result_frame(queries, query, item, score, rank, catalog):
+    return pd.DataFrame({
+        "query": np.asarray(queries, dtype=object)[query],
+        "rank": rank,
+        "isbn": catalog.isbns[item],
+        "title": catalog.titles[item],
+        "image_url": catalog.image_urls[item],
+        "score": score,
+    }, columns=RESULT_COLUMNS)
+
+
+def recommend_books_collab_batch(ids, collab_vector_store, interactions, catalog, user_vectors, books_data=None,
+                                 k=3, n=5):
+    """
+    Collaborative recommendations for many users with a single FAISS search.
+
+    Equivalent to calling `recommend_book_collab` for every id: the `k` most similar indexed users vote for
+    the books they read, books the query user already read are dropped, and the `n` most voted books are kept.
+
+    Args:
+        ids (Sequence[int]): User ids.
+        collab_vector_store (FAISS): Vector store over train user histories.
+        interactions (InteractionSets): Books read by every user.
+        catalog (CatalogLookup): Book metadata.
+        user_vectors (UserVectorCache): Precomputed user vectors.
+        books_data (dict, optional): History texts, embedded for users missing from `user_vectors`.
+        k (int, optional): Neighbouring users per query. Defaults to 3.
+        n (int, optional): Books recommended per user. Defaults to 5.
+
+    Returns:
+        DataFrame: One row per recommendation with the `RESULT_COLUMNS` columns, `query` holding the user id.
+
+    Raises:
+        KeyError: If a user is neither in `user_vectors` nor in `books_data`.
+    """
+    ids = [int(user_id) for user_id in ids]
+    known = np.fromiter((user_id in user_vectors for user_id in ids), dtype=bool, count=len(ids))
+    queries = np.empty((len(ids), collab_vector_store.index.d), dtype=np.float32)
+    if known.any():
+        queries[known] = user_vectors.vectors_for([user_id for user_id, ok in zip(ids, known) if ok])
+    if not known.all():
+        texts = [books_data[user_id] for user_id, ok in zip(ids, known) if not ok]
+        queries[~known] = _query_matrix(collab_vector_store, texts)
+
+    _, found = collab_vector_store.index.search(queries, k)
+    neighbours = [int(doc_id) if doc_id is not None else None for doc_id in _docstore_ids(collab_vector_store, found)]
+    owner, items = interactions.gather(interactions.rows_for(neighbours))
+    read_of, read_items = interactions.gather(interactions.rows_for(ids))
+
+    result = rank_items(owner // k, items, len(catalog), n, exclude_of=read_of, exclude_items=read_items)
+    return _result_frame(ids, *result, catalog)
+
+
+def recommend_books_item_cf_batch(ids, item_cf, catalog, n=5):
+    """
+    Collaborative recommendations for many users from the item-item engine, with one sparse product.
+
+    Args:
+        ids (Sequence[int]): User ids.
+        item_cf (ItemCF): The fitted item-item model, see `src.models.item_cf`.
+        catalog (CatalogLookup): Book metadata.
+        n (int, optional): Books recommended per user. Defaults to 5.
+
+    Returns:
+        DataFrame: One row per recommendation with the `RESULT_COLUMNS` columns, `query` holding the user id.
+                   Users without ratings get no rows.
+    """
+    ids = [int(user_id) for user_id in ids]
+    return _result_frame(ids, *item_cf.recommend(ids, n), catalog)
+
+
+def recommend_books_content_batch(titles, content_vector_store, catalog, k=10, n=5):
+    """
+    Content based recommendations for many titles with a single embedding pass and a single FAISS search.
+
+    Equivalent to calling `recommend_book_content` for every title: the description and title of the book
+    are embedded, the `k` nearest books are retrieved, the best match (the book itself) is dropped and the
+    next `n` are kept. Titles missing from the catalog get no rows.
+
+    Args:
+        titles (Sequence[str]): Book titles.
+        content_vector_store (FAISS): Vector store over book descriptions.
+        catalog (CatalogLookup): Book metadata.
+        k (int, optional): Neighbouring books retrieved per title. Defaults to 10.
+        n (int, optional): Books recommended per title. Defaults to 5.
+
+    Returns:
+        DataFrame: One row per recommendation with the `RESULT_COLUMNS` columns, `query` holding the title.
+    """
+    titles = [str(title) for title in titles]
+    positions = np.fromiter((catalog.title_to_pos.get(title, -1) for title in titles), dtype=np.int64,
+                            count=len(titles))
+    found_titles = np.flatnonzero(positions >= 0)
+    if len(found_titles) == 0:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    texts = catalog.descriptions[positions[found_titles]] + " " + catalog.titles[positions[found_titles]]
+
+    _, found = content_vector_store.index.search(_query_matrix(content_vector_store, texts.tolist()), k)
+    doc_ids = _docstore_ids(content_vector_store, found)
+    items = np.fromiter((catalog.isbn_to_pos.get(doc_id, -1) for doc_id in doc_ids), dtype=np.int64,
+                        count=len(doc_ids))
+    query_of = found_titles[np.arange(len(items)) // k]
+    valid = items >= 0
+
+    result = rank_items(query_of[valid], items[valid], len(catalog), n, skip=1)
+    return _result_frame(titles, *result, catalog)
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+
+def _as_text(column):
+    # Same rendering as `.astype(str)` on a single value, missing values become 'nan'.
+    return column.astype(str).fillna("nan").to_numpy(dtype=object)
+
+
+def _first_positions(keys):
+    positions = {}
+    for pos, key in enumerate(keys):
+        positions.setdefault(key, pos)
+    return positions
+
+
+class CatalogLookup:
+    """
+    Constant time access to book metadata by ISBN or title.
+
+    Built once when the model is loaded so the serving path never scans the catalog DataFrame. When an
+    ISBN or title occurs more than once, the first row wins, like the `df[df['isbn'] == isbn].values[0]`
+    lookups this replaces.
+
+    Attributes:
+        frame (DataFrame): The catalog table the lookup was built from.
+        isbns, titles, authors, descriptions, image_urls (ndarray): Column arrays indexed by row position.
+        isbn_to_pos (dict): ISBN to row position.
+        title_to_pos (dict): Title (as a string) to row position.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame.reset_index(drop=True)
+        num_rows = len(self.frame)
+
+        def column(name):
+            if name not in self.frame.columns:
+                return np.full(num_rows, "nan", dtype=object)
+            return _as_text(self.frame[name])
+
+        self.isbns = self.frame["isbn"].to_numpy(dtype=object)
+        self.titles = column("title")
+        self.authors = column("authors")
+        self.descriptions = column("description")
+        self.image_urls = column("new_image_url")
+        self.isbn_to_pos = _first_positions(self.isbns)
+        self.title_to_pos = _first_positions(self.titles)
+
+    def __len__(self):
+        return len(self.isbns)
+
+    def __contains__(self, isbn):
+        return isbn in self.isbn_to_pos
+
+    def position(self, isbn):
+        """Returns the row position of `isbn`. Raises `KeyError` for unknown ISBNs."""
+        return self.isbn_to_pos[isbn]
+
+    def positions(self, isbns):
+        """Returns the row positions of `isbns` as an int64 array."""
+        return np.fromiter((self.isbn_to_pos[isbn] for isbn in isbns), dtype=np.int64, count=len(isbns))
+
+    def title_position(self, title):
+        """Returns the row position of the book titled `title`. Raises `KeyError` for unknown titles."""
+        return self.title_to_pos[str(title)]
+
+    def description_for_title(self, title):
+        return self.descriptions[self.title_position(title)]
+
+    def titles_for(self, isbns):
+        return self.titles[self.positions(isbns)].tolist()
+
+    def image_urls_for(self, isbns):
+        return self.image_urls[self.positions(isbns)].tolist()
+
+    def info_for(self, isbns):
+        """Returns the details shown for each recommended book, keyed by its rank in `isbns`."""
+        positions = self.positions(isbns)
+        return {
+            k: {
+                "Title": self.titles[pos],
+                "Author": self.authors[pos],
+                "Description": self.descriptions[pos],
+            }
+            for k, pos in enumerate(positions.tolist())
+        }
+
+    def table(self):
+        """Returns the catalog rows currently in use, without rows removed by `remove`."""
+        live = np.zeros(len(self.isbns), dtype=bool)
+        live[list(self.isbn_to_pos.values())] = True
+        return self.frame[live].reset_index(drop=True)
+
+    def upsert(self, frame):
+        """
+        Adds new books and replaces changed ones in place.
+
+        A changed book keeps its row position and new books are appended, so row positions held elsewhere
+        (e.g. by `InteractionSets` or the item-item model) stay valid and keep pointing at the same book.
+
+        Args:
+            frame (DataFrame): Catalog rows, one per ISBN.
+        """
+        added = CatalogLookup(frame.reindex(columns=self.frame.columns))
+        positions = np.fromiter((self.isbn_to_pos.get(isbn, -1) for isbn in added.isbns), dtype=np.int64,
+                                count=len(added.isbns))
+        changed = np.flatnonzero(positions >= 0)
+        new = np.flatnonzero(positions < 0)
+
+        if len(changed):
+            targets = positions[changed]
+            for pos in targets.tolist():
+                if self.title_to_pos.get(self.titles[pos]) == pos:
+                    del self.title_to_pos[self.titles[pos]]
+            for name in ("titles", "authors", "descriptions", "image_urls"):
+                getattr(self, name)[targets] = getattr(added, name)[changed]
+            for column in range(len(self.frame.columns)):
+                self.frame.iloc[targets, column] = added.frame.iloc[changed, column].to_numpy()
+            for pos in targets.tolist():
+                self.title_to_pos.setdefault(self.titles[pos], pos)
+
+        if len(new):
+            start = len(self.isbns)
+            appended = added.frame.iloc[new].reset_index(drop=True)
+            self.frame = pd.concat([self.frame, appended], ignore_index=True)
+            for name in ("isbns", "titles", "authors", "descriptions", "image_urls"):
+                setattr(self, name, np.concatenate([getattr(self, name), getattr(added, name)[new]]))
+            for pos in range(start, start + len(new)):
+                self.isbn_to_pos[self.isbns[pos]] = pos
+                self.title_to_pos.setdefault(self.titles[pos], pos)
+
+    def remove(self, isbns):
+        """Forgets the books with the given ISBNs. Unknown ISBNs are ignored."""
+        for isbn in isbns:
+            pos = self.isbn_to_pos.pop(isbn, None)
+            if pos is not None and self.title_to_pos.get(self.titles[pos]) == pos:
+                del self.title_to_pos[self.titles[pos]]
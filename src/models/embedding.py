@@ -0,0 +1,84 @@
+import logging
+import os
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+DEFAULT_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+
+
+class BatchEmbedder(Embeddings):
+    """
+    Embeds whole text columns into float32 matrices with a sentence-transformers model.
+
+    Texts are processed longest first in fixed size batches so each batch holds texts of similar length,
+    which keeps tokenizer padding (and wasted transformer compute) to a minimum. The output is a single
+    preallocated matrix in the original order, ready to be added to a FAISS index as is.
+
+    The class also implements the LangChain `Embeddings` interface, so the same loaded model embeds
+    queries for the vector stores.
+
+    Attributes:
+        model_name (str): Name of the sentence-transformers model.
+        batch_size (int): Number of texts encoded per forward pass.
+        normalize (bool): L2-normalize the vectors so inner product equals cosine similarity.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, batch_size=DEFAULT_BATCH_SIZE, normalize=True, device=None):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.model = SentenceTransformer(model_name, device=device)
+
+    @property
+    def dimension(self):
+        """int: Size of the vectors produced by the model."""
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size=None):
+        """
+        Embeds a column of texts.
+
+        Args:
+            texts (Sequence[str] or ndarray): The texts to embed, e.g. a DataFrame column.
+            batch_size (int, optional): Overrides the embedder's batch size for this call.
+
+        Returns:
+            ndarray: A `(len(texts), dimension)` float32 matrix, row `i` holding the vector of `texts[i]`.
+        """
+        batch_size = batch_size or self.batch_size
+        texts = np.asarray(texts, dtype=object)
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if len(texts) == 0:
+            return vectors
+
+        lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+        order = np.argsort(-lengths, kind="stable")
+
+        start_time = time.perf_counter()
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            vectors[batch] = self.model.encode(
+                texts[batch].tolist(),
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=self.normalize,
+                show_progress_bar=False,
+            )
+        elapsed = time.perf_counter() - start_time
+
+        logging.info("Embedded %d texts in %.2fs (%.1f docs/sec, batch size %d)",
+                     len(texts), elapsed, len(texts) / max(elapsed, 1e-9), batch_size)
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        vector = self.model.encode([text], convert_to_numpy=True, normalize_embeddings=self.normalize,
+                                   show_progress_bar=False)
+        return vector[0].tolist()
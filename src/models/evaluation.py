@@ -0,0 +1,238 @@
+"""
+Offline evaluation of the collaborative recommender on the validation users.
+
+Part of every validation user's interactions is held out. The rest is embedded as the user's history, run
+through the collaborative index like `batch_recommend.recommend_books_collab_batch`, and the recommended
+books are scored against the held-out ones. Validation users are not in the index, so no user is its own
+neighbour. Searches run in shards across a process pool, metrics are computed over all users at once with
+NumPy, and the report carries the wall-clock time of every stage next to the quality numbers, so index and
+engine changes can be compared on both:
+
+    python -m src.models.evaluation --collab-index flat ivf_pq --n 5 10
+    python -m src.models.evaluation --collab-engine vector item_cf
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import faiss
+
+from src.dbutils import dbwrapper
+from src.models import (artifacts, batch_recommend, history_builder, incremental, index_factory, item_cf,
+                        jaykishan_model_building)
+from src.models.interactions import InteractionSets
+
+HOLDOUT_FRACTION = float(os.getenv("EVAL_HOLDOUT_FRACTION", 0.2))
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", os.cpu_count() or 1))
+# Queries searched per task sent to the pool.
+SHARD_SIZE = 10000
+
+_worker = {}
+
+
+def holdout_split(interactions, fraction=HOLDOUT_FRACTION, seed=0):
+    """
+    Splits the interactions of every user into a query part and a held-out part.
+
+    A random `fraction` of every user's rows (rounded down) is held out; users with fewer rows than it takes
+    to hold one out while keeping one are left out of both parts.
+
+    Args:
+        interactions (DataFrame): `books_data`-style rows of the users to evaluate.
+        fraction (float, optional): Share of each user's rows held out.
+        seed (int, optional): Seed of the random split.
+
+    Returns:
+        tuple: `(query_df, heldout_df)`.
+    """
+    rng = np.random.default_rng(seed)
+    users = interactions["user_id"]
+    order = pd.Series(rng.random(len(interactions)), index=interactions.index).groupby(users).rank(method="first")
+    held_count = np.floor(fraction * users.map(users.value_counts()))
+    held = order <= held_count
+    usable = users.map(held.groupby(users).sum() > 0) & users.map((~held).groupby(users).sum() > 0)
+    return interactions[usable & ~held], interactions[usable & held]
+
+
+def ranking_metrics(rec_of, rec_items, rec_rank, truth_of, truth_items, num_queries, n, num_items):
+    """
+    Scores top-`n` recommendations against held-out items, vectorized over all queries.
+
+    Args:
+        rec_of, rec_items, rec_rank (ndarray): Query, catalog position and 0-based rank of every recommendation.
+        truth_of, truth_items (ndarray): Query and catalog position of every held-out item.
+        num_queries (int): Number of queries; queries without held-out items are not scored.
+        n (int): Recommendations per query.
+        num_items (int): Catalog size, the denominator of the coverage.
+
+    Returns:
+        dict: Mean `precision`, `recall`, `ndcg` and `hit_rate` at `n` over the scored queries, and the
+              `coverage`, the share of the catalog recommended to anyone.
+    """
+    truth_count = np.bincount(truth_of, minlength=num_queries)
+    scored = truth_count > 0
+    if not scored.any():
+        return {"precision": 0.0, "recall": 0.0, "ndcg": 0.0, "hit_rate": 0.0, "coverage": 0.0}
+
+    hit = np.isin(rec_of.astype(np.int64) * num_items + rec_items, truth_of.astype(np.int64) * num_items + truth_items)
+    hits = np.bincount(rec_of[hit], minlength=num_queries)
+    gain = np.bincount(rec_of[hit], weights=1 / np.log2(rec_rank[hit] + 2), minlength=num_queries)
+    ideal = np.cumsum(1 / np.log2(np.arange(n) + 2))[np.minimum(truth_count[scored], n) - 1]
+    return {
+        "precision": float(np.mean(hits[scored] / n)),
+        "recall": float(np.mean(hits[scored] / truth_count[scored])),
+        "ndcg": float(np.mean(gain[scored] / ideal)),
+        "hit_rate": float(np.mean(hits[scored] > 0)),
+        "coverage": float(len(np.unique(rec_items)) / num_items),
+    }
+
+
+def _init_worker(index_source, index_to_docstore_id, neighbour_sets, num_items):
+    if isinstance(index_source, str):
+        _worker["index"] = artifacts.read_index(index_source)
+    else:
+        _worker["index"] = faiss.deserialize_index(index_source)
+    _worker["index_to_docstore_id"] = index_to_docstore_id
+    _worker["neighbour_sets"] = neighbour_sets
+    _worker["num_items"] = num_items
+
+
+def _recommend_shard(queries, exclude_of, exclude_items, k, n):
+    _, found = _worker["index"].search(queries, k)
+    ids = _worker["index_to_docstore_id"]
+    neighbours = [int(ids[pos]) if pos >= 0 else None for pos in found.ravel().tolist()]
+    owner, items = _worker["neighbour_sets"].gather(_worker["neighbour_sets"].rows_for(neighbours))
+    query, item, _, rank = batch_recommend.rank_items(owner // k, items, _worker["num_items"], n,
+                                                      exclude_of=exclude_of, exclude_items=exclude_items)
+    return query, item, rank
+
+
+def evaluate(bundle, user_book_df, users=None, n=5, k=3, fraction=HOLDOUT_FRACTION, seed=0, workers=EVAL_WORKERS,
+             engine="vector"):
+    """
+    Evaluates the collaborative recommendations of a bundle on held-out interactions.
+
+    Args:
+        bundle (ModelBundle): The model to evaluate.
+        user_book_df (DataFrame): The user/book interactions (`books_data`).
+        users (list, optional): Users to evaluate. Defaults to the bundle's validation users.
+        n (int or list, optional): Recommendations per user; a list scores every cut-off from one search.
+        k (int, optional): Neighbouring users per query of the vector engine, as in `recommend_book_collab`.
+        fraction (float, optional): Share of each user's interactions held out, see `holdout_split`.
+        seed (int, optional): Seed of the split.
+        workers (int, optional): Processes searching the index. 1 searches in this process.
+        engine (str, optional): Collaborative engine, one of `item_cf.COLLAB_ENGINES`. "item_cf" fits the
+                                item-item model on the train users and the query part of the evaluated users.
+
+    Returns:
+        dict: `users` evaluated, the metrics of every `n` (see `ranking_metrics`) under `metrics`, and the
+              `seconds` spent splitting, embedding (or fitting), searching and scoring.
+    """
+    cutoffs = sorted(set(n if isinstance(n, (list, tuple)) else [n]))
+    timings = {}
+    start = time.perf_counter()
+    users = list(bundle.users_val if users is None else users)
+    catalog = bundle.catalog
+    query_df, heldout_df = holdout_split(user_book_df[user_book_df["user_id"].isin(users)], fraction, seed)
+    users = pd.unique(query_df["user_id"]).tolist()
+    timings["split"] = time.perf_counter() - start
+
+    if engine == "item_cf":
+        step = time.perf_counter()
+        indexed = user_book_df[user_book_df["user_id"].isin(bundle.users_train)]
+        model = item_cf.ItemCF.fit(pd.concat([indexed, query_df], ignore_index=True), catalog)
+        timings["fit"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        rec_of, rec_items, _, rec_rank = model.recommend(users, max(cutoffs))
+        timings["search"] = time.perf_counter() - step
+    else:
+        step = time.perf_counter()
+        histories, _ = history_builder.build_histories(query_df, users)
+        queries = batch_recommend._query_matrix(bundle.collab_vector_store,
+                                                [" ".join(history) for history in histories])
+        timings["embed"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        store = bundle.collab_vector_store
+        indexed = user_book_df[user_book_df["user_id"].isin(bundle.users_train)]
+        neighbour_sets = InteractionSets.from_frame(indexed, catalog)
+        query_sets = InteractionSets.from_frame(query_df, catalog)
+        read_of, read_items = query_sets.gather(query_sets.rows_for(users))
+        shards = [(begin, min(begin + SHARD_SIZE, len(users))) for begin in range(0, len(users), SHARD_SIZE)]
+
+        def shard_args(begin, end):
+            mask = (read_of >= begin) & (read_of < end)
+            return queries[begin:end], read_of[mask] - begin, read_items[mask], k, max(cutoffs)
+
+        if workers <= 1 or len(shards) == 1:
+            _worker.update(index=store.index, index_to_docstore_id=store.index_to_docstore_id,
+                           neighbour_sets=neighbour_sets, num_items=len(catalog))
+            results = [_recommend_shard(*shard_args(begin, end)) for begin, end in shards]
+        else:
+            # Workers memory-map the saved index when it is up to date, and get a copy of it otherwise.
+            saved = bundle.path is not None and incremental.DeltaLog(bundle.path).head() is None
+            index_source = os.path.join(bundle.path, artifacts.COLLAB_INDEX_FILE) if saved \
+                else faiss.serialize_index(store.index)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(index_source, store.index_to_docstore_id, neighbour_sets,
+                                               len(catalog))) as executor:
+                futures = [executor.submit(_recommend_shard, *shard_args(begin, end)) for begin, end in shards]
+                results = [future.result() for future in futures]
+        empty = np.empty(0, dtype=np.int64)
+        rec_of = np.concatenate([query + begin for (query, _, _), (begin, _) in zip(results, shards)] or [empty])
+        rec_items = np.concatenate([item for _, item, _ in results] or [empty])
+        rec_rank = np.concatenate([rank for _, _, rank in results] or [empty])
+        timings["search"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    truth_sets = InteractionSets.from_frame(heldout_df, catalog)
+    truth_of, truth_items = truth_sets.gather(truth_sets.rows_for(users))
+    metrics = {}
+    for cutoff in cutoffs:
+        top = rec_rank < cutoff
+        metrics[cutoff] = ranking_metrics(rec_of[top], rec_items[top], rec_rank[top], truth_of, truth_items,
+                                          len(users), cutoff, len(catalog.isbn_to_pos))
+    timings["score"] = time.perf_counter() - step
+    timings["total"] = time.perf_counter() - start
+
+    logging.info("Evaluated %d users in %.2fs: %s", len(users), timings["total"], metrics)
+    return {"users": len(users), "metrics": metrics, "seconds": timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collab-engine", nargs="+", default=["vector"], choices=item_cf.COLLAB_ENGINES,
+                        help="collaborative engines to compare")
+    parser.add_argument("--collab-index", nargs="+", default=[index_factory.DEFAULT_COLLAB_INDEX],
+                        choices=index_factory.INDEX_TYPES, help="index types to compare")
+    parser.add_argument("--n", type=int, nargs="+", default=[5], help="recommendations per user")
+    parser.add_argument("--k", type=int, default=3, help="neighbouring users per query")
+    parser.add_argument("--holdout", type=float, default=HOLDOUT_FRACTION)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=EVAL_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    user_book_df = dbwrapper.fetch_dataframe('books_data', jaykishan_model_building.INTERACTION_COLUMNS)
+    df = dbwrapper.fetch_dataframe('all_books', jaykishan_model_building.BOOK_COLUMNS)
+    report = {}
+    for index_type in args.collab_index:
+        bundle = jaykishan_model_building.load_or_build_model(df, user_book_df, collab_index=index_type)
+        if "vector" in args.collab_engine:
+            report[index_type] = evaluate(bundle, user_book_df, n=args.n, k=args.k, fraction=args.holdout,
+                                          seed=args.seed, workers=args.workers)
+    if "item_cf" in args.collab_engine:
+        # Same train/validation split as the bundle, so the engines are scored on the same users.
+        report["item_cf"] = evaluate(bundle, user_book_df, n=args.n, fraction=args.holdout, seed=args.seed,
+                                     engine="item_cf")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import numpy as np
+
+HISTORY_COLUMNS = ["isbn", "title", "description", "user_id", "rating"]
+
+
+def _as_text(column):
+    # Missing values render as 'nan' like `str(value)` did, whether or not pandas keeps them missing.
+    return column.astype(str).fillna("nan")
+
+
+def combined_text(frame):
+    """Builds the text of every interaction row as `user_id + description + title + rating`."""
+    return (_as_text(frame["user_id"]) + _as_text(frame["description"])
+            + _as_text(frame["title"]) + _as_text(frame["rating"]))
+
+
+def build_histories(frame, users):
+    """
+    Builds the reading history of every user in one pass over the interactions.
+
+    Rows are stably sorted by user once and split at the user boundaries, so the cost is linear in the
+    number of rows instead of one full scan of `frame` per user.
+
+    Args:
+        frame (DataFrame): Interactions with the `HISTORY_COLUMNS` columns, e.g. `train_df`.
+        users (list): User ids to build histories for, in the order the outputs should follow.
+
+    Returns:
+        tuple: `(histories, isbns)` where `histories[i]` is the list of combined texts and `isbns[i]` the list
+               of ISBNs read by `users[i]`, both in the original row order. Users without interactions get
+               empty lists.
+    """
+    user_ids = frame["user_id"].to_numpy()
+    order = np.argsort(user_ids, kind="stable")
+    unique_users, starts = np.unique(user_ids[order], return_index=True)
+
+    text_groups = np.split(combined_text(frame).to_numpy(dtype=object)[order], starts[1:])
+    isbn_groups = np.split(frame["isbn"].to_numpy(dtype=object)[order], starts[1:])
+    position = dict(zip(unique_users.tolist(), range(len(unique_users))))
+
+    histories = []
+    isbns = []
+    for user in users:
+        pos = position.get(user)
+        if pos is None:
+            histories.append([])
+            isbns.append([])
+        else:
+            histories.append(text_groups[pos].tolist())
+            isbns.append(isbn_groups[pos].tolist())
+    return histories, isbns
+
@@ -0,0 +1,453 @@
+"""
+Incremental updates of a model bundle: new, changed and removed books and users are embedded and applied to
+the FAISS indexes, the catalog lookup, the user vectors and `books_data` in place, without a full rebuild.
+
+Every applied change is appended, together with its vectors, to a delta log next to the bundle, so a restart
+loads the saved bundle and replays the log without embedding anything again. Once the log grows past a
+fraction of the bundle, the bundle is written out again under the new data hash and the log starts empty.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.models import artifacts, history_builder
+from src.preprocessing_data import jaykishan_randomize_data
+
+DELTA_LOG_FILE = "delta.log"
+DELTA_HEAD_FILE = "delta_head.json"
+# Rewrite the bundle once the logged rows exceed this fraction of the indexed rows.
+COMPACT_RATIO = float(os.getenv("DELTA_COMPACT_RATIO", 0.2))
+# `books_data` fields of the interactions logged with every user update.
+INTERACTION_LOG_COLUMNS = ["user_id", "isbn", "rating"]
+
+
+class DeltaLog:
+    """
+    Append-only log of the updates applied to a saved bundle.
+
+    Records are pickled one after the other. A small head file, rewritten atomically after every append,
+    holds the data hash the bundle reflects after replaying the log and the number of logged rows, so the
+    bundle can be found and judged without reading the log.
+
+    Attributes:
+        path (str): Directory of the bundle the log belongs to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = os.path.join(path, DELTA_LOG_FILE)
+        self.head_path = os.path.join(path, DELTA_HEAD_FILE)
+
+    def head(self):
+        """Returns `{"data_hash", "rows"}` of the logged updates, or None if nothing was logged."""
+        try:
+            with open(self.head_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def append(self, records, data_hash):
+        """Appends `records` and durably records `data_hash` as the state of the bundle after them."""
+        with open(self.log_path, "ab") as f:
+            for record in records:
+                pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        head = self.head() or {"rows": 0}
+        head = {"data_hash": data_hash, "rows": head["rows"] + sum(record.get("rows", 0) for record in records),
+                "size": os.path.getsize(self.log_path)}
+        tmp_path = f"{self.head_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(head, f)
+        os.replace(tmp_path, self.head_path)
+
+    def records(self):
+        """
+        Yields the logged records in order.
+
+        Only the part of the log covered by the head file is read, so records of an append that crashed
+        before updating the head are ignored.
+        """
+        yield from self.read_from(0)[0]
+
+    def size(self):
+        """Returns the length in bytes of the logged records, the offset after the last one."""
+        head = self.head()
+        return head["size"] if head is not None else 0
+
+    def read_from(self, offset):
+        """
+        Reads the records logged after byte `offset`, e.g. by another process since `offset` was taken.
+
+        Returns:
+            tuple: `(records, end)`, the records and the offset after the last of them.
+        """
+        end = self.size()
+        records = []
+        if end <= offset:
+            return records, offset
+        with open(self.log_path, "rb") as f:
+            f.seek(offset)
+            while f.tell() < end:
+                records.append(pickle.load(f))
+        return records, end
+
+    def clear(self):
+        for path in (self.head_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _next_version(data_hash, record):
+    # Hashes the whole content of the record, so different updates of the same state get different versions,
+    # and replaying the same records, in any process, gets the same ones.
+    digest = hashlib.sha256(f"{data_hash}:{record['op']}".encode("utf-8"))
+    for key in sorted(record):
+        value = record[key]
+        digest.update(f":{key}=".encode("utf-8"))
+        if isinstance(value, np.ndarray):
+            digest.update(f"{value.dtype}{value.shape}".encode("utf-8"))
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, pd.DataFrame):
+            digest.update(json.dumps(list(map(str, value.columns))).encode("utf-8"))
+            digest.update(pd.util.hash_pandas_object(value.astype(str), index=False).to_numpy().tobytes())
+        else:
+            digest.update(json.dumps(value, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _labels_by_doc_id(store, doc_ids):
+    wanted = set(doc_ids)
+    return [label for label, doc_id in store.index_to_docstore_id.items() if doc_id in wanted]
+
+
+def remove_from_store(store, doc_ids):
+    """
+    Removes the vectors of `doc_ids` from a LangChain FAISS store.
+
+    Flat indexes shift the remaining vectors down, so their labels are renumbered; IVF indexes keep the
+    labels of the remaining vectors.
+
+    Raises:
+        ValueError: If the index type does not support removal (HNSW). Such indexes need a full rebuild.
+    """
+    import faiss
+
+    labels = _labels_by_doc_id(store, doc_ids)
+    if not labels:
+        return
+    try:
+        store.index.remove_ids(np.asarray(labels, dtype=np.int64))
+    except RuntimeError as e:
+        raise ValueError(f"{type(store.index).__name__} does not support removing vectors, rebuild the model") from e
+    removed = set(labels)
+    store.docstore.delete(list({store.index_to_docstore_id[label] for label in labels}))
+    if isinstance(store.index, faiss.IndexIVF):
+        for label in labels:
+            del store.index_to_docstore_id[label]
+    else:
+        remaining = [doc_id for label, doc_id in sorted(store.index_to_docstore_id.items()) if label not in removed]
+        store.index_to_docstore_id = dict(enumerate(remaining))
+
+
+def add_to_store(store, vectors, doc_ids, texts, metadatas):
+    """Adds precomputed vectors and their documents to a LangChain FAISS store."""
+    import faiss
+    from langchain_core.documents import Document
+
+    if not len(doc_ids):
+        return
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if isinstance(store.index, faiss.IndexIVF):
+        start = max(store.index_to_docstore_id, default=-1) + 1
+        labels = np.arange(start, start + len(doc_ids), dtype=np.int64)
+        store.index.add_with_ids(vectors, labels)
+    else:
+        labels = np.arange(store.index.ntotal, store.index.ntotal + len(doc_ids), dtype=np.int64)
+        store.index.add(vectors)
+    store.docstore.add({doc_id: Document(page_content=text, metadata=metadata)
+                        for doc_id, text, metadata in zip(doc_ids, texts, metadatas)})
+    store.index_to_docstore_id.update(zip(labels.tolist(), doc_ids))
+
+
+def _writable_index(index):
+    import faiss
+
+    # A serialize round trip gives an in-memory copy of a memory-mapped index.
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+class IncrementalUpdater:
+    """
+    Applies book and user changes to a loaded bundle and records them in its delta log.
+
+    All changes are applied under the write side of `bundle.lock`, so they never run concurrently with a
+    search holding the read side.
+
+    Memory-mapped indexes cannot grow, so unless the bundle was loaded with `mmap=False` (`in_memory`), the
+    indexes are copied into memory first. The copy is private to the process, unlike the page cache behind
+    the memory map, so every process creating an updater adds the full size of the indexes to its memory.
+
+    Attributes:
+        bundle (ModelBundle): The bundle being updated.
+        log (DeltaLog or None): Log the changes are appended to, None to keep them in memory only.
+    """
+
+    def __init__(self, bundle, log=None, in_memory=False):
+        self.bundle = bundle
+        self.log = log if log is not None else (DeltaLog(bundle.path) if bundle.path else None)
+        self.embeddings = bundle.content_vector_store.embedding_function
+        if not in_memory:
+            with bundle.lock.write():
+                for store in (bundle.collab_vector_store, bundle.content_vector_store):
+                    store.index = _writable_index(store.index)
+
+    def _encode(self, texts):
+        if hasattr(self.embeddings, "encode"):
+            return self.embeddings.encode(texts)
+        return np.asarray(self.embeddings.embed_documents(list(texts)), dtype=np.float32)
+
+    def upsert_books(self, frame):
+        """
+        Embeds and indexes new or changed books.
+
+        Args:
+            frame (DataFrame): `all_books` rows of the books, at least `isbn`, `title` and `description`.
+
+        Returns:
+            str: The new model version (`bundle.data_hash`).
+        """
+        frame = artifacts.catalog_table(frame.drop_duplicates("isbn"))
+        if frame.empty:
+            return self.bundle.data_hash
+        vectors = self._encode(frame["description"].astype(str).tolist())
+        return self.apply([{"op": "upsert_books", "frame": frame, "vectors": vectors, "rows": len(frame)}])
+
+    def remove_books(self, isbns):
+        """Removes books from the content index and the catalog. Returns the new model version."""
+        isbns = list(isbns)
+        return self.apply([{"op": "remove_books", "isbns": isbns, "rows": len(isbns)}])
+
+    def upsert_users(self, interactions, user_ids=None):
+        """
+        Re-embeds the reading histories of new or changed users.
+
+        Args:
+            interactions (DataFrame): All `books_data` rows of the users, with the `HISTORY_COLUMNS` columns.
+            user_ids (list, optional): Users to update. Defaults to the users in `interactions`; listed users
+                                       without any interactions are removed. Users the model is not built
+                                       from (see `jaykishan_randomize_data.model_users`) are not embedded;
+                                       only their interactions are logged, for the processes following the
+                                       log.
+
+        Returns:
+            str: The new model version (`bundle.data_hash`).
+        """
+        if user_ids is None:
+            user_ids = pd.unique(interactions["user_id"]).tolist()
+        records = []
+        selected = jaykishan_randomize_data.model_users(user_ids)
+        others = [user_id for user_id in user_ids if user_id not in set(selected)]
+        if others:
+            records.append({"op": "interactions", "user_ids": others,
+                            "interactions": interactions.loc[interactions["user_id"].isin(others),
+                                                             INTERACTION_LOG_COLUMNS].reset_index(drop=True)})
+        user_ids = selected
+        active_rows = interactions["user_id"].isin(user_ids)
+        histories, isbns = history_builder.build_histories(interactions, user_ids)
+        active = [i for i, history in enumerate(histories) if history]
+        removed = [user_ids[i] for i, history in enumerate(histories) if not history]
+
+        if active:
+            texts = [" ".join(histories[i]) for i in active]
+            # The rows themselves are logged too, so processes following the log can update their read sets.
+            records.append({"op": "upsert_users", "user_ids": [user_ids[i] for i in active], "texts": texts,
+                            "isbns": [isbns[i] for i in active], "vectors": self._encode(texts),
+                            "interactions": interactions.loc[active_rows, INTERACTION_LOG_COLUMNS]
+                            .reset_index(drop=True),
+                            "rows": len(active)})
+        if removed:
+            records.append({"op": "remove_users", "user_ids": removed, "rows": len(removed)})
+        return self.apply(records) if records else self.bundle.data_hash
+
+    def remove_users(self, user_ids):
+        """Removes users from the collaborative index and the user vectors. Returns the new model version."""
+        user_ids = list(user_ids)
+        return self.apply([{"op": "remove_users", "user_ids": user_ids, "rows": len(user_ids)}])
+
+    def mark(self, data_hash):
+        """Records that the bundle now reflects the collections with hash `data_hash`."""
+        return self.apply([{"op": "mark", "data_hash": data_hash}])
+
+    def apply(self, records, log=True):
+        """
+        Applies already embedded update records to the bundle, and appends them to the delta log.
+
+        Args:
+            records (list): Records as produced by the other methods or read back from a `DeltaLog`.
+            log (bool, optional): Append the records to the log. Defaults to `True`.
+
+        Returns:
+            str: The new model version (`bundle.data_hash`).
+        """
+        bundle = self.bundle
+        with bundle.lock.write():
+            for record in records:
+                getattr(self, f"_apply_{record['op']}")(record)
+                bundle.data_hash = record.get("data_hash") or _next_version(bundle.data_hash, record)
+            if log and self.log is not None:
+                self.log.append(records, bundle.data_hash)
+        return bundle.data_hash
+
+    def _apply_mark(self, record):
+        pass
+
+    def _apply_interactions(self, record):
+        # Interactions of users outside the model, logged for the read sets of the processes following the log.
+        pass
+
+    def _apply_upsert_books(self, record):
+        frame = record["frame"]
+        store = self.bundle.content_vector_store
+        isbns = frame["isbn"].tolist()
+        remove_from_store(store, isbns)
+        descriptions = frame["description"].astype(str).tolist()
+        add_to_store(store, record["vectors"], isbns, descriptions,
+                     [{"title": title, "isbn": isbn} for title, isbn in zip(frame["title"], frame["isbn"])])
+        self.bundle.catalog.upsert(frame)
+
+    def _apply_remove_books(self, record):
+        remove_from_store(self.bundle.content_vector_store, record["isbns"])
+        self.bundle.catalog.remove(record["isbns"])
+
+    def _apply_upsert_users(self, record):
+        bundle = self.bundle
+        user_ids = record["user_ids"]
+        known = set(bundle.users_train) | set(bundle.users_val)
+        # New users are indexed like train users; validation users stay out of the index.
+        bundle.users_train.extend(user_id for user_id in user_ids if user_id not in known)
+        train = set(bundle.users_train)
+        indexed = [i for i, user_id in enumerate(user_ids) if user_id in train]
+
+        store = bundle.collab_vector_store
+        remove_from_store(store, [str(user_ids[i]) for i in indexed])
+        add_to_store(store, record["vectors"][indexed], [str(user_ids[i]) for i in indexed],
+                     [record["texts"][i] for i in indexed], [{"isbns": record["isbns"][i]} for i in indexed])
+        bundle.user_vectors.upsert(user_ids, record["vectors"])
+        bundle.books_data.update(zip(user_ids, record["texts"]))
+
+    def _apply_remove_users(self, record):
+        bundle = self.bundle
+        removed = set(record["user_ids"])
+        remove_from_store(bundle.collab_vector_store, [str(user_id) for user_id in removed])
+        bundle.user_vectors.remove(record["user_ids"])
+        bundle.users_train = [user_id for user_id in bundle.users_train if user_id not in removed]
+        bundle.users_val = [user_id for user_id in bundle.users_val if user_id not in removed]
+        for user_id in removed:
+            bundle.books_data.pop(user_id, None)
+
+    def replay(self):
+        """Applies the records of the delta log to a freshly loaded bundle, without logging them again."""
+        records = list(self.log.records()) if self.log is not None else []
+        if records:
+            self.apply(records, log=False)
+            logging.info("Replayed %d delta log records onto %s", len(records), self.bundle.path)
+        return len(records)
+
+    def needs_compaction(self):
+        head = self.log.head() if self.log is not None else None
+        indexed = self.bundle.collab_vector_store.index.ntotal + self.bundle.content_vector_store.index.ntotal
+        return head is not None and head["rows"] > COMPACT_RATIO * max(indexed, 1)
+
+    def compact(self, artifact_dir=artifacts.DEFAULT_ARTIFACT_DIR, model_key=None):
+        """Writes the updated bundle out under its current data hash with an empty log, removing the old one."""
+        old_path = self.bundle.path
+        with self.bundle.lock.read():
+            path = artifacts.save_bundle(self.bundle, artifact_dir, model_key)
+        self.log = DeltaLog(path)
+        if old_path and os.path.abspath(old_path) != os.path.abspath(path):
+            shutil.rmtree(old_path, ignore_errors=True)
+        return path
+
+
+def _row_hashes(frame):
+    # Hashes the text rendering, so equal rows match whatever dtypes the columns ended up with.
+    hashes = pd.util.hash_pandas_object(frame.astype(str).fillna("nan"), index=False).to_numpy()
+    return dict(zip(frame["isbn"].tolist(), hashes.tolist()))
+
+
+def sync(updater, df, user_book_df, data_hash):
+    """
+    Brings a bundle up to date with the current collections, embedding only what changed.
+
+    Books are compared by their catalog row, users by their history text. Only the users a rebuild would
+    select (see `jaykishan_randomize_data.model_users`) are kept, so the updated bundle matches a rebuild of the
+    same data. Finally the bundle is marked as reflecting `data_hash`.
+
+    Args:
+        updater (IncrementalUpdater): Updater of the bundle.
+        df (DataFrame): The book catalog (`all_books`).
+        user_book_df (DataFrame): The user/book interactions (`books_data`).
+        data_hash (str): Hash of `df` and `user_book_df`.
+
+    Returns:
+        dict: Number of books and users upserted and removed.
+    """
+    bundle = updater.bundle
+    current = artifacts.catalog_table(df.drop_duplicates("isbn"))
+    old = bundle.catalog.table().reindex(columns=current.columns)
+    new_hashes, old_hashes = _row_hashes(current), _row_hashes(old)
+    changed = [isbn for isbn, row_hash in new_hashes.items() if old_hashes.get(isbn) != row_hash]
+    removed_books = [isbn for isbn in old_hashes if isbn not in new_hashes]
+
+    users = jaykishan_randomize_data.model_users(pd.unique(user_book_df["user_id"]).tolist())
+    histories, _ = history_builder.build_histories(user_book_df, users)
+    changed_users = [user for user, history in zip(users, histories)
+                     if bundle.books_data.get(user) != " ".join(history)]
+    removed_users = sorted(set(bundle.books_data) - set(users))
+
+    if changed:
+        updater.upsert_books(current[current["isbn"].isin(changed)])
+    if removed_books:
+        updater.remove_books(removed_books)
+    if changed_users:
+        updater.upsert_users(user_book_df[user_book_df["user_id"].isin(changed_users)], changed_users)
+    if removed_users:
+        updater.remove_users(removed_users)
+    updater.mark(data_hash)
+
+    summary = {"books_upserted": len(changed), "books_removed": len(removed_books),
+               "users_upserted": len(changed_users), "users_removed": len(removed_users)}
+    logging.info("Synced model bundle incrementally: %s", summary)
+    return summary
+
+
+def find_bundle(artifact_dir, model_key, data_hash=None):
+    """
+    Finds a saved bundle of `model_key` to update incrementally.
+
+    Returns:
+        str or None: The bundle whose delta log head matches `data_hash`, else the most recently updated
+                     bundle of `model_key`, or None if there is none.
+    """
+    if not os.path.isdir(artifact_dir):
+        return None
+    candidates = []
+    for name in os.listdir(artifact_dir):
+        path = os.path.join(artifact_dir, name)
+        manifest = artifacts.read_manifest(path)
+        if (manifest is None or manifest.get("format_version") != artifacts.BUNDLE_FORMAT_VERSION
+                or manifest.get("model_key") != model_key):
+            continue
+        head = DeltaLog(path).head()
+        if data_hash is not None and head is not None and head["data_hash"] == data_hash:
+            return path
+        modified = os.path.getmtime(DeltaLog(path).head_path) if head else manifest.get("created_at", 0)
+        candidates.append((modified, path))
+    return max(candidates)[1] if candidates else None
@@ -0,0 +1,163 @@
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+DEFAULT_COLLAB_INDEX = os.getenv("COLLAB_INDEX_TYPE", "flat")
+DEFAULT_CONTENT_INDEX = os.getenv("CONTENT_INDEX_TYPE", "flat")
+
+# FAISS warns below 39 training points per centroid; clustering quality drops quickly under that.
+MIN_POINTS_PER_CENTROID = 39
+MAX_TRAINING_POINTS_PER_CENTROID = 256
+
+
+def default_nlist(num_vectors):
+    """Number of IVF cells for `num_vectors` vectors: about 4 * sqrt(n), bounded by the training set size."""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def default_pq_m(dim):
+    """Number of PQ sub-quantizers: one per 4 dimensions, falling back to the nearest divisor of `dim`."""
+    m = max(1, dim // 4)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def make_index(index_type, dim, num_vectors, nlist=None, nprobe=None, hnsw_m=32, ef_construction=200, ef_search=64,
+               pq_m=None, pq_nbits=8):
+    """
+    Creates an empty inner-product FAISS index of the requested type, sized for `num_vectors` vectors.
+
+    Args:
+        index_type (str): One of `INDEX_TYPES`.
+        dim (int): Vector dimension.
+        num_vectors (int): Number of vectors the index will hold, used to size IVF cells and PQ codebooks.
+        nlist (int, optional): IVF cells. Defaults to `default_nlist(num_vectors)`.
+        nprobe (int, optional): IVF cells visited per query. Defaults to `nlist / 16`, at least 1.
+        hnsw_m (int, optional): HNSW neighbours per node. Defaults to 32.
+        ef_construction (int, optional): HNSW build-time search depth. Defaults to 200.
+        ef_search (int, optional): HNSW query-time search depth. Defaults to 64.
+        pq_m (int, optional): PQ sub-quantizers. Defaults to `default_pq_m(dim)`.
+        pq_nbits (int, optional): Bits per PQ code. Defaults to 8.
+
+    Returns:
+        faiss.Index: The untrained index. Data sets too small to train an IVF index get a flat index instead.
+
+    Raises:
+        ValueError: If `index_type` is not one of `INDEX_TYPES`.
+    """
+    import faiss
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dim)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+        return index
+
+    nlist = nlist or default_nlist(num_vectors)
+    if index_type == "ivf_pq":
+        # Each PQ codebook needs its own training points on top of the coarse quantizer.
+        pq_nbits = min(pq_nbits, int(math.log2(max(2, num_vectors // MIN_POINTS_PER_CENTROID))))
+    if nlist < 2 or pq_nbits < 1:
+        logging.warning("%d vectors are too few to train a %s index, using a flat index", num_vectors, index_type)
+        return faiss.IndexFlatIP(dim)
+
+    quantizer = faiss.IndexFlatIP(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m or default_pq_m(dim), pq_nbits,
+                                 faiss.METRIC_INNER_PRODUCT)
+    index.nprobe = nprobe or max(1, nlist // 16)
+    return index
+
+
+def build_index(vectors, index_type="flat", seed=0, **params):
+    """
+    Creates, trains and fills an index with `vectors`.
+
+    Args:
+        vectors (ndarray): `(n, dim)` float32 matrix.
+        index_type (str, optional): One of `INDEX_TYPES`. Defaults to `"flat"`.
+        seed (int, optional): Seed for sampling the training set. Defaults to 0.
+        **params: Forwarded to `make_index`.
+
+    Returns:
+        faiss.Index: The trained index holding all of `vectors`, row `i` at position `i`.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dim = vectors.shape
+    index = make_index(index_type, dim, num_vectors, **params)
+
+    if not index.is_trained:
+        max_training = MAX_TRAINING_POINTS_PER_CENTROID * index.nlist
+        training = vectors
+        if num_vectors > max_training:
+            sample = np.random.default_rng(seed).choice(num_vectors, max_training, replace=False)
+            training = vectors[np.sort(sample)]
+        start = time.perf_counter()
+        index.train(training)
+        logging.info("Trained %s index on %d vectors in %.2fs", index_type, len(training), time.perf_counter() - start)
+
+    index.add(vectors)
+    return index
+
+
+def recall_latency_report(vectors, queries, k=10, index_types=INDEX_TYPES, **params):
+    """
+    Compares index types against the exact flat index on recall@k and per-query latency.
+
+    Args:
+        vectors (ndarray): `(n, dim)` float32 matrix to index.
+        queries (ndarray): `(q, dim)` float32 query matrix.
+        k (int, optional): Number of neighbours retrieved per query. Defaults to 10.
+        index_types (tuple, optional): Index types to compare. Defaults to all `INDEX_TYPES`.
+        **params: Forwarded to `make_index` for every index type.
+
+    Returns:
+        list: One dict per index type with `index_type`, `build_seconds`, `recall_at_k`, `p50_ms`, `p99_ms`
+              (single query latency) and `batch_qps` (throughput of one batched search).
+    """
+    import faiss
+
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_index(vectors, index_type, **params)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        batch_seconds = time.perf_counter() - start
+
+        latencies = np.empty(len(queries))
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            index.search(queries[i:i + 1], k)
+            latencies[i] = time.perf_counter() - start
+
+        hits = sum(len(np.intersect1d(found[i], truth[i])) for i in range(len(queries)))
+        report.append({
+            "index_type": index_type,
+            "build_seconds": build_seconds,
+            "recall_at_k": hits / truth.size,
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p99_ms": float(np.percentile(latencies, 99) * 1000),
+            "batch_qps": len(queries) / max(batch_seconds, 1e-9),
+        })
+    return report
@@ -0,0 +1,142 @@
+import numpy as np
+
+
+def _reserve(array, used, needed):
+    # Grows `array` to hold `needed` items, doubling its capacity so repeated appends stay amortized O(1).
+    if needed <= len(array):
+        return array
+    grown = np.empty(max(needed, 2 * len(array)), dtype=array.dtype)
+    grown[:used] = array[:used]
+    return grown
+
+
+class InteractionSets:
+    """
+    The catalog positions each user has read, stored as CSR arrays.
+
+    Row `r` holds the books of user `user_ids[r]` in `indices[indptr[r]:indptr[r + 1]]`, in the order the
+    interactions appear in the source frame. Interactions with ISBNs missing from the catalog are dropped.
+
+    `replace` appends the new rows of changed users and points their ids at them, like `CatalogLookup.upsert`
+    does for books, so an update costs time proportional to the changed users only. The arrays therefore
+    carry spare capacity past `num_rows`, and rows no id points at any more until `compact` drops them.
+
+    Attributes:
+        user_ids (ndarray): User id of every row, sorted when built by `from_frame`.
+        indptr (ndarray): Row boundaries into `indices`.
+        indices (ndarray): Catalog positions of the books read.
+        values (ndarray or None): Value of every entry of `indices`, e.g. its rating, or None.
+        id_to_row (dict): User id to row.
+        num_rows (int): Rows in use in the arrays, including replaced ones.
+        dead (int): Entries of replaced or removed rows.
+    """
+
+    def __init__(self, user_ids, indptr, indices, values=None):
+        self.user_ids = user_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.id_to_row = {user_id: row for row, user_id in enumerate(user_ids.tolist())}
+        self.num_rows = len(user_ids)
+        self.dead = 0
+
+    @classmethod
+    def from_frame(cls, user_book_df, catalog):
+        """Builds the sets from a `books_data`-style frame with `user_id` and `isbn` columns."""
+        items = user_book_df["isbn"].map(catalog.isbn_to_pos).to_numpy(dtype=np.float64)
+        known = ~np.isnan(items)
+        user_ids = user_book_df["user_id"].to_numpy()[known]
+        items = items[known].astype(np.int64)
+
+        unique_users, inverse = np.unique(user_ids, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        indptr = np.zeros(len(unique_users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(inverse, minlength=len(unique_users)), out=indptr[1:])
+        return cls(unique_users, indptr, items[order])
+
+    def __contains__(self, user_id):
+        return user_id in self.id_to_row
+
+    def rows_for(self, user_ids):
+        """Returns the row of every user id, -1 for users without interactions."""
+        return np.fromiter((self.id_to_row.get(user_id, -1) for user_id in user_ids), dtype=np.int64,
+                           count=len(user_ids))
+
+    def _entries(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        valid = rows >= 0
+        starts = np.where(valid, self.indptr[np.where(valid, rows, 0)], 0)
+        lengths = np.where(valid, self.indptr[np.where(valid, rows + 1, 0)] - starts, 0)
+        owner = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return owner, np.repeat(starts, lengths) + offsets
+
+    def gather(self, rows):
+        """
+        Concatenates the items of several rows.
+
+        Args:
+            rows (ndarray): Rows to gather; -1 entries contribute nothing.
+
+        Returns:
+            tuple: `(owner, items)` where `items` are the catalog positions and `owner[i]` is the index into
+                   `rows` that `items[i]` came from.
+        """
+        owner, entries = self._entries(rows)
+        return owner, self.indices[entries]
+
+    def gather_values(self, rows):
+        """Like `gather`, returning `(owner, items, values)`."""
+        owner, entries = self._entries(rows)
+        return owner, self.indices[entries], self.values[entries]
+
+    def replace(self, user_ids, other):
+        """
+        Replaces the rows of some users with their rows in `other`, in place.
+
+        Runs in time proportional to `other` (amortized), not to the whole set. Readers must not run
+        concurrently; the recommender calls it under the write side of the bundle lock.
+
+        Args:
+            user_ids (Sequence): Users whose rows are replaced; users missing from `other` lose their row.
+            other (InteractionSets): The new rows, with `values` whenever this set has them.
+        """
+        for user_id in set(user_ids) | set(other.id_to_row):
+            row = self.id_to_row.pop(user_id, None)
+            if row is not None:
+                self.dead += int(self.indptr[row + 1] - self.indptr[row])
+
+        rows = other.num_rows
+        start_row = self.num_rows
+        start, size = int(self.indptr[start_row]), int(other.indptr[rows])
+        self.indptr = _reserve(self.indptr, start_row + 1, start_row + rows + 1)
+        self.indices = _reserve(self.indices, start, start + size)
+        if self.values is not None:
+            self.values = _reserve(self.values, start, start + size)
+            self.values[start:start + size] = other.values[:size]
+        user_ids_dtype = np.result_type(self.user_ids, other.user_ids)
+        self.user_ids = _reserve(self.user_ids.astype(user_ids_dtype, copy=False), start_row, start_row + rows)
+        self.indices[start:start + size] = other.indices[:size]
+        self.indptr[start_row + 1:start_row + rows + 1] = other.indptr[1:rows + 1] + start
+        self.user_ids[start_row:start_row + rows] = other.user_ids[:rows]
+        self.num_rows += rows
+        self.id_to_row.update((user_id, start_row + row) for user_id, row in other.id_to_row.items())
+
+        if self.dead > start + size - self.dead:
+            self.compact()
+
+    def compact(self):
+        """Drops the rows no user points at any more and the spare capacity, renumbering the rows."""
+        user_ids = list(self.id_to_row)
+        rows = self.rows_for(user_ids)
+        owner, entries = self._entries(rows)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owner, minlength=len(rows)), out=indptr[1:])
+        self.user_ids = self.user_ids[rows]
+        self.indptr = indptr
+        self.indices = self.indices[entries]
+        if self.values is not None:
+            self.values = self.values[entries]
+        self.id_to_row = {user_id: row for row, user_id in enumerate(user_ids)}
+        self.num_rows = len(rows)
+        self.dead = 0
@@ -0,0 +1,220 @@
+"""
+Item-item collaborative filtering over a sparse user x book rating matrix, the collaborative engine selected
+with `COLLAB_ENGINE=item_cf`.
+
+The `books_data` interactions become a SciPy CSR matrix with one row per user and one column per catalog
+position, holding the `rating` of every interaction. Its book columns are L2-normalized and multiplied, a
+block of books at a time, into cosine similarities, of which only the `neighbours` most similar books of
+every book are kept. A user is scored with one sparse product of their rating row and that similarity
+matrix: every book they rated votes for its neighbours, weighted by rating and similarity. Nothing is
+embedded, neither when building nor when serving.
+"""
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.models.interactions import InteractionSets
+
+# "vector": nearest users in the embedded history index; "item_cf": this module.
+COLLAB_ENGINES = ("vector", "item_cf")
+DEFAULT_COLLAB_ENGINE = os.getenv("COLLAB_ENGINE", "vector")
+DEFAULT_NEIGHBOURS = int(os.getenv("ITEM_CF_NEIGHBOURS", 50))
+# Books whose similarities are computed per sparse product; bounds the memory of the block before pruning.
+DEFAULT_BLOCK_SIZE = int(os.getenv("ITEM_CF_BLOCK_SIZE", 2048))
+
+
+def rating_matrix(user_book_df, catalog, num_items=None):
+    """
+    Builds the user x book rating matrix.
+
+    Missing, non-numeric and zero ratings (shelved but not rated) count as 1. When a user has several rows for
+    the same book, the last one wins. Books missing from the catalog are dropped.
+
+    Args:
+        user_book_df (DataFrame): `books_data`-style rows with `user_id`, `isbn` and `rating` columns.
+        catalog (CatalogLookup): Maps ISBNs to columns.
+        num_items (int, optional): Number of columns; books at later positions are dropped. Defaults to the
+                                   catalog size.
+
+    Returns:
+        tuple: `(user_ids, ratings)`, the sorted user id of every row and the float32 CSR matrix.
+    """
+    import scipy.sparse as sp
+
+    num_items = len(catalog) if num_items is None else num_items
+    user_book_df = user_book_df.drop_duplicates(subset=["user_id", "isbn"], keep="last")
+    items = user_book_df["isbn"].map(catalog.isbn_to_pos).to_numpy(dtype=np.float64)
+    known = ~np.isnan(items) & (items < num_items)
+    ratings = pd.to_numeric(user_book_df["rating"], errors="coerce").to_numpy(dtype=np.float32)[known]
+    ratings[~(ratings > 0)] = 1
+
+    user_ids, rows = np.unique(user_book_df["user_id"].to_numpy()[known], return_inverse=True)
+    matrix = sp.csr_matrix((ratings, (rows, items[known].astype(np.int64))), shape=(len(user_ids), num_items))
+    return user_ids, matrix
+
+
+def _top_per_row(matrix, n):
+    """
+    Keeps the `n` largest positive entries of every row of a CSR matrix.
+
+    Returns:
+        tuple: `(row, col, value, rank)` arrays sorted by row then rank, ties in the order of `matrix.indices`.
+    """
+    row = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    positive = matrix.data > 0
+    row, col, data = row[positive], matrix.indices[positive], matrix.data[positive]
+    if not len(row):
+        return row, col, data, row
+    # Ranks within every row with one sort instead of a lexsort: the row number plus one minus the value
+    # scaled to (0, 1] by the row maximum orders by row, then by descending value.
+    starts = np.flatnonzero(np.r_[True, row[1:] != row[:-1]])
+    lengths = np.diff(np.r_[starts, len(row)])
+    row_max = np.repeat(np.maximum.reduceat(data, starts).astype(np.float64), lengths)
+    order = np.argsort(row + (1 - data / row_max), kind="stable")
+    row, col, data = row[order], col[order], data[order]
+    rank = np.arange(len(row)) - np.repeat(starts, lengths)
+    keep = rank < n
+    return row[keep], col[keep], data[keep], rank[keep]
+
+
+def item_similarities(ratings, neighbours=DEFAULT_NEIGHBOURS, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Computes the cosine similarity of every pair of books rated by common users, pruned to the top neighbours.
+
+    Args:
+        ratings (csr_matrix): `(num_users, num_items)` ratings, see `rating_matrix`.
+        neighbours (int, optional): Similarities kept per book.
+        block_size (int, optional): Books per sparse product.
+
+    Returns:
+        csr_matrix: `(num_items, num_items)` float32 matrix, row `i` holding the most similar books of book
+                    `i`, without `i` itself.
+    """
+    import scipy.sparse as sp
+
+    num_items = ratings.shape[1]
+    norms = np.sqrt(np.asarray(ratings.multiply(ratings).sum(axis=0), dtype=np.float64).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = (ratings @ sp.diags(scale.astype(np.float32))).tocsr()
+    transposed = normalized.T.tocsr()
+
+    rows, cols, values = [], [], []
+    for start in range(0, num_items, block_size):
+        block = (transposed[start:start + block_size] @ normalized).tocsr()
+        # A book is not its own neighbour.
+        block.data[block.indices == np.repeat(np.arange(start, start + block.shape[0]), np.diff(block.indptr))] = 0
+        row, col, data, _ = _top_per_row(block, neighbours)
+        rows.append(row + start)
+        cols.append(col)
+        values.append(data)
+    if not rows:
+        return sp.csr_matrix((num_items, num_items), dtype=np.float32)
+    return sp.csr_matrix((np.concatenate(values).astype(np.float32), (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(num_items, num_items))
+
+
+def _rating_sets(user_ids, ratings):
+    return InteractionSets(user_ids, ratings.indptr.astype(np.int64), ratings.indices.astype(np.int64),
+                           ratings.data.astype(np.float32))
+
+
+def _live_items(catalog, num_items):
+    # Positions still in use: removed books keep their old positions, see `CatalogLookup.remove`.
+    live = np.zeros(num_items, dtype=bool)
+    positions = np.fromiter(catalog.isbn_to_pos.values(), dtype=np.int64, count=len(catalog.isbn_to_pos))
+    live[positions[positions < num_items]] = True
+    return live
+
+
+class ItemCF:
+    """
+    Item-item collaborative filtering model.
+
+    Attributes:
+        similarities (csr_matrix): `(num_items, num_items)` pruned book similarities, see `item_similarities`.
+        ratings (InteractionSets): Rated catalog positions of every user, with the ratings as `values`.
+        live (ndarray): Boolean mask of the catalog positions that may be recommended.
+    """
+
+    def __init__(self, similarities, ratings, live):
+        self.similarities = similarities
+        self.ratings = ratings
+        self.live = live
+
+    @classmethod
+    def fit(cls, user_book_df, catalog, neighbours=DEFAULT_NEIGHBOURS, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Builds the model from interactions.
+
+        Args:
+            user_book_df (DataFrame): `books_data`-style rows, see `rating_matrix`.
+            catalog (CatalogLookup): The book catalog.
+            neighbours (int, optional): Similarities kept per book.
+            block_size (int, optional): Books per sparse product.
+
+        Returns:
+            ItemCF: The fitted model.
+        """
+        start = time.perf_counter()
+        user_ids, ratings = rating_matrix(user_book_df, catalog)
+        similarities = item_similarities(ratings, neighbours, block_size)
+        logging.info("Built item-item similarities of %d books from %d ratings of %d users in %.2fs",
+                     ratings.shape[1], ratings.nnz, len(user_ids), time.perf_counter() - start)
+        return cls(similarities, _rating_sets(user_ids, ratings), _live_items(catalog, ratings.shape[1]))
+
+    @property
+    def num_items(self):
+        return self.similarities.shape[0]
+
+    def update_users(self, user_ids, user_book_df, catalog):
+        """
+        Replaces the ratings of some users in place, keeping the book similarities.
+
+        Costs time proportional to the changed users, so it follows every interaction change; books added to
+        the catalog since `fit` are only scored after the next `fit`.
+
+        Args:
+            user_ids (Sequence[int]): Users whose ratings are replaced.
+            user_book_df (DataFrame): All `books_data` rows of `user_ids`; users without rows lose their ratings.
+            catalog (CatalogLookup): The book catalog.
+        """
+        changed_ids, ratings = rating_matrix(user_book_df, catalog, self.num_items)
+        self.ratings.replace(user_ids, _rating_sets(changed_ids, ratings))
+
+    def refresh_live(self, catalog):
+        """Stops recommending the books removed from `catalog` since `fit`."""
+        self.live = _live_items(catalog, self.num_items)
+
+    def __contains__(self, user_id):
+        return user_id in self.ratings
+
+    def recommend(self, user_ids, n=5):
+        """
+        Scores the books of many users with one sparse product and keeps the `n` best unrated ones.
+
+        Args:
+            user_ids (Sequence[int]): User ids. Users without ratings get no recommendations.
+            n (int, optional): Books recommended per user. Defaults to 5.
+
+        Returns:
+            tuple: `(query, item, score, rank)` arrays sorted by query then rank, like
+                   `batch_recommend.rank_items`; `query` indexes `user_ids` and `item` is a catalog position.
+                   Ties are broken by catalog position.
+        """
+        import scipy.sparse as sp
+
+        rows = self.ratings.rows_for(user_ids)
+        found = np.flatnonzero(rows >= 0)
+        owner, items, values = self.ratings.gather_values(rows[found])
+        user_ratings = sp.csr_matrix((values, (owner, items)), shape=(len(found), self.num_items))
+        scores = user_ratings @ self.similarities
+        # Drops the books already rated and the books no longer in the catalog.
+        scores = scores - scores.multiply(user_ratings > 0)
+        scores = scores.multiply(self.live[np.newaxis, :].astype(np.float32)).tocsr()
+        scores.sort_indices()
+
+        query, item, score, rank = _top_per_row(scores, n)
+        return found[query], item.astype(np.int64), score, rank
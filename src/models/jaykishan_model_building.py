@@ -1,103 +1,161 @@
+import logging
 import pandas as pd
 import numpy as np
-import faiss
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.documents import Document
-
-
-def create_recommendation_model(df, users_train, users_val, train_df, validation_df):
-    # list to capture book history of the users
-    books_train = []
-    books_train_isbns = []
-
-    # populate the list with the book history
-    for user in users_train:
-        temp = train_df[train_df["user_id"] == user][["isbn", "title", "description", "user_id", "rating"]]
-        temp["combined"] = train_df.apply(
-            lambda x: str(x["user_id"]) + str(x["description"]) + str(x["title"]) + str(x['rating']), axis=1)
-        books_train_isbns.append(temp["isbn"].tolist())
-        books_train.append(temp["combined"].tolist())
-
-    # list to capture book history of the users(validation set)
-    books_val = []
-    books_val_isbns = []
-
-    # populate the list with the product codes
-    for user in users_val:
-        temp = validation_df[validation_df["user_id"] == user][["isbn", "title", "description", "user_id", "rating"]]
-        temp["combined"] = validation_df.apply(
-            lambda x: str(x["user_id"]) + str(x["description"]) + str(x["title"]) + str(x['rating']), axis=1)
-        books_val_isbns.append(temp["isbn"].tolist())
-        books_val.append(temp["combined"].tolist())
-
-    model_name = "all-MiniLM-L6-v2"
-
-    embeddings = HuggingFaceEmbeddings(model_name=model_name)
-
-    index = faiss.IndexFlatIP(len(embeddings.embed_query("Hello World")))
-
-    collab_vector_store = FAISS(
-        embedding_function=embeddings,
-        index=index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={},
-    )
-
-    content_vector_store = FAISS(
+from src.instrumentation import span, timed
+from src.models import artifacts, history_builder, incremental, index_factory
+from src.models.user_vectors import UserVectorCache
+from src.preprocessing_data import jaykishan_randomize_data
+
+# `embedding.DEFAULT_MODEL_NAME`; `embedding` loads LangChain, so it is only imported by `load_embeddings`.
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Fields of the `all_books` and `books_data` collections the model reads; loading projects onto these.
+BOOK_COLUMNS = artifacts.CATALOG_COLUMNS
+INTERACTION_COLUMNS = history_builder.HISTORY_COLUMNS
+
+
+def load_embeddings(model_name=MODEL_NAME, batch_size=None):
+    from src.models import embedding
+
+    return embedding.BatchEmbedder(model_name=model_name, batch_size=batch_size or embedding.DEFAULT_BATCH_SIZE)
+
+
+def build_vector_store(embeddings, vectors, ids, texts, metadatas, index_type="flat", index_params=None):
+    """
+    Wraps a precomputed float32 matrix into a LangChain FAISS vector store.
+
+    Args:
+        embeddings (Embeddings): Embedding function used by the store for queries.
+        vectors (ndarray): `(n, dim)` float32 matrix, row `i` belonging to `ids[i]`.
+        ids (list): Docstore id of every row.
+        texts (list): Page content of every row.
+        metadatas (list): Metadata dict of every row.
+        index_type (str, optional): One of `index_factory.INDEX_TYPES`. Defaults to `"flat"`.
+        index_params (dict, optional): Extra parameters for `index_factory.make_index`, e.g. `nprobe`.
+
+    Returns:
+        FAISS: The vector store with its own index holding `vectors`.
+    """
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+    index = index_factory.build_index(vectors, index_type, **(index_params or {}))
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    return FAISS(
         embedding_function=embeddings,
         index=index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={},
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
     )
 
-    documents = []
-    idx = 0
-
-    def create_document(book_history):
-        global idx
-        book_codes = " ".join(book_history)
-        book_isbns = books_train_isbns[idx]
-        idx += 1
-        return Document(page_content=book_codes, metadata={"isbns": book_isbns})
-
-    for book_history in books_train:
-        doc = create_document(book_history)
-        documents.append(doc)
-
-    ids = [str(user) for user in users_train]
-    collab_vector_store.add_documents(documents=documents, ids=ids)
-
-    content_docs = []
-
-    def create_content_doc(desc, title, isbn):
-        return Document(page_content=desc, metadata={"title": title, "isbn": isbn})
-
-    for i in range(len(df)):
-        temp = df.loc[i]
-        desc = temp['description']
-        title, isbn = temp['title'], temp['isbn']
-        doc = create_content_doc(desc, title, isbn)
-        content_docs.append(doc)
-
-    ids = df['isbn'].tolist()
-    content_vector_store.add_documents(documents=content_docs, ids=ids)
-
-    collab_vector_store.save_local("collab-store")
-    content_vector_store.save_local("content-store")
-
-    books_data = {}
-
-    def generate_data():
-        for i in range(len(users_train)):
-            books_data[users_train[i]] = " ".join(books_train[i])
-
-        for i in range(len(users_val)):
-            books_data[users_val[i]] = " ".join(books_val[i])
-
-        return books_data
-    books_data = generate_data()
-
 
-    return collab_vector_store, content_vector_store, books_data
\ No newline at end of file
+@timed("build.create_recommendation_model")
+def create_recommendation_model(df, users_train, users_val, train_df, validation_df, batch_size=None,
+                                collab_index=index_factory.DEFAULT_COLLAB_INDEX,
+                                content_index=index_factory.DEFAULT_CONTENT_INDEX, index_params=None):
+    # book history of the users in the train and validation sets
+    with span("build.histories"):
+        books_train, books_train_isbns = history_builder.build_histories(train_df, users_train)
+        books_val, books_val_isbns = history_builder.build_histories(validation_df, users_val)
+
+    embeddings = load_embeddings(batch_size=batch_size)
+
+    # User histories and book descriptions are embedded as whole columns and the resulting matrices
+    # are written straight into the indexes. Every user is embedded once, train users are indexed.
+    all_users = list(users_train) + list(users_val)
+    user_texts = [" ".join(book_history) for book_history in books_train + books_val]
+    with span("build.embed_users"):
+        user_matrix = embeddings.encode(user_texts)
+    user_vectors = UserVectorCache(all_users, user_matrix)
+
+    with span("build.collab_index"):
+        collab_vector_store = build_vector_store(
+            embeddings,
+            user_matrix[:len(users_train)],
+            ids=[str(user) for user in users_train],
+            texts=user_texts[:len(users_train)],
+            metadatas=[{"isbns": book_isbns} for book_isbns in books_train_isbns],
+            index_type=collab_index,
+            index_params=index_params,
+        )
+
+    descriptions = df['description'].astype(str).tolist()
+    with span("build.embed_books"):
+        book_matrix = embeddings.encode(descriptions)
+    with span("build.content_index"):
+        content_vector_store = build_vector_store(
+            embeddings,
+            book_matrix,
+            ids=df['isbn'].tolist(),
+            texts=descriptions,
+            metadatas=[{"title": title, "isbn": isbn} for title, isbn in zip(df['title'], df['isbn'])],
+            index_type=content_index,
+            index_params=index_params,
+        )
+
+    books_data = dict(zip(all_users, user_texts))
+
+    return collab_vector_store, content_vector_store, books_data, user_vectors
+
+
+@timed("build.load_or_build_model")
+def load_or_build_model(df, user_book_df, artifact_dir=artifacts.DEFAULT_ARTIFACT_DIR, rebuild=False,
+                        collab_index=index_factory.DEFAULT_COLLAB_INDEX,
+                        content_index=index_factory.DEFAULT_CONTENT_INDEX, index_params=None):
+    """
+    Loads the model bundle for the given collections from disk, building and saving it only when needed.
+
+    The bundle is keyed by a hash of `df` and `user_book_df`, so a restart with unchanged data memory-maps
+    the saved indexes instead of re-embedding every book and user history. When the data changed since the
+    last saved bundle, that bundle is updated incrementally (see `incremental.sync`) instead of rebuilt.
+
+    Args:
+        df (DataFrame): The book catalog (`all_books`).
+        user_book_df (DataFrame): The user/book interactions (`books_data`).
+        artifact_dir (str, optional): Root directory holding the bundles.
+        rebuild (bool, optional): Ignore any saved bundle and rebuild from scratch. Defaults to `False`.
+        collab_index (str, optional): Index type of the collaborative store, see `index_factory.INDEX_TYPES`.
+        content_index (str, optional): Index type of the content store, see `index_factory.INDEX_TYPES`.
+        index_params (dict, optional): Extra parameters for `index_factory.make_index`.
+
+    Returns:
+        ModelBundle: The loaded or freshly built bundle.
+    """
+    data_hash = artifacts.compute_data_hash(df, user_book_df)
+    model_key = f"{MODEL_NAME}:{collab_index}:{content_index}:{sorted((index_params or {}).items())}"
+    path = artifacts.bundle_path(data_hash, artifact_dir, model_key)
+
+    if not rebuild and artifacts.is_bundle_valid(path, data_hash, model_key) \
+            and incremental.DeltaLog(path).head() is None:
+        logging.info("Loading model bundle from %s", path)
+        return artifacts.load_bundle(path, load_embeddings())
+
+    # A bundle built from older data is brought up to date by embedding only the changed books and users.
+    base_path = None if rebuild else incremental.find_bundle(artifact_dir, model_key, data_hash)
+    if base_path is not None:
+        logging.info("Updating model bundle %s incrementally", base_path)
+        bundle = artifacts.load_bundle(base_path, load_embeddings(), mmap=False)
+        updater = incremental.IncrementalUpdater(bundle, in_memory=True)
+        try:
+            updater.replay()
+            if bundle.data_hash != data_hash:
+                incremental.sync(updater, df, user_book_df, data_hash)
+            if updater.needs_compaction():
+                updater.compact(artifact_dir, model_key)
+            return bundle
+        except ValueError as e:
+            # e.g. HNSW indexes, which cannot remove vectors
+            logging.warning("Incremental update failed (%s), rebuilding the model", e)
+
+    logging.info("No valid model bundle at %s, building the model", path)
+    users_train, users_val, train_df, validation_df = jaykishan_randomize_data.randomize_data(user_book_df)
+    collab_vector_store, content_vector_store, books_data, user_vectors = create_recommendation_model(
+        df, users_train, users_val, train_df, validation_df,
+        collab_index=collab_index, content_index=content_index, index_params=index_params)
+    bundle = artifacts.ModelBundle(collab_vector_store, content_vector_store, books_data,
+                                   artifacts.catalog_table(df), users_train, users_val, user_vectors, data_hash)
+    artifacts.save_bundle(bundle, artifact_dir, model_key)
+    return bundle
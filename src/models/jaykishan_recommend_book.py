@@ -1,53 +1,81 @@
+from src.instrumentation import span, timed
 
-def recommend_book_content(df, content_vector_store, title):
+
+def recommend_book_content(catalog, content_vector_store, title, k=10):
     title = str(title)
-    desc = df['description'][df['title'] == title].astype(str).values[0]
+    with span("content.lookup"):
+        desc = catalog.description_for_title(title)
     content = desc + " " + title
-    results_content = content_vector_store.similarity_search_with_score(
-        content, k=10
-    )
-
-    recommended_books = {}
-    for res, score in results_content:
-        isbn = res.metadata['isbn']
-        recommended_books[isbn] = recommended_books.get(isbn, 0) + 1
-
-    rec_books = list(recommended_books.items())
-    rec_books.sort(key=lambda x: x[1], reverse=True)
-    rec_books = rec_books[1:6]
-    isbns = [ele[0] for ele in rec_books]
-    titles = [df[df['isbn'] == isbn]['title'].astype(str).values[0] for isbn in isbns]
-
-    urls = retrieve_images(isbns)
+    with span("content.embed"):
+        vector = content_vector_store.embedding_function.embed_query(content)
+    with span("content.search"):
+        results_content = content_vector_store.similarity_search_with_score_by_vector(
+            vector, k=k
+        )
+
+    with span("content.rank"):
+        recommended_books = {}
+        for res, score in results_content:
+            isbn = res.metadata['isbn']
+            recommended_books[isbn] = recommended_books.get(isbn, 0) + 1
+
+        rec_books = list(recommended_books.items())
+        rec_books.sort(key=lambda x: x[1], reverse=True)
+        rec_books = rec_books[1:6]
+        isbns = [ele[0] for ele in rec_books]
+        titles = catalog.titles_for(isbns)
+
+    urls = retrieve_images(isbns, catalog)
     return urls, titles, isbns
 
 
-def recommend_book_collab(id, collab_vector_store, user_book_df, df, books_data):
+def recommend_book_collab(id, collab_vector_store, interactions, catalog, books_data, user_vectors=None, k=3,
+                          item_cf=None):
     id = int(id)
-    results_collab = collab_vector_store.similarity_search_with_score(
-        books_data[id], k=3
-    )
-
-    read = set(user_book_df[user_book_df['user_id'] == id]['isbn'].tolist())
-    recommended_books = {}
-    for res, score in results_collab:
-        isbns = res.metadata['isbns']
-        for isbn in isbns:
-            if isbn not in read:
-                recommended_books[isbn] = recommended_books.get(isbn, 0) + 1
-
-    rec_books = list(recommended_books.items())
-    rec_books.sort(key=lambda x: x[1], reverse=True)
-    rec_books = rec_books[:5]
-    isbns = [ele[0] for ele in rec_books]
-    titles = [df[df['isbn'] == isbn]['title'].astype(str).values[0] for isbn in isbns]
-
-    urls = retrieve_images(isbns)
+    if item_cf is not None:
+        # item-item engine, see `src.models.item_cf`: one sparse product, no search and no embedding
+        with span("collab.item_cf"):
+            _, items, _, _ = item_cf.recommend([id], n=5)
+            isbns = catalog.isbns[items].tolist()
+            titles = catalog.titles_for(isbns)
+        urls = retrieve_images(isbns, catalog)
+        return urls, titles, isbns
+
+    if user_vectors is not None and id in user_vectors:
+        # precomputed history embedding, no transformer forward pass
+        vector = user_vectors.vector(id)
+    else:
+        with span("collab.embed"):
+            vector = collab_vector_store.embedding_function.embed_query(books_data[id])
+    with span("collab.search"):
+        results_collab = collab_vector_store.similarity_search_with_score_by_vector(
+            vector, k=k
+        )
+
+    with span("collab.read_filter"):
+        # catalog positions of the books read, from `InteractionSets` instead of scanning every interaction
+        _, read = interactions.gather(interactions.rows_for([id]))
+        read = set(read.tolist())
+    with span("collab.rank"):
+        recommended_books = {}
+        for res, score in results_collab:
+            isbns = res.metadata['isbns']
+            for isbn in isbns:
+                # books removed from the catalog since the neighbour was indexed have no position
+                pos = catalog.isbn_to_pos.get(isbn)
+                if pos is not None and pos not in read:
+                    recommended_books[isbn] = recommended_books.get(isbn, 0) + 1
+
+        rec_books = list(recommended_books.items())
+        rec_books.sort(key=lambda x: x[1], reverse=True)
+        rec_books = rec_books[:5]
+        isbns = [ele[0] for ele in rec_books]
+        titles = catalog.titles_for(isbns)
+
+    urls = retrieve_images(isbns, catalog)
     return urls, titles, isbns
 
 
-def retrieve_images(book_ids):
-    urls = []
-    for book_id in book_ids:
-        urls.append(df[df['isbn'] == book_id]['new_image_url'].astype(str).values[0])
-    return urls
+@timed("retrieve_images")
+def retrieve_images(book_ids, catalog):
+    return catalog.image_urls_for(book_ids)
@@ -0,0 +1,198 @@
+"""
+Offline job computing the top-N collaborative recommendations of every user and the content recommendations
+of every book, and storing them in MongoDB for the serving path to read by key.
+
+    python -m src.models.precompute_recommendations --chunk-size 1000 --workers 4
+
+Work is split into chunks of users and books. Finished chunks are recorded in a checkpoint file keyed by the
+model bundle version, so an interrupted run resumes where it stopped and a new model starts from scratch.
+
+Rows are keyed by the data hash of the collections the bundle was built or synced for. A server refreshing
+its model live keeps reading the rows of that hash, skipping the users and titles changed since it loaded and
+rows recommending removed books (see `Recommender.precomputed_version`); books added since the job ran only
+show up in the rows of the next run.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.dbutils import dbwrapper
+from src.dbutils.connect_database import REQUEST_RETRY
+from src.models import batch_recommend, jaykishan_model_building
+from src.models.interactions import InteractionSets
+
+COLLAB_COLLECTION = "collab_recommendations"
+CONTENT_COLLECTION = "content_recommendations"
+DEFAULT_CHECKPOINT_DIR = os.getenv("PRECOMPUTE_CHECKPOINT_DIR", "artifacts/checkpoints")
+
+
+class Checkpoint:
+    """
+    Set of finished chunk keys persisted to a JSON file.
+
+    Attributes:
+        path (str): Location of the checkpoint file.
+        done (set): Keys of the finished chunks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.done = set(json.load(f))
+        except (OSError, ValueError):
+            self.done = set()
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def mark(self, key):
+        """Records `key` as finished and rewrites the checkpoint file atomically."""
+        with self.lock:
+            self.done.add(key)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(sorted(self.done), f)
+            os.replace(tmp_path, self.path)
+
+
+def results_to_documents(results, model_version, extra=None):
+    """
+    Groups a batch result frame into one MongoDB document per query, keyed by `_id` = user id or title.
+
+    Args:
+        results (DataFrame): Output of a `batch_recommend` function.
+        model_version (str): Data hash of the bundle the recommendations were computed with.
+        extra (dict, optional): Additional fields per query value, e.g. the ISBN of a title.
+
+    Returns:
+        list: The documents, with the recommended `isbns`, `titles`, `image_urls` and `scores` in rank order.
+    """
+    updated_at = datetime.datetime.now(datetime.timezone.utc)
+    documents = []
+    for query, group in results.groupby("query", sort=False):
+        document = {
+            "_id": query.item() if hasattr(query, "item") else query,
+            "isbns": group["isbn"].tolist(),
+            "titles": group["title"].tolist(),
+            "image_urls": group["image_url"].tolist(),
+            "scores": group["score"].astype(int).tolist(),
+            "model_version": model_version,
+            "updated_at": updated_at,
+        }
+        document.update((extra or {}).get(query, {}))
+        documents.append(document)
+    return documents
+
+
+def lookup_precomputed(collection_name, condition, model_version):
+    """
+    Reads precomputed recommendations for the serving path, retrying only briefly (`REQUEST_RETRY`): when
+    the database is unavailable the caller searches live instead of waiting.
+
+    Args:
+        collection_name (str): `COLLAB_COLLECTION` or `CONTENT_COLLECTION`.
+        condition (dict): Key of the user or book, e.g. `{"_id": 42}` or `{"_id": "Dune"}`.
+        model_version (str): Data hash of the collections the bundle was loaded for; documents of other
+                             versions are ignored.
+
+    Returns:
+        tuple or None: `(urls, titles, isbns)` like the live recommenders, or None if nothing is stored.
+    """
+    try:
+        document = dbwrapper.fetch_documents(collection_name, condition=dict(condition, model_version=model_version),
+                                             one=True, retry=REQUEST_RETRY)
+    except Exception as e:
+        logging.warning("Reading precomputed recommendations from %s failed: %s", collection_name, e)
+        return None
+    if not document:
+        return None
+    return document["image_urls"], document["titles"], document["isbns"]
+
+
+def _chunks(values, chunk_size):
+    for start in range(0, len(values), chunk_size):
+        yield start // chunk_size, values[start:start + chunk_size]
+
+
+def run(chunk_size=1000, workers=4, checkpoint_dir=DEFAULT_CHECKPOINT_DIR, modes=("collab", "content"), n=5):
+    """
+    Computes and stores the recommendations of all users and books.
+
+    Args:
+        chunk_size (int, optional): Users or books per batch query and bulk write. Defaults to 1000.
+        workers (int, optional): Chunks processed in parallel. Defaults to 4.
+        checkpoint_dir (str, optional): Directory of the checkpoint files.
+        modes (tuple, optional): Which recommendations to compute, `"collab"` and/or `"content"`.
+        n (int, optional): Recommendations stored per user or book. Defaults to 5.
+
+    Returns:
+        dict: Number of documents written per mode.
+    """
+    user_book_df = dbwrapper.fetch_dataframe('books_data', jaykishan_model_building.INTERACTION_COLUMNS)
+    df = dbwrapper.fetch_dataframe('all_books', jaykishan_model_building.BOOK_COLUMNS)
+    bundle = jaykishan_model_building.load_or_build_model(df, user_book_df)
+    catalog = bundle.catalog
+    interactions = InteractionSets.from_frame(user_book_df, catalog)
+    checkpoint = Checkpoint(os.path.join(checkpoint_dir, f"precompute-{bundle.data_hash[:16]}.json"))
+    isbn_of_title = {title: {"isbn": catalog.isbns[pos]} for title, pos in catalog.title_to_pos.items()}
+
+    def collab_chunk(user_ids):
+        results = batch_recommend.recommend_books_collab_batch(user_ids, bundle.collab_vector_store, interactions,
+                                                               catalog, bundle.user_vectors, bundle.books_data, n=n)
+        return COLLAB_COLLECTION, results_to_documents(results, bundle.data_hash)
+
+    def content_chunk(titles):
+        results = batch_recommend.recommend_books_content_batch(titles, bundle.content_vector_store, catalog, n=n)
+        return CONTENT_COLLECTION, results_to_documents(results, bundle.data_hash, isbn_of_title)
+
+    jobs = []
+    if "collab" in modes:
+        jobs += [(f"collab-{i}", collab_chunk, chunk)
+                 for i, chunk in _chunks(bundle.user_vectors.user_ids.tolist(), chunk_size)]
+    if "content" in modes:
+        jobs += [(f"content-{i}", content_chunk, chunk) for i, chunk in _chunks(list(isbn_of_title), chunk_size)]
+    pending = [job for job in jobs if job[0] not in checkpoint]
+    logging.info("%d of %d chunks already done, processing %d", len(jobs) - len(pending), len(jobs), len(pending))
+
+    written = {COLLAB_COLLECTION: 0, CONTENT_COLLECTION: 0}
+
+    def process(job):
+        key, func, chunk = job
+        collection_name, documents = func(chunk)
+        dbwrapper.bulk_upsert(collection_name, documents)
+        checkpoint.mark(key)
+        return collection_name, len(documents)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for done, (collection_name, count) in enumerate(executor.map(process, pending), 1):
+            written[collection_name] += count
+            logging.info("Chunk %d/%d written (%.1f docs/sec)", done, len(pending),
+                         sum(written.values()) / (time.perf_counter() - start))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR)
+    parser.add_argument("--modes", nargs="+", choices=["collab", "content"], default=["collab", "content"])
+    parser.add_argument("-n", type=int, default=5, help="recommendations stored per user or book")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    written = run(args.chunk_size, args.workers, args.checkpoint_dir, tuple(args.modes), args.n)
+    logging.info("Done: %s", written)
+
+
+if __name__ == "__main__":
+    main()
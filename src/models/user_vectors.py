@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+
+USER_IDS_FILE = "user_ids.npy"
+USER_VECTORS_FILE = "user_vectors.npy"
+
+
+class UserVectorCache:
+    """
+    Embedding of every user's reading history, addressable by user id.
+
+    The vectors are computed once when the model is built, so collaborative recommendations query the
+    index with a stored vector instead of re-embedding the user's whole history text on every request.
+
+    Attributes:
+        user_ids (ndarray): User id of every row.
+        vectors (ndarray): `(num_users, dim)` float32 matrix, possibly a read-only memory map.
+        id_to_row (dict): User id to row of `vectors`.
+    """
+
+    def __init__(self, user_ids, vectors):
+        self.user_ids = np.asarray(user_ids)
+        self.vectors = vectors
+        self.id_to_row = {user_id: row for row, user_id in enumerate(self.user_ids.tolist())}
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        return user_id in self.id_to_row
+
+    def vector(self, user_id):
+        """Returns the vector of `user_id`. Raises `KeyError` for unknown users."""
+        return self.vectors[self.id_to_row[user_id]]
+
+    def vectors_for(self, user_ids):
+        """Returns the `(len(user_ids), dim)` matrix of vectors of `user_ids`."""
+        rows = np.fromiter((self.id_to_row[user_id] for user_id in user_ids), dtype=np.int64, count=len(user_ids))
+        return np.ascontiguousarray(self.vectors[rows], dtype=np.float32)
+
+    def upsert(self, user_ids, vectors):
+        """Replaces the vectors of known users and appends the new ones. A memory-mapped matrix is copied first."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not self.vectors.flags.writeable:
+            self.vectors = np.array(self.vectors, dtype=np.float32)
+        rows = np.fromiter((self.id_to_row.get(user_id, -1) for user_id in user_ids), dtype=np.int64,
+                           count=len(user_ids))
+        known = rows >= 0
+        self.vectors[rows[known]] = vectors[known]
+        new_ids = [user_id for user_id, ok in zip(user_ids, known) if not ok]
+        if new_ids:
+            start = len(self.user_ids)
+            self.user_ids = np.concatenate([self.user_ids, np.asarray(new_ids, dtype=self.user_ids.dtype)])
+            self.vectors = np.concatenate([self.vectors, vectors[~known]])
+            self.id_to_row.update((user_id, start + i) for i, user_id in enumerate(new_ids))
+
+    def remove(self, user_ids):
+        """Drops the vectors of `user_ids`. Unknown users are ignored."""
+        rows = [self.id_to_row[user_id] for user_id in user_ids if user_id in self.id_to_row]
+        if rows:
+            self.user_ids = np.delete(self.user_ids, rows)
+            self.vectors = np.delete(self.vectors, rows, axis=0)
+            self.id_to_row = {user_id: row for row, user_id in enumerate(self.user_ids.tolist())}
+
+    def save(self, path):
+        np.save(os.path.join(path, USER_IDS_FILE), self.user_ids)
+        np.save(os.path.join(path, USER_VECTORS_FILE), np.ascontiguousarray(self.vectors, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a cache written by `save`, memory-mapping the vectors unless `mmap` is `False`."""
+        user_ids = np.load(os.path.join(path, USER_IDS_FILE))
+        vectors = np.load(os.path.join(path, USER_VECTORS_FILE), mmap_mode="r" if mmap else None)
+        return cls(user_ids, vectors)
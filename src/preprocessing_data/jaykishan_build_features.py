@@ -1,89 +1,92 @@
 # all featuring engineering functions put in this script like remove stopwords, lemitization, translation and cleaning data
 import pandas as pd
 import numpy as np
-from googletrans import Translator
-from langdetect import detect
-from langdetect.lang_detect_exception import LangDetectException
-
-
-def build_features(df):
+from src.preprocessing_data import translation
+
+
+# Column: (value missing values are filled with, dtype). 'median' fills with the column median, None leaves
+# them missing. Repeated strings become categoricals and counts the smallest int that holds them.
+FEATURE_SCHEMA = {
+    'book_id': (0, 'int32'),
+    'publication_year': (0, 'int16'),
+    'publication_month': (0, 'int8'),
+    'average_rating': (None, 'float32'),
+    'ratings_count': (0, 'int32'),
+    'language_code': ('unknown', 'category'),
+    'country_code': ('unknown', 'category'),
+    'num_pages': ('median', 'float32'),
+    'publisher': ('unknown', 'category'),
+    'text_reviews_count': (0, 'int32'),
+}
+
+IMAGE_URL_PREFIX = "https://images-na.ssl-images-amazon.com/images/S/compressed.photo.goodreads.com/books/"
+
+
+def apply_schema(df, schema=FEATURE_SCHEMA):
+    """
+    Fills missing values and converts the columns of `schema` in one pass.
+
+    Args:
+        df (DataFrame): The raw book catalog.
+        schema (dict): Column to `(fill value, dtype)`, see `FEATURE_SCHEMA`.
+
+    Returns:
+        DataFrame: A copy of `df` with the converted columns.
+    """
+    converted = {}
+    for column, (fill, dtype) in schema.items():
+        values = df[column]
+        if dtype != 'category':
+            # Raw goodreads dumps hold numbers as strings, empty when missing.
+            values = pd.to_numeric(values, errors='coerce')
+        if fill == 'median':
+            fill = values.median()
+        if fill is not None:
+            values = values.fillna(fill)
+        converted[column] = values.astype(dtype)
+    return df.assign(**converted)
+
+
+def new_image_urls(image_urls, book_ids):
+    """
+    Rewrites goodreads cover urls to the larger cover on the Amazon CDN.
+
+    `https://images.gr-assets.com/books/1361039443m/41865.jpg` of book 41865 becomes
+    `IMAGE_URL_PREFIX + '1361039443i/41865.jpg'`: the size suffix of the second to last path segment is
+    replaced with 'i'.
+
+    Args:
+        image_urls (Series): The `image_url` column.
+        book_ids (Series): The `book_id` column, aligned with `image_urls`.
+
+    Returns:
+        Series: The new urls, missing where `image_url` is missing or contains no '/'. With a single '/', the
+                part before it is taken as the second to last segment.
+    """
+    code = image_urls.str.rsplit('/', n=2).str[-2].str[:-1]
+    return IMAGE_URL_PREFIX + code + 'i/' + book_ids.astype(str) + '.jpg'
+
+
+def build_features(df, translation_backend=None, translation_cache=None):
     # Removing duplicates
     df.drop_duplicates(inplace=True)
 
-    translator = Translator()
-    translations_cache = {}  # Cache for storing previously translated texts
-
-    # Translate non-english description to english
-    def translate_to_english(text):
-        if not text or text in translations_cache:
-            return translations_cache.get(text, text)
-
-        try:
-            # Detect language and translate if necessary
-            detected_lang = detect(text)
-            if detected_lang != 'en':
-                translation = translator.translate(text, src=detected_lang, dest='en').text
-                translations_cache[text] = translation  # Cache the translation
-                return translation
-            else:
-                return text
-        except LangDetectException:
-            print(f"Language detection failed for: {text}")
-        except Exception as e:
-            print(f"Translation failed for text: {text} - Error: {e}")
-
-        return text
-
-    # Function to detect language_code
-    def detect_language(text):
-        try:
-            return detect(text)
-        except LangDetectException:
-            return 'unknown'
-
-    df['description'] = df['description'].apply(translate_to_english)  # Translate description
-    df['language_code_new'] = df['description'].apply(detect_language)  # Identify language_code
+    # Translate non-english description to english and identify language_code. Every distinct description
+    # is detected and translated once, earlier runs' results come from the translation cache.
+    descriptions, languages = translation.translate_texts(
+        df['description'].tolist(), backend=translation_backend, cache=translation_cache)
+    df['description'] = descriptions
+    df['language_code_new'] = languages
 
     # Correcting the datatypes and filling up the missing values
-    df['book_id'] = df['book_id'].fillna(0).astype(int)
-    df['publication_year'] = df['publication_year'].fillna(0).astype(int)
-    df['publication_month'] = df['publication_month'].fillna(0).astype(int)
-    df['average_rating'] = df['average_rating'].astype(float)
-    df['ratings_count'] = df['ratings_count'].fillna(0).astype(int)
-    df['language_code'] = df['language_code'].fillna('unknown').astype(str)
-    df['country_code'] = df['country_code'].fillna('unknown').astype(str)
-    df['num_pages'] = df['num_pages'].fillna(df['num_pages'].median())
-    df['publisher'] = df['publisher'].fillna('unknown')
-    df['text_reviews_count'] = df['text_reviews_count'].fillna(0).astype(int)
+    df = apply_schema(df)
 
     df.drop_duplicates(subset='isbn', keep='first', inplace=True)
     df.drop_duplicates(subset='title', keep='first', inplace=True)
 
-    new_image_urls = []
-
-    # Function to adjust the image_url parameter
-    def new_image_url(image_url, book_id):
-
-        # Replacing m with i
-        p = image_url.rfind('/')
-        code = image_url[:p - 1] + 'i'
-        p = code.rfind('/')
-        code = code[p + 1:]
-
-        # Replacing the front
-        p = image_url.find('books')
-
-        fore = "https://images-na.ssl-images-amazon.com/images/S/compressed.photo.goodreads.com/books/"
-        new_url = fore + str(code) + '/' + str(book_id) + '.jpg'
-        return new_url
-
-    for i in range(len(df)):
-        temp = df.loc[i]
-        new_image_urls.append(new_image_url(temp['image_url'], temp['book_id']))
-
-    df['new_image_url'] = new_image_urls
+    df['new_image_url'] = new_image_urls(df['image_url'], df['book_id'])
 
     # Selecting all the relevant columns.
-    data = df[['isbn', 'title', 'description', 'average_rating', 'language_code', 'image_url', 'authors']]
-    # Save the csv file
+    data = df[['isbn', 'title', 'description', 'average_rating', 'language_code', 'image_url', 'new_image_url',
+               'authors']]
     return data
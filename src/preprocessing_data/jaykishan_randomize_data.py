@@ -5,10 +5,18 @@ import numpy as np
 import random
 np.random.seed(3)
 
+# Users the model is built from, and kept up to date with: ids 1 to NUM_USERS.
+NUM_USERS = 500
+
+
+# This function keeps the user ids the model is built from, in their order.
+def model_users(user_ids):
+    return [user_id for user_id in user_ids if user_id in range(1, NUM_USERS + 1)]
+
+
 # This function will randomize assign books to 'num_users' users.
 def randomize_data(df):
-    num_users = 500
-    users = [x for x in range(1, num_users + 1)]
+    users = model_users(range(1, NUM_USERS + 1))
     random.shuffle(users, )
 
     # extract 90% of user ID's
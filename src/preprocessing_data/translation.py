@@ -0,0 +1,181 @@
+"""
+Language detection and translation of book descriptions to English.
+
+Every distinct description is detected once, across a process pool since langdetect is pure Python, and
+only the non-English ones are sent to the translation backend, through a bounded thread pool since
+translation is network bound. Results are kept in a SQLite cache keyed by the hash of the text, so
+descriptions seen in an earlier run are neither detected nor translated again.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+from langdetect import DetectorFactory, detect
+from langdetect.lang_detect_exception import LangDetectException
+
+# Makes detection deterministic, so cached and freshly detected languages agree.
+DetectorFactory.seed = 0
+
+DEFAULT_CACHE_PATH = os.getenv("TRANSLATION_CACHE", "translation_cache.sqlite")
+# "google" or "noop"
+DEFAULT_BACKEND = os.getenv("TRANSLATION_BACKEND", "google")
+DETECT_WORKERS = int(os.getenv("DETECT_WORKERS", os.cpu_count() or 1))
+TRANSLATE_WORKERS = int(os.getenv("TRANSLATE_WORKERS", 8))
+UNKNOWN_LANGUAGE = "unknown"
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def detect_language(text):
+    """Returns the language code of `text`, or 'unknown' if it cannot be detected."""
+    try:
+        return detect(text)
+    except LangDetectException:
+        return UNKNOWN_LANGUAGE
+
+
+def detect_languages(texts, workers=DETECT_WORKERS):
+    """Detects the language of every text, across `workers` processes when there is more than one."""
+    if workers <= 1 or len(texts) < 2 * workers:
+        return [detect_language(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(detect_language, texts, chunksize=max(1, len(texts) // (4 * workers))))
+
+
+class NoopBackend:
+    """Leaves texts untranslated, for offline runs and tests. Nothing it returns is cached."""
+
+    def translate(self, text, src):
+        return None
+
+
+class GoogleBackend:
+    """Translates through the Google Translate web API (`googletrans`)."""
+
+    def __init__(self):
+        from googletrans import Translator
+        self.translator = Translator()
+
+    def translate(self, text, src):
+        return self.translator.translate(text, src=src, dest="en").text
+
+
+def make_backend(name=DEFAULT_BACKEND):
+    """Returns the translation backend called `name` ("google" or "noop")."""
+    if name == "noop":
+        return NoopBackend()
+    if name == "google":
+        return GoogleBackend()
+    raise ValueError(f"Unknown translation backend {name!r}")
+
+
+class TranslationCache:
+    """
+    SQLite table of `(text hash, language, English text)` rows persisting across runs.
+
+    Only used from the thread that created it; the worker pools return their results to that thread.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS translations (hash TEXT PRIMARY KEY, language TEXT, translation TEXT)")
+
+    def get_many(self, hashes):
+        """Returns `{hash: (language, translation)}` for the cached hashes among `hashes`."""
+        found = {}
+        hashes = list(hashes)
+        # Stays below SQLite's limit on the number of query parameters.
+        for start in range(0, len(hashes), 900):
+            chunk = hashes[start:start + 900]
+            rows = self.connection.execute(
+                f"SELECT hash, language, translation FROM translations WHERE hash IN ({','.join('?' * len(chunk))})",
+                chunk)
+            found.update((row[0], (row[1], row[2])) for row in rows)
+        return found
+
+    def put_many(self, rows):
+        """Stores `(hash, language, translation)` rows, replacing existing ones."""
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?)", rows)
+
+    def close(self):
+        self.connection.close()
+
+
+def translate_texts(texts, backend=None, cache=None, detect_workers=DETECT_WORKERS,
+                    translate_workers=TRANSLATE_WORKERS):
+    """
+    Translates texts to English, detecting and translating every distinct text only once.
+
+    Texts the backend fails on or returns None for are returned unchanged, in their own language, and left
+    out of the cache, so the next run retries them.
+
+    Args:
+        texts (list): The texts, e.g. the `description` column. Empty and missing values are returned as is.
+        backend (NoopBackend or GoogleBackend, optional): Translation backend. Defaults to `make_backend()`.
+        cache (TranslationCache, optional): Persistent cache. Defaults to the cache at `DEFAULT_CACHE_PATH`.
+        detect_workers (int, optional): Processes detecting languages.
+        translate_workers (int, optional): Translation requests in flight at once.
+
+    Returns:
+        tuple: `(translations, languages)`, aligned with `texts`. The language is the one of the returned
+               text: 'en' for translated texts, 'unknown' for empty or undetectable ones.
+    """
+    start = time.perf_counter()
+    own_cache = cache is None
+    cache = TranslationCache() if own_cache else cache
+    try:
+        unique = [text for text in pd.unique(pd.Series(texts, dtype=object)) if isinstance(text, str) and text]
+        hashes = {text: text_hash(text) for text in unique}
+        cached = cache.get_many(hashes.values())
+        results = {text: cached[hashes[text]] for text in unique if hashes[text] in cached}
+
+        pending = [text for text in unique if text not in results]
+        languages = detect_languages(pending, detect_workers)
+        to_translate = []
+        for text, language in zip(pending, languages):
+            if language in ("en", UNKNOWN_LANGUAGE):
+                results[text] = (language, text)
+            else:
+                to_translate.append((text, language))
+        untranslated = set()
+
+        if to_translate:
+            backend = backend or make_backend()
+
+            def translate(item):
+                text, language = item
+                try:
+                    return backend.translate(text, language)
+                except Exception as e:
+                    logging.warning("Translation from %s failed: %s", language, e)
+                    return None
+
+            with ThreadPoolExecutor(max_workers=translate_workers) as executor:
+                translated = list(executor.map(translate, to_translate))
+            for (text, language), translation in zip(to_translate, translated):
+                if translation is None:
+                    untranslated.add(text)
+                    results[text] = (language, text)
+                else:
+                    results[text] = ("en", translation)
+
+        cache.put_many([(hashes[text], *results[text]) for text in pending if text not in untranslated])
+    finally:
+        if own_cache:
+            cache.close()
+
+    logging.info("Translated %d texts (%d distinct, %d not cached, %d of %d non-English translated) in %.2fs",
+                 len(texts), len(unique), len(pending), len(to_translate) - len(untranslated), len(to_translate),
+                 time.perf_counter() - start)
+    translations = [results[text][1] if isinstance(text, str) and text else text for text in texts]
+    languages = [results[text][0] if isinstance(text, str) and text else UNKNOWN_LANGUAGE for text in texts]
+    return translations, languages
@@ -0,0 +1,290 @@
+"""
+Background refresh of a running `Recommender` from changes to the `all_books` and `books_data` collections.
+
+One thread per collection tails a MongoDB change stream, or, where change streams are unavailable (standalone
+servers, mongomock), polls for documents with a newer `_id` or `updated_at`. Changes are queued and applied in
+micro-batches by a single worker thread: new and changed books are embedded and indexed, and users whose
+ratings changed get their history re-read and re-embedded. Embedding happens outside the bundle lock, so
+request threads only wait for the short index mutation itself.
+
+Polling cannot see deletions at all, and change streams only report which book or rating was deleted when
+pre-images are enabled on the collection; deletions missed either way are picked up by the incremental sync on
+the next restart. Polling finds updated documents by their `updated_at` field, which must hold a BSON date
+(like the `updated_at` of `precompute_recommendations`): MongoDB does not compare dates with numbers.
+
+With several serving processes only one watches the collections and embeds the changes; it appends them, with
+their vectors, to the bundle's delta log, and the other processes can apply them from there with a
+`LogFollower`. Every process applying changes holds its own in-memory copy of the indexes (see
+`IncrementalUpdater`), so the HTTP service only has its other workers follow the log with
+`LIVE_REFRESH_ALL_WORKERS=1`.
+"""
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+from pymongo.errors import OperationFailure
+
+from src.dbutils import dbwrapper
+from src.models import jaykishan_model_building
+from src.models.incremental import IncrementalUpdater
+
+BOOKS_COLLECTION = "all_books"
+RATINGS_COLLECTION = "books_data"
+LIVE_REFRESH = os.getenv("LIVE_REFRESH", "0") == "1"
+LIVE_REFRESH_ALL_WORKERS = os.getenv("LIVE_REFRESH_ALL_WORKERS", "0") == "1"
+BATCH_SIZE = int(os.getenv("LIVE_REFRESH_BATCH_SIZE", 500))
+MAX_DELAY = float(os.getenv("LIVE_REFRESH_MAX_DELAY", 2))
+POLL_INTERVAL = float(os.getenv("LIVE_REFRESH_POLL_INTERVAL", 5))
+FOLLOW_INTERVAL = float(os.getenv("LIVE_REFRESH_FOLLOW_INTERVAL", 1))
+# Field holding the last modification time, used by polling to find updated documents.
+UPDATED_FIELD = os.getenv("LIVE_REFRESH_UPDATED_FIELD", "updated_at")
+# Fields a book needs to be embedded and indexed; books missing any of them are skipped.
+REQUIRED_BOOK_FIELDS = ["isbn", "title", "description"]
+
+
+class ChangeWatcher:
+    """
+    Tails the collections and applies their changes to a recommender in micro-batches.
+
+    Attributes:
+        recommender (Recommender): The service kept up to date.
+        updater (IncrementalUpdater): Applies the changes to the recommender's bundle.
+        batch_size (int): Changes applied at most per batch.
+        max_delay (float): Seconds a change waits at most for its batch to fill up.
+        use_change_streams (bool): Try change streams before falling back to polling.
+        stats (dict): Number of `changes` seen, `batches` applied and `errors`, and `last_applied` time.
+    """
+
+    def __init__(self, recommender, updater=None, batch_size=BATCH_SIZE, max_delay=MAX_DELAY,
+                 poll_interval=POLL_INTERVAL, use_change_streams=True, persist=True):
+        self.recommender = recommender
+        self.updater = updater or IncrementalUpdater(recommender.bundle)
+        if not persist:
+            # Only one process may append to a bundle's delta log, the others keep their changes in memory.
+            self.updater.log = None
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_change_streams = use_change_streams
+        self.changes = queue.Queue()
+        self.stopped = threading.Event()
+        self.threads = []
+        self.resume_tokens = {}
+        self.stats = {"changes": 0, "batches": 0, "errors": 0, "last_applied": None}
+
+    def start(self):
+        """Starts the tailing threads and the worker thread applying the batches."""
+        for collection_name in (BOOKS_COLLECTION, RATINGS_COLLECTION):
+            self.threads.append(threading.Thread(target=self._tail, args=(collection_name,),
+                                                 name=f"watch-{collection_name}", daemon=True))
+        self.threads.append(threading.Thread(target=self._apply_loop, name="watch-apply", daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _tail(self, collection_name):
+        while not self.stopped.is_set():
+            try:
+                if self.use_change_streams:
+                    try:
+                        self._watch(collection_name)
+                        continue
+                    # Standalone servers refuse change streams; mongomock has no `watch` and raises TypeError.
+                    except (OperationFailure, NotImplementedError, TypeError) as e:
+                        logging.warning("Change streams unavailable on %s (%s), polling instead", collection_name, e)
+                        self.use_change_streams = False
+                self._poll(collection_name)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.exception("Watching %s failed: %s", collection_name, e)
+                self.stopped.wait(self.poll_interval)
+
+    def _watch(self, collection_name):
+        def open_stream(database):
+            return database[collection_name].watch(full_document="updateLookup",
+                                                   full_document_before_change="whenAvailable",
+                                                   resume_after=self.resume_tokens.get(collection_name),
+                                                   max_await_time_ms=1000)
+
+        with dbwrapper.get_connection().run("watch", open_stream) as stream:
+            while not self.stopped.is_set() and stream.alive:
+                event = stream.try_next()
+                self.resume_tokens[collection_name] = stream.resume_token
+                if event is None:
+                    continue
+                self.changes.put({
+                    "collection": collection_name,
+                    "operation": event["operationType"],
+                    "document": event.get("fullDocument") or event.get("fullDocumentBeforeChange"),
+                })
+
+    def _poll(self, collection_name):
+        """Polls for new `_id`s and newer `UPDATED_FIELD` dates. Deleted documents are never seen this way."""
+        newest = dbwrapper.fetch_documents(collection_name, limit_count=1, columns={"_id": 1},
+                                           sort_condition=("_id", -1))
+        last_id = newest[0]["_id"] if newest else None
+        last_updated = datetime.datetime.now(datetime.timezone.utc)
+
+        while not self.stopped.wait(self.poll_interval):
+            condition = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            for document in dbwrapper.fetch_documents(collection_name, condition=condition,
+                                                      sort_condition=("_id", 1)):
+                last_id = document["_id"]
+                self.changes.put({"collection": collection_name, "operation": "insert", "document": document})
+
+            since, last_updated = last_updated, datetime.datetime.now(datetime.timezone.utc)
+            for document in dbwrapper.fetch_documents(collection_name, condition={UPDATED_FIELD: {"$gt": since}}):
+                self.changes.put({"collection": collection_name, "operation": "update", "document": document})
+
+    def _apply_loop(self):
+        while not self.stopped.is_set():
+            try:
+                batch = [self.changes.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.changes.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.apply_batch(batch)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.exception("Applying %d changes failed: %s", len(batch), e)
+
+    def apply_batch(self, batch):
+        """
+        Applies one micro-batch of changes.
+
+        Changed books are read again by `_id`, like the ratings of changed users, so partial documents (e.g.
+        an update of `updated_at` only) are applied with all their fields. Books still missing one of the
+        `REQUIRED_BOOK_FIELDS` are logged and skipped.
+
+        Args:
+            batch (list): Changes as `{"collection", "operation", "document"}` dicts, `document` being the
+                          document after the change, or before it for deletions.
+        """
+        self.stats["changes"] += len(batch)
+        book_ids = {}
+        removed_isbns = set()
+        users = set()
+        for change in batch:
+            document = change["document"]
+            if document is None:
+                logging.warning("Skipping %s on %s without document", change["operation"], change["collection"])
+                continue
+            if change["collection"] == BOOKS_COLLECTION:
+                if change["operation"] != "delete" and "_id" in document:
+                    book_ids[document["_id"]] = document.get("isbn")
+                    removed_isbns.discard(document.get("isbn"))
+                elif change["operation"] == "delete" and "isbn" in document:
+                    removed_isbns.add(document["isbn"])
+                    book_ids.pop(document.get("_id"), None)
+            elif change["collection"] == RATINGS_COLLECTION and "user_id" in document:
+                users.add(document["user_id"])
+
+        books = _read_books(list(book_ids), removed_isbns) if book_ids else []
+        if len(books):
+            self.updater.upsert_books(books)
+            self.recommender.books_changed(books["title"].tolist())
+        if removed_isbns:
+            self.updater.remove_books(removed_isbns)
+            self.recommender.refresh_catalog()
+        if users:
+            users = sorted(users)
+            frame = dbwrapper.fetch_dataframe(RATINGS_COLLECTION, jaykishan_model_building.INTERACTION_COLUMNS,
+                                              condition={"user_id": {"$in": users}})
+            self.updater.upsert_users(frame, users)
+            self.recommender.update_interactions(users, frame)
+        self.stats["batches"] += 1
+        self.stats["last_applied"] = time.time()
+        logging.info("Applied %d changes: %d books, %d removed, %d users", len(batch), len(books),
+                     len(removed_isbns), len(users))
+
+
+def _read_books(book_ids, removed_isbns):
+    """Reads the current `BOOK_COLUMNS` of the books with `_id` in `book_ids`, without incomplete or removed ones."""
+    frame = dbwrapper.fetch_dataframe(BOOKS_COLLECTION, jaykishan_model_building.BOOK_COLUMNS,
+                                      condition={"_id": {"$in": book_ids}})
+    frame = frame.reindex(columns=jaykishan_model_building.BOOK_COLUMNS)
+    complete = frame[REQUIRED_BOOK_FIELDS].notna().all(axis=1)
+    if not complete.all():
+        logging.warning("Skipping %d changed books missing one of %s: %s", (~complete).sum(), REQUIRED_BOOK_FIELDS,
+                        frame.loc[~complete, "isbn"].tolist())
+    return frame[complete & ~frame["isbn"].isin(removed_isbns)]
+
+
+class LogFollower:
+    """
+    Applies the changes another process appends to a bundle's delta log, without watching or embedding.
+
+    The records carry their vectors and, for users, their interactions, so following costs no embedding and no
+    database read; every process serving the bundle ends up with the same model as the one watching.
+
+    Attributes:
+        recommender (Recommender): The service kept up to date.
+        log (DeltaLog): The log followed.
+        offset (int): Bytes of the log already applied.
+        stats (dict): Number of `records` applied and `errors`, and `last_applied` time.
+    """
+
+    def __init__(self, recommender, log, offset, interval=FOLLOW_INTERVAL):
+        self.recommender = recommender
+        self.updater = IncrementalUpdater(recommender.bundle)
+        # Applied records are already in the log.
+        self.updater.log = None
+        self.log = log
+        self.offset = offset
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = {"records": 0, "errors": 0, "last_applied": None}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._follow_loop, name="follow-delta-log", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _follow_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.exception("Following %s failed: %s", self.log.log_path, e)
+
+    def poll(self):
+        """Applies the records logged since the last call. Returns how many were applied."""
+        records, end = self.log.read_from(self.offset)
+        for record in records:
+            self.updater.apply([record], log=False)
+            if record["op"] in ("upsert_users", "interactions"):
+                self.recommender.update_interactions(record["user_ids"], record.get("interactions"))
+            elif record["op"] == "remove_users":
+                self.recommender.update_interactions(record["user_ids"])
+            elif record["op"] == "upsert_books":
+                self.recommender.books_changed(record["frame"]["title"].tolist())
+            elif record["op"] == "remove_books":
+                self.recommender.refresh_catalog()
+        self.offset = end
+        if records:
+            self.stats["records"] += len(records)
+            self.stats["last_applied"] = time.time()
+            logging.info("Applied %d delta log records, model version %s", len(records),
+                         self.recommender.bundle.data_hash)
+        return len(records)
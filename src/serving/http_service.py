@@ -0,0 +1,364 @@
+"""
+Headless JSON HTTP API over the same loaded model as the Gradio demo.
+
+    GET  /recommend/user/{id}?n=5        collaborative recommendations of one user
+    GET  /recommend/book?title=...&n=5   content based recommendations of one title
+    POST /recommend/users  {"user_ids": [...], "n": 5}
+    POST /recommend/books  {"titles": [...], "n": 5}
+    GET  /health
+    GET  /metrics                        Prometheus metrics, see `src.instrumentation`
+
+`n` is at least 1, and at most `MAX_SINGLE_N` on the single user and title endpoints. Invalid requests are
+answered with 400, unexpected failures with 500.
+
+    python -m src.serving.http_service --port 8000 --workers 4
+
+Connections are kept alive (HTTP/1.1) and every response carries a `Server-Timing` header with the time
+spent handling it. With `--workers N` the model is loaded once, then N processes are forked that accept on
+the same socket; the memory-mapped index pages stay shared between them through the page cache.
+
+With `--live-refresh` (or `LIVE_REFRESH=1`) changes to the collections are applied to the model as they happen,
+see `src.serving.change_watcher`. With several workers only the first one applies them by default: applying
+changes copies the memory-mapped indexes into the worker's memory, and the other workers keep serving the
+shared, memory-mapped model as loaded, until restarted. With `--live-refresh-all-workers` (or
+`LIVE_REFRESH_ALL_WORKERS=1`) the other workers follow the delta log the first one appends the changes to,
+so every worker serves the current model, at the cost of one in-memory copy of the indexes per worker.
+
+With `--collab-engine item_cf` (or `COLLAB_ENGINE=item_cf`) user recommendations come from the sparse item-item
+model of `src.models.item_cf` instead of the user history index.
+
+`/metrics` is empty unless recording is on, with `--metrics` (or `METRICS_ENABLED=1`). With several workers
+they share their metrics through files in `METRICS_MULTIPROCESS_DIR` (a temporary directory by default), so
+every scrape reports the requests of all workers, whichever one answers it; see `instrumentation.share`.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from src import instrumentation
+from src.dbutils import dbwrapper
+from src.models.incremental import DeltaLog
+from src.models.item_cf import COLLAB_ENGINES, DEFAULT_COLLAB_ENGINE
+from src.serving.change_watcher import LIVE_REFRESH, LIVE_REFRESH_ALL_WORKERS
+from src.serving.recommender import load_recommender
+
+DEFAULT_TIMEOUT = float(os.getenv("RECOMMEND_TIMEOUT", 10))
+# Books returned by the single user and title recommenders, the most `n` can ask for on those endpoints.
+MAX_SINGLE_N = 5
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _items(urls, titles, isbns):
+    return [{"isbn": isbn, "title": title, "image_url": url} for url, title, isbn in zip(urls, titles, isbns)]
+
+
+def _batch_items(results):
+    grouped = {}
+    for row in results.itertuples(index=False):
+        grouped.setdefault(row.query, []).append({"isbn": row.isbn, "title": row.title, "image_url": row.image_url})
+    return grouped
+
+
+def _json_body(body):
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "Request body is not valid JSON")
+    if not isinstance(request, dict):
+        raise HTTPError(400, "Request body must be a JSON object")
+    return request
+
+
+def _list_param(request, name):
+    values = request.get(name, [])
+    if not isinstance(values, list):
+        raise HTTPError(400, f"{name} must be a list")
+    return values
+
+
+def _int_param(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} must be an integer")
+
+
+def _n_param(value, maximum=None):
+    n = _int_param(value, "n")
+    if n < 1:
+        raise HTTPError(400, "n must be at least 1")
+    if maximum is not None and n > maximum:
+        raise HTTPError(400, f"n must be at most {maximum}")
+    return n
+
+
+def _gauges(recommender):
+    gauges = {}
+    if recommender.cache is not None:
+        gauges.update((f"result_cache_{name}", value) for name, value in recommender.cache.stats.as_dict().items())
+    for operation, metrics in dbwrapper.get_connection().latency_report().items():
+        gauges.update((f"db_{operation}_{name}", value) for name, value in metrics.items())
+    return gauges
+
+
+def route(recommender, method, path, body=b"", timeout=DEFAULT_TIMEOUT):
+    """
+    Handles one API request.
+
+    CPU-bound work runs on the recommender's bounded worker pool, so the number of concurrent searches stays
+    capped however many connections the server accepts.
+
+    Args:
+        recommender (Recommender): The loaded recommendation service.
+        method (str): HTTP method.
+        path (str): Request path including the query string.
+        body (bytes, optional): Request body of POST requests.
+        timeout (float, optional): Seconds to wait for the worker pool before failing the request.
+
+    Returns:
+        tuple: `(status, payload)` where `payload` is JSON serializable, or plain text for `/metrics`.
+    """
+    url = urlsplit(path)
+    query = parse_qs(url.query)
+    parts = [part for part in url.path.split("/") if part]
+
+    def call(func, *args):
+        return recommender.executor.submit(func, *args).result(timeout=timeout)
+
+    try:
+        if method == "GET" and parts == ["health"]:
+            cache = recommender.cache.stats.as_dict() if recommender.cache is not None else None
+            return 200, {"status": "ok", "model_version": recommender.bundle.data_hash, "cache": cache}
+
+        if method == "GET" and parts == ["metrics"]:
+            return 200, instrumentation.render(_gauges(recommender))
+
+        if method == "GET" and parts[:2] == ["recommend", "user"] and len(parts) == 3:
+            user_id = _int_param(parts[2], "user id")
+            n = _n_param(query.get("n", [MAX_SINGLE_N])[0], MAX_SINGLE_N)
+            urls, titles, isbns, _ = call(recommender.recommend_user, user_id)
+            return 200, {"user_id": user_id, "recommendations": _items(urls, titles, isbns)[:n]}
+
+        if method == "GET" and parts == ["recommend", "book"]:
+            if "title" not in query:
+                raise HTTPError(400, "title is required")
+            title = query["title"][0]
+            n = _n_param(query.get("n", [MAX_SINGLE_N])[0], MAX_SINGLE_N)
+            urls, titles, isbns, _ = call(recommender.recommend_title, title)
+            return 200, {"title": title, "recommendations": _items(urls, titles, isbns)[:n]}
+
+        if method == "POST" and parts == ["recommend", "users"]:
+            request = _json_body(body)
+            user_ids = [_int_param(user_id, "user id") for user_id in _list_param(request, "user_ids")]
+            results = call(recommender.recommend_users, user_ids, _n_param(request.get("n", 5)))
+            grouped = _batch_items(results)
+            return 200, {"results": [{"user_id": user_id, "recommendations": grouped.get(user_id, [])}
+                                     for user_id in user_ids]}
+
+        if method == "POST" and parts == ["recommend", "books"]:
+            request = _json_body(body)
+            titles = [str(title) for title in _list_param(request, "titles")]
+            results = call(recommender.recommend_titles, titles, _n_param(request.get("n", 5)))
+            grouped = _batch_items(results)
+            return 200, {"results": [{"title": title, "recommendations": grouped.get(title, [])}
+                                     for title in titles]}
+
+        raise HTTPError(404, f"No route for {method} {url.path}")
+
+    except HTTPError as e:
+        return e.status, {"error": e.message}
+    except KeyError as e:
+        return 404, {"error": f"Unknown user or title: {e}"}
+    except TimeoutError:
+        return 503, {"error": "Timed out waiting for a recommendation worker"}
+    except Exception:
+        logging.exception("%s %s failed", method, path)
+        return 500, {"error": "Internal server error"}
+
+
+class RecommendationRequestHandler(BaseHTTPRequestHandler):
+    """Serves `route` over HTTP/1.1 with keep-alive. The recommender is taken from the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _content_length(self, method):
+        value = self.headers.get("Content-Length")
+        if value is None:
+            if method == "POST":
+                raise HTTPError(400, "Content-Length header is required")
+            return 0
+        try:
+            length = int(value)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise HTTPError(400, "Content-Length must be a non-negative integer")
+        return length
+
+    def _handle(self, method):
+        start = time.perf_counter()
+        try:
+            length = self._content_length(method)
+        except HTTPError as e:
+            # Without a length the body cannot be skipped, so the connection cannot be reused.
+            self.close_connection = True
+            status, payload = e.status, {"error": e.message}
+        else:
+            body = self.rfile.read(length) if length else b""
+            with instrumentation.span("http"):
+                status, payload = route(self.server.recommender, method, self.path, body)
+        instrumentation.inc(f"http_responses_{status}")
+        if isinstance(payload, str):
+            data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            data, content_type = json.dumps(payload, default=str).encode("utf-8"), "application/json"
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Server-Timing", f"app;dur={elapsed_ms:.3f}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_server(recommender, host="127.0.0.1", port=8000):
+    """Creates a threaded HTTP server bound to `host:port` serving `recommender`. Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), RecommendationRequestHandler)
+    server.daemon_threads = True
+    server.recommender = recommender
+    return server
+
+
+def _metrics_dir():
+    # Starts every run from empty files, the counters of an earlier run must not be added to this one's.
+    if instrumentation.MULTIPROCESS_DIR is None:
+        return tempfile.mkdtemp(prefix="book-recommender-metrics-")
+    os.makedirs(instrumentation.MULTIPROCESS_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(instrumentation.MULTIPROCESS_DIR, "*.json*")):
+        os.remove(path)
+    return instrumentation.MULTIPROCESS_DIR
+
+
+def serve(recommender, host="127.0.0.1", port=8000, workers=1, live_refresh=False,
+          all_workers=LIVE_REFRESH_ALL_WORKERS):
+    """
+    Serves the API until interrupted.
+
+    With more than one worker the listening socket is created first and the process is forked, so every
+    worker accepts on the same socket and shares the model loaded before the fork. The recommender's
+    thread pool starts its threads lazily, so each worker gets its own. The MongoDB client created while
+    loading is not fork-safe, so every child drops it and creates its own on first use. With `live_refresh`
+    the first worker starts the change watcher after the fork, threads do not survive it. The others keep
+    serving the memory-mapped model as loaded unless `all_workers` is set; then they follow the delta log it
+    appends to, each with its own in-memory copy of the indexes. A bundle that was never saved has no log;
+    then every worker watches on its own and keeps its changes in memory. With metrics recorded, the workers
+    share them, see `instrumentation.share`; the children start from an empty registry.
+    """
+    server = make_server(recommender, host, port)
+    log = DeltaLog(recommender.bundle.path) if recommender.bundle.path else None
+    # Taken before forking, so the followers start exactly where the watcher starts appending.
+    log_offset = log.size() if log is not None else 0
+    metrics_dir = _metrics_dir() if workers > 1 and instrumentation.registry.enabled else None
+    children = []
+    child = False
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = []
+            child = True
+            dbwrapper.set_connection(None)
+            instrumentation.registry.reset()
+            break
+        children.append(pid)
+
+    if metrics_dir is not None:
+        instrumentation.share(metrics_dir, gauges=lambda: _gauges(recommender))
+
+    if live_refresh and not child:
+        recommender.watch()
+    elif live_refresh and all_workers:
+        if log is not None:
+            recommender.follow(log, log_offset)
+        else:
+            recommender.watch(persist=False)
+
+    logging.info("Worker %d serving on http://%s:%d", os.getpid(), *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            for pid in children:
+                os.waitpid(pid, 0)
+        finally:
+            if metrics_dir is not None and not child and instrumentation.MULTIPROCESS_DIR is None:
+                instrumentation.shared.stop()
+                shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+class InProcessClient:
+    """
+    Calls the API without a socket, for tests and local experiments.
+
+        client = InProcessClient(recommender)
+        status, payload = client.get("/recommend/user/42")
+    """
+
+    def __init__(self, recommender):
+        self.recommender = recommender
+
+    def get(self, path):
+        return route(self.recommender, "GET", path)
+
+    def post(self, path, payload):
+        return route(self.recommender, "POST", path, json.dumps(payload).encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="processes accepting on the shared socket")
+    parser.add_argument("--live-refresh", action="store_true", default=LIVE_REFRESH,
+                        help="apply changes to the collections while serving")
+    parser.add_argument("--live-refresh-all-workers", action="store_true", default=LIVE_REFRESH_ALL_WORKERS,
+                        help="apply them in every worker, each with its own in-memory copy of the indexes")
+    parser.add_argument("--collab-engine", choices=COLLAB_ENGINES, default=DEFAULT_COLLAB_ENGINE,
+                        help="engine of the collaborative recommendations")
+    parser.add_argument("--metrics", action="store_true", default=instrumentation.ENABLED,
+                        help="record latencies and counters, exported on /metrics")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    instrumentation.configure(args.metrics)
+    recommender = load_recommender(live_refresh=False, collab_engine=args.collab_engine)
+    serve(recommender, args.host, args.port, args.workers, args.live_refresh, args.live_refresh_all_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from src.dbutils import dbwrapper
+from src.instrumentation import span
+from src.models import batch_recommend, jaykishan_model_building, jaykishan_recommend_book, precompute_recommendations
+from src.models.interactions import InteractionSets
+from src.models.item_cf import COLLAB_ENGINES, DEFAULT_COLLAB_ENGINE, ItemCF
+from src.serving.change_watcher import LIVE_REFRESH, ChangeWatcher, LogFollower
+from src.serving.result_cache import ResultCache
+
+DEFAULT_WORKERS = int(os.getenv("RECOMMEND_WORKERS", os.cpu_count() or 1))
+# Neighbours searched per request, the values the offline job precomputes with.
+COLLAB_K = 3
+CONTENT_K = 10
+
+_DEFAULT_CACHE = object()
+
+
+class Recommender:
+    """
+    Request-scoped recommendation service over a loaded model bundle.
+
+    Every call returns its results instead of storing them in shared state, so concurrent requests never see
+    each other's results. CPU-bound FAISS and embedding work runs on a bounded thread pool (FAISS and the
+    transformer release the GIL), which caps how many searches run at once regardless of how many requests
+    the web layer accepts.
+
+    Attributes:
+        bundle (ModelBundle): The loaded model.
+        interactions (InteractionSets): Books read per user, used for the read-set filter and by the batch
+                                        methods.
+        use_precomputed (bool): Read recommendations written by the offline job before searching live.
+        precomputed_version (str): Data hash of the collections the bundle was loaded for, the version the
+                                   offline job keys its rows by. Live changes give the bundle new versions
+                                   but keep this one, so the rows of unchanged users and titles stay in use.
+        stale_users (set): Users whose interactions changed since loading; their precomputed rows are ignored.
+        stale_titles (set): Titles added or changed since loading; their precomputed rows are ignored.
+        executor (ThreadPoolExecutor): Worker pool for the CPU-bound work.
+        cache (ResultCache or None): Results of single user and title requests, None to disable caching.
+        watcher (ChangeWatcher or LogFollower or None): Applies changes to the collections while serving, see
+                                                        `watch` and `follow`.
+        item_cf (ItemCF or None): Item-item model answering the collaborative requests when the collaborative
+                                  engine is "item_cf", None when the bundle's vector store does.
+    """
+
+    def __init__(self, bundle, user_book_df, max_workers=DEFAULT_WORKERS, use_precomputed=True, cache=_DEFAULT_CACHE,
+                 collab_engine=DEFAULT_COLLAB_ENGINE):
+        if collab_engine not in COLLAB_ENGINES:
+            raise ValueError(f"Unknown collaborative engine {collab_engine!r}, expected one of {COLLAB_ENGINES}")
+        self.bundle = bundle
+        self.interactions = InteractionSets.from_frame(user_book_df, bundle.catalog)
+        self.item_cf = ItemCF.fit(user_book_df, bundle.catalog) if collab_engine == "item_cf" else None
+        self.use_precomputed = use_precomputed
+        self.precomputed_version = bundle.data_hash
+        self.stale_users = set()
+        self.stale_titles = set()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recommender")
+        self.cache = ResultCache() if cache is _DEFAULT_CACHE else cache
+        self.watcher = None
+
+    def recommend_user(self, user_id, k=COLLAB_K):
+        """
+        Collaborative recommendations of one user.
+
+        The read side of `bundle.lock` is only held while the index and the catalog are used, not around the
+        precomputed lookup and the cache, so a slow database read never holds up an incremental update and,
+        through it, every other request.
+
+        Returns:
+            tuple: `(urls, titles, isbns, info)` where `info` maps the rank of every book to its details.
+        """
+        user_id = int(user_id)
+
+        def compute():
+            precomputed = None
+            # The offline job precomputes with the vector engine.
+            if self.use_precomputed and k == COLLAB_K and self.item_cf is None and user_id not in self.stale_users:
+                precomputed = precompute_recommendations.lookup_precomputed(
+                    precompute_recommendations.COLLAB_COLLECTION, {"_id": user_id}, self.precomputed_version)
+            if precomputed and self._in_catalog(precomputed):
+                return precomputed
+            with self.bundle.lock.read():
+                return jaykishan_recommend_book.recommend_book_collab(
+                    user_id, self.bundle.collab_vector_store, self.interactions, self.bundle.catalog,
+                    self.bundle.books_data, self.bundle.user_vectors, k=k, item_cf=self.item_cf)
+
+        mode = "collab" if self.item_cf is None else "item_cf"
+        with span("recommend_user"):
+            urls, titles, isbns = self._cached(mode, user_id, k, compute)
+            with span("metadata"), self.bundle.lock.read():
+                return urls, titles, isbns, self.bundle.catalog.info_for(isbns)
+
+    def recommend_title(self, title, k=CONTENT_K):
+        """Content based recommendations for one title, returned like `recommend_user`."""
+        title = str(title)
+
+        def compute():
+            precomputed = None
+            if self.use_precomputed and k == CONTENT_K and title not in self.stale_titles:
+                precomputed = precompute_recommendations.lookup_precomputed(
+                    precompute_recommendations.CONTENT_COLLECTION, {"_id": title}, self.precomputed_version)
+            if precomputed and self._in_catalog(precomputed):
+                return precomputed
+            with self.bundle.lock.read():
+                return jaykishan_recommend_book.recommend_book_content(
+                    self.bundle.catalog, self.bundle.content_vector_store, title, k=k)
+
+        with span("recommend_title"):
+            urls, titles, isbns = self._cached("content", title, k, compute)
+            with span("metadata"), self.bundle.lock.read():
+                return urls, titles, isbns, self.bundle.catalog.info_for(isbns)
+
+    def _in_catalog(self, recommendations):
+        # Precomputed rows recommending a book removed since loading are searched again.
+        return all(isbn in self.bundle.catalog for isbn in recommendations[2])
+
+    def _cached(self, mode, query, k, compute):
+        if self.cache is None:
+            return compute()
+        return self.cache.get_or_compute(mode, query, k, self.bundle.data_hash, compute)
+
+    def recommend_users(self, user_ids, n=5):
+        """Collaborative recommendations of many users as a DataFrame, see `batch_recommend`."""
+        with span("recommend_users"), self.bundle.lock.read():
+            if self.item_cf is not None:
+                return batch_recommend.recommend_books_item_cf_batch(user_ids, self.item_cf, self.bundle.catalog, n=n)
+            return batch_recommend.recommend_books_collab_batch(
+                user_ids, self.bundle.collab_vector_store, self.interactions, self.bundle.catalog,
+                self.bundle.user_vectors, self.bundle.books_data, n=n)
+
+    def recommend_titles(self, titles, n=5):
+        """Content based recommendations of many titles as a DataFrame, see `batch_recommend`."""
+        with span("recommend_titles"), self.bundle.lock.read():
+            return batch_recommend.recommend_books_content_batch(
+                titles, self.bundle.content_vector_store, self.bundle.catalog, n=n)
+
+    def update_interactions(self, user_ids=(), frame=None):
+        """
+        Replaces the interactions of some users in the read sets (and the ratings of the item-item model).
+
+        Only the rows of `user_ids` are rebuilt, so the cost follows the size of the change, not of all the
+        interactions. The rows are built under the read side of the bundle lock and swapped in under the
+        write side.
+
+        Args:
+            user_ids (list, optional): Users whose interactions are replaced.
+            frame (DataFrame, optional): All `books_data` rows of `user_ids`; users without rows are removed.
+        """
+        if not len(user_ids):
+            return
+        self.stale_users.update(user_ids)
+        if frame is None:
+            frame = pd.DataFrame(columns=["user_id", "isbn", "rating"])
+        with self.bundle.lock.read():
+            interactions = InteractionSets.from_frame(frame, self.bundle.catalog)
+        with self.bundle.lock.write():
+            self.interactions.replace(user_ids, interactions)
+            if self.item_cf is not None:
+                self.item_cf.update_users(user_ids, frame, self.bundle.catalog)
+
+    def books_changed(self, titles):
+        """Stops using the precomputed recommendations of books added or changed since loading."""
+        self.stale_titles.update(titles)
+
+    def refresh_catalog(self):
+        """Stops the item-item model from recommending books removed from the catalog."""
+        if self.item_cf is not None:
+            with self.bundle.lock.write():
+                self.item_cf.refresh_live(self.bundle.catalog)
+
+    def watch(self, **kwargs):
+        """
+        Starts applying changes to `all_books` and `books_data` to this recommender in the background.
+
+        Args:
+            **kwargs: Forwarded to `ChangeWatcher`.
+
+        Returns:
+            ChangeWatcher: The started watcher, stopped again by `close`.
+        """
+        if self.watcher is None:
+            self.watcher = ChangeWatcher(self, **kwargs).start()
+        return self.watcher
+
+    def follow(self, log, offset):
+        """
+        Starts applying the changes another process appends to the bundle's delta log, see `LogFollower`.
+
+        Args:
+            log (DeltaLog): The delta log of the bundle.
+            offset (int): Size of the log already reflected by the bundle, taken before the other process
+                          started appending, e.g. before forking.
+
+        Returns:
+            LogFollower: The started follower, stopped again by `close`.
+        """
+        if self.watcher is None:
+            self.watcher = LogFollower(self, log, offset).start()
+        return self.watcher
+
+    async def run(self, method, *args):
+        """Runs one of the recommendation methods on the worker pool without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, method, *args)
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.executor.shutdown(wait=True)
+
+
+def load_recommender(live_refresh=LIVE_REFRESH, **kwargs):
+    """
+    Loads the collections from MongoDB and the matching model bundle, and wraps them in a `Recommender`.
+
+    Args:
+        live_refresh (bool, optional): Keep the model up to date with the collections while serving, see
+                                       `Recommender.watch`. Defaults to the `LIVE_REFRESH` environment variable.
+        **kwargs: Forwarded to `Recommender`.
+
+    Returns:
+        Recommender: The service, ready to answer requests.
+    """
+    user_book_df = dbwrapper.fetch_dataframe('books_data', jaykishan_model_building.INTERACTION_COLUMNS)
+    df = dbwrapper.fetch_dataframe('all_books', jaykishan_model_building.BOOK_COLUMNS)
+
+    # Reuses the saved model bundle when the collections are unchanged and only retrains otherwise.
+    bundle = jaykishan_model_building.load_or_build_model(df, user_book_df)
+    recommender = Recommender(bundle, user_book_df, **kwargs)
+    if live_refresh:
+        recommender.watch()
+    return recommender
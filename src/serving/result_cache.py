@@ -0,0 +1,226 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src.dbutils import dbwrapper
+from src.dbutils.connect_database import REQUEST_RETRY
+
+DEFAULT_MAX_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 10000))
+DEFAULT_TTL = float(os.getenv("RESULT_CACHE_TTL", 3600))
+# "none", "local" or "mongo"
+DEFAULT_SHARED_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "none")
+CACHE_COLLECTION = "result_cache"
+
+_MISSING = object()
+
+
+class CacheStats:
+    """Counters of a `ResultCache`. Not locked, so the numbers are approximate under concurrency."""
+
+    def __init__(self):
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class LRUCache:
+    """
+    Thread-safe in-process cache bounded by number of entries and entry age.
+
+    Attributes:
+        max_size (int): Entries kept before the least recently used one is evicted.
+        ttl (float): Seconds an entry stays valid; 0 or less disables expiry.
+        stats (CacheStats): Eviction and expiration counters.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, stats=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = stats or CacheStats()
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= self.clock():
+                del self.entries[key]
+                self.stats.expirations += 1
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = self.clock() + self.ttl if self.ttl and self.ttl > 0 else None
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class LocalSharedBackend:
+    """
+    Stand-in for a shared backend that lives in the current process.
+
+    Has the interface of `MongoCacheBackend`, so the two-level cache path can run and be tested without a
+    database. Not actually shared between processes.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.cache = LRUCache(max_size=float("inf"), ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class MongoCacheBackend:
+    """
+    Cache shared by all serving processes, stored in a MongoDB collection.
+
+    Entries are keyed by the JSON encoded cache key and carry an `expires_at` timestamp that is checked on
+    read. Failures are logged and treated as a miss, so an unavailable database only costs the live search.
+    """
+
+    def __init__(self, collection_name=CACHE_COLLECTION, ttl=DEFAULT_TTL):
+        self.collection_name = collection_name
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            document = dbwrapper.fetch_documents(self.collection_name, condition={"_id": json.dumps(key)}, one=True,
+                                                 retry=REQUEST_RETRY)
+        except Exception as e:
+            logging.warning("Reading the result cache from %s failed: %s", self.collection_name, e)
+            return None
+        if not document:
+            return None
+        expires_at = document.get("expires_at")
+        if expires_at is not None:
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+            if expires_at <= datetime.datetime.now(datetime.timezone.utc):
+                return None
+        return document["value"]
+
+    def set(self, key, value):
+        expires_at = None
+        if self.ttl and self.ttl > 0:
+            expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.ttl)
+        try:
+            dbwrapper.update_docs(self.collection_name, {"_id": json.dumps(key)},
+                                  {"$set": {"value": value, "expires_at": expires_at}}, upsert=True,
+                                  retry=REQUEST_RETRY)
+        except Exception as e:
+            logging.warning("Writing the result cache to %s failed: %s", self.collection_name, e)
+
+    def clear(self):
+        # Keys contain the model version, so entries of older models are never read again and expire.
+        pass
+
+
+def make_shared_backend(name=DEFAULT_SHARED_BACKEND, ttl=DEFAULT_TTL):
+    """Returns the shared backend called `name` ("none", "local" or "mongo")."""
+    if name in (None, "", "none"):
+        return None
+    if name == "local":
+        return LocalSharedBackend(ttl=ttl)
+    if name == "mongo":
+        return MongoCacheBackend(ttl=ttl)
+    raise ValueError(f"Unknown result cache backend {name!r}")
+
+
+class ResultCache:
+    """
+    Cache of recommendation results keyed by `(mode, user id or title, k, model version)`.
+
+    Lookups go to the in-process LRU first and then to the optional shared backend, whose hits are copied
+    into the LRU. The cache remembers the model version of the last lookup and empties itself when a
+    different version shows up, so results of a rebuilt bundle are never mixed with stale ones.
+
+    Attributes:
+        local (LRUCache): In-process cache.
+        shared (LocalSharedBackend or MongoCacheBackend or None): Optional second level.
+        stats (CacheStats): Hit, miss, eviction, expiration and invalidation counters.
+        model_version (str or None): Model version the cached results belong to.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, shared=_MISSING):
+        self.stats = CacheStats()
+        self.local = LRUCache(max_size=max_size, ttl=ttl, stats=self.stats)
+        self.shared = make_shared_backend(ttl=ttl) if shared is _MISSING else shared
+        self.model_version = None
+        self.lock = threading.Lock()
+
+    def invalidate(self, model_version=None):
+        """Drops every cached result and starts caching for `model_version`."""
+        with self.lock:
+            self.local.clear()
+            if self.shared is not None:
+                self.shared.clear()
+            self.model_version = model_version
+            self.stats.invalidations += 1
+
+    def get_or_compute(self, mode, query, k, model_version, compute):
+        """
+        Returns the cached result of a request, computing and storing it on a miss.
+
+        Args:
+            mode (str): `"collab"` or `"content"`.
+            query (int or str): User id or title.
+            k (int): Neighbours searched, part of the key since it changes the result.
+            model_version (str): Data hash of the bundle serving the request.
+            compute (callable): Produces the result when it is not cached.
+
+        Returns:
+            The cached or freshly computed result.
+        """
+        if model_version != self.model_version:
+            self.invalidate(model_version)
+        key = (mode, query, k, model_version)
+
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats.hits += 1
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.stats.shared_hits += 1
+                self.local.set(key, value)
+                return value
+
+        self.stats.misses += 1
+        value = compute()
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+        return value
@@ -0,0 +1,79 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from src.models import artifacts, history_builder
+from src.models.jaykishan_model_building import build_vector_store
+from src.models.user_vectors import UserVectorCache
+
+DIM = 16
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic stand-in for `BatchEmbedder`: every text maps to a fixed unit vector derived from its hash."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts):
+        self.calls += len(texts)
+        vectors = np.empty((len(texts), DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(DIM)
+            vectors[row] = vector / np.linalg.norm(vector)
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+def make_frames(num_books=12, num_users=8, per_user=3, seed=0):
+    """Returns a small `(all_books, books_data)` pair shaped like the collections."""
+    rng = np.random.default_rng(seed)
+    books = pd.DataFrame({
+        "isbn": [f"isbn{i}" for i in range(num_books)],
+        "title": [f"Title {i}" for i in range(num_books)],
+        "authors": [f"Author {i}" for i in range(num_books)],
+        "description": [f"description of book {i}" for i in range(num_books)],
+        "new_image_url": [f"http://images/{i}.jpg" for i in range(num_books)],
+    })
+    rows = []
+    for user_id in range(1, num_users + 1):
+        for book in rng.choice(num_books, per_user, replace=False):
+            rows.append({"user_id": user_id, "isbn": books.isbn[book], "title": books.title[book],
+                         "rating": int(rng.integers(1, 6)), "description": books.description[book]})
+    return books, pd.DataFrame(rows)
+
+
+def make_bundle(books, interactions, embeddings, index_type="flat"):
+    """Builds a bundle like `create_recommendation_model`, with every user indexed."""
+    users = pd.unique(interactions["user_id"]).tolist()
+    histories, isbns = history_builder.build_histories(interactions, users)
+    user_texts = [" ".join(history) for history in histories]
+    user_matrix = embeddings.encode(user_texts)
+    collab = build_vector_store(embeddings, user_matrix, [str(user) for user in users], user_texts,
+                                [{"isbns": book_isbns} for book_isbns in isbns], index_type=index_type)
+    descriptions = books["description"].astype(str).tolist()
+    content = build_vector_store(embeddings, embeddings.encode(descriptions), books["isbn"].tolist(), descriptions,
+                                 [{"title": title, "isbn": isbn} for title, isbn in zip(books["title"], books["isbn"])],
+                                 index_type=index_type)
+    return artifacts.ModelBundle(collab, content, dict(zip(users, user_texts)), artifacts.catalog_table(books),
+                                 users, [], UserVectorCache(users, user_matrix),
+                                 artifacts.compute_data_hash(books, interactions))
+
+
+@pytest.fixture
+def embeddings():
+    return HashEmbeddings()
+
+
+@pytest.fixture
+def frames():
+    return make_frames()
@@ -0,0 +1,206 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from langchain_core.documents import Document
+
+from src.models import artifacts, incremental, jaykishan_recommend_book
+from src.models.interactions import InteractionSets
+from src.models.jaykishan_model_building import build_vector_store
+from tests.conftest import HashEmbeddings, make_bundle
+
+MODEL_KEY = "test"
+
+
+def _store_state(store):
+    labels = sorted(store.index_to_docstore_id)
+    doc_ids = [store.index_to_docstore_id[label] for label in labels]
+    vectors = np.stack([store.index.reconstruct(label) for label in labels]) if labels else None
+    documents = [store.docstore.search(doc_id) for doc_id in doc_ids]
+    return doc_ids, vectors, [(document.page_content, document.metadata) for document in documents]
+
+
+def _assert_same_state(bundle, expected):
+    assert bundle.data_hash == expected.data_hash
+    for store, expected_store in ((bundle.collab_vector_store, expected.collab_vector_store),
+                                  (bundle.content_vector_store, expected.content_vector_store)):
+        doc_ids, vectors, documents = _store_state(store)
+        expected_ids, expected_vectors, expected_documents = _store_state(expected_store)
+        assert doc_ids == expected_ids
+        np.testing.assert_array_equal(vectors, expected_vectors)
+        assert documents == expected_documents
+    pd.testing.assert_frame_equal(bundle.catalog.table(), expected.catalog.table())
+    assert bundle.books_data == expected.books_data
+    assert bundle.users_train == expected.users_train
+    assert bundle.user_vectors.user_ids.tolist() == expected.user_vectors.user_ids.tolist()
+    np.testing.assert_array_equal(bundle.user_vectors.vectors, expected.user_vectors.vectors)
+
+
+def _saved_bundle(tmp_path, frames, embeddings):
+    books, interactions = frames
+    bundle = make_bundle(books, interactions, embeddings)
+    artifacts.save_bundle(bundle, str(tmp_path), MODEL_KEY)
+    return artifacts.load_bundle(bundle.path, embeddings)
+
+
+def _apply_changes(updater, frames):
+    books, interactions = frames
+    changed = books[books["isbn"] == "isbn2"].assign(description="a completely new description")
+    added = pd.DataFrame([{"isbn": "isbn-new", "title": "New Title", "authors": "New Author",
+                           "description": "a new book", "new_image_url": "http://images/new.jpg"}])
+    updater.upsert_books(pd.concat([changed, added], ignore_index=True))
+    updater.remove_books(["isbn5"])
+
+    user_3 = interactions[interactions["user_id"] == 3]
+    new_user = user_3.assign(user_id=99).iloc[:1]
+    updater.upsert_users(pd.concat([user_3, user_3.iloc[:1].assign(rating=1), new_user], ignore_index=True))
+    updater.remove_users([4])
+
+
+def test_replay_after_restart_restores_updates_without_embedding(tmp_path, frames, embeddings):
+    bundle = _saved_bundle(tmp_path, frames, embeddings)
+    updater = incremental.IncrementalUpdater(bundle)
+    _apply_changes(updater, frames)
+
+    restarted = artifacts.load_bundle(bundle.path, HashEmbeddings(), mmap=False)
+    replayer = incremental.IncrementalUpdater(restarted, in_memory=True)
+    assert replayer.replay() == 4
+
+    assert restarted.content_vector_store.embedding_function.calls == 0
+    _assert_same_state(restarted, bundle)
+    assert "isbn5" not in restarted.catalog and "isbn-new" in restarted.catalog
+    assert 4 not in restarted.user_vectors and 99 in restarted.user_vectors
+
+
+def test_replay_ignores_records_of_an_append_that_did_not_finish(tmp_path, frames, embeddings):
+    bundle = _saved_bundle(tmp_path, frames, embeddings)
+    updater = incremental.IncrementalUpdater(bundle)
+    updater.remove_books(["isbn5"])
+    # A crash between writing the records and rewriting the head leaves bytes the head does not cover.
+    with open(updater.log.log_path, "ab") as f:
+        f.write(b"\x80\x05torn record")
+
+    restarted = artifacts.load_bundle(bundle.path, embeddings, mmap=False)
+    assert incremental.IncrementalUpdater(restarted, in_memory=True).replay() == 1
+    _assert_same_state(restarted, bundle)
+
+
+def test_different_updates_of_the_same_state_get_different_versions(tmp_path, frames, embeddings):
+    books, _ = frames
+    versions = []
+    for isbn in ("isbn2", "isbn4"):
+        bundle = _saved_bundle(tmp_path / isbn, frames, embeddings)
+        updater = incremental.IncrementalUpdater(bundle)
+        versions.append(updater.upsert_books(books[books["isbn"] == isbn].assign(description="rewritten")))
+        versions.append(updater.remove_users([3 if isbn == "isbn2" else 4]))
+    assert len(set(versions)) == 4
+
+
+def test_sync_skips_users_a_rebuild_would_not_select(tmp_path, frames, embeddings):
+    books, interactions = frames
+    bundle = _saved_bundle(tmp_path, frames, embeddings)
+    outside = interactions[interactions["user_id"] == 1].assign(user_id=700)
+    inside = interactions[interactions["user_id"] == 1].assign(user_id=42)
+
+    summary = incremental.sync(incremental.IncrementalUpdater(bundle), books,
+                               pd.concat([interactions, outside, inside], ignore_index=True), "synced")
+
+    assert summary["users_upserted"] == 1
+    assert 42 in bundle.user_vectors and 700 not in bundle.user_vectors
+    assert bundle.data_hash == "synced"
+
+
+def test_collab_recommendations_skip_read_books_and_books_removed_after_indexing(frames, embeddings):
+    books, interactions = frames
+    bundle = make_bundle(books, interactions, embeddings)
+    sets = InteractionSets.from_frame(interactions, bundle.catalog)
+    read = set(interactions.loc[interactions["user_id"] == 1, "isbn"])
+
+    def recommend():
+        # Every indexed user votes, so the removed book would be recommended again if it were not skipped.
+        return jaykishan_recommend_book.recommend_book_collab(
+            1, bundle.collab_vector_store, sets, bundle.catalog, bundle.books_data, bundle.user_vectors,
+            k=len(bundle.users_train))
+
+    _, _, isbns = recommend()
+    incremental.IncrementalUpdater(bundle).remove_books([isbns[0]])
+    _, titles, after = recommend()
+
+    assert isbns and not read & set(isbns)
+    assert isbns[0] not in after and not read & set(after)
+    assert titles == bundle.catalog.titles_for(after)
+
+
+def test_compaction_saves_the_updated_bundle_and_starts_an_empty_log(tmp_path, frames, embeddings, monkeypatch):
+    bundle = _saved_bundle(tmp_path, frames, embeddings)
+    old_path = bundle.path
+    updater = incremental.IncrementalUpdater(bundle)
+    updater.remove_books(["isbn5"])
+    assert not updater.needs_compaction()
+
+    _apply_changes(updater, frames)
+    monkeypatch.setattr(incremental, "COMPACT_RATIO", 0.1)
+    assert updater.needs_compaction()
+    path = updater.compact(str(tmp_path), MODEL_KEY)
+
+    assert path != old_path and not os.path.exists(old_path)
+    assert artifacts.is_bundle_valid(path, bundle.data_hash, MODEL_KEY)
+    assert incremental.DeltaLog(path).head() is None
+    assert incremental.find_bundle(str(tmp_path), MODEL_KEY, bundle.data_hash) == path
+    _assert_same_state(artifacts.load_bundle(path, embeddings), bundle)
+
+    # Later updates are logged next to the compacted bundle.
+    updater.remove_users([5])
+    restarted = artifacts.load_bundle(path, embeddings, mmap=False)
+    assert incremental.IncrementalUpdater(restarted, in_memory=True).replay() == 1
+    _assert_same_state(restarted, bundle)
+
+
+def _store(embeddings, texts, index_type="flat"):
+    doc_ids = [f"doc{i}" for i in range(len(texts))]
+    return build_vector_store(embeddings, embeddings.encode(texts), doc_ids, texts,
+                              [{"id": doc_id} for doc_id in doc_ids], index_type=index_type)
+
+
+def test_removing_from_a_flat_store_renumbers_the_remaining_labels(embeddings):
+    texts = [f"text {i}" for i in range(5)]
+    store = _store(embeddings, texts)
+
+    incremental.remove_from_store(store, ["doc1", "doc3"])
+
+    assert store.index.ntotal == 3
+    assert store.index_to_docstore_id == {0: "doc0", 1: "doc2", 2: "doc4"}
+    for label, doc_id in store.index_to_docstore_id.items():
+        np.testing.assert_array_equal(store.index.reconstruct(label), embeddings.encode([f"text {doc_id[3:]}"])[0])
+    assert not isinstance(store.docstore.search("doc0"), str)
+    assert isinstance(store.docstore.search("doc1"), str)
+
+    incremental.add_to_store(store, embeddings.encode(["text 5"]), ["doc5"], ["text 5"], [{"id": "doc5"}])
+    assert store.index_to_docstore_id[3] == "doc5"
+    document, _ = store.similarity_search_with_score("text 2", k=1)[0]
+    assert document == Document(page_content="text 2", metadata={"id": "doc2"})
+
+
+def test_removing_from_an_ivf_store_keeps_the_remaining_labels(embeddings):
+    texts = [f"text {i}" for i in range(100)]
+    store = _store(embeddings, texts, "ivf_flat")
+    store.index.nprobe = store.index.nlist
+
+    incremental.remove_from_store(store, ["doc1", "doc3"])
+
+    assert store.index.ntotal == 98
+    assert 1 not in store.index_to_docstore_id and 3 not in store.index_to_docstore_id
+    assert store.index_to_docstore_id[2] == "doc2" and store.index_to_docstore_id[99] == "doc99"
+
+    incremental.add_to_store(store, embeddings.encode(["text 100"]), ["doc100"], ["text 100"], [{"id": "doc100"}])
+    assert store.index_to_docstore_id[100] == "doc100"
+    for text in ("text 2", "text 100"):
+        document, _ = store.similarity_search_with_score(text, k=1)[0]
+        assert document.page_content == text
+
+
+def test_removing_from_an_hnsw_store_asks_for_a_rebuild(embeddings):
+    store = _store(embeddings, [f"text {i}" for i in range(5)], "hnsw")
+    with pytest.raises(ValueError):
+        incremental.remove_from_store(store, ["doc1"])
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+from src.models import artifacts, item_cf
+from src.models.catalog import CatalogLookup
+from tests.conftest import make_frames
+
+NUM_BOOKS = 40
+NEIGHBOURS = 6
+
+
+@pytest.fixture
+def ratings():
+    books, interactions = make_frames(num_books=NUM_BOOKS, num_users=60, per_user=8, seed=1)
+    # Real-valued ratings, so no two similarities or scores tie and the dense reference ranks them the same.
+    interactions = interactions.assign(rating=np.random.default_rng(1).uniform(0.5, 5, len(interactions)))
+    return CatalogLookup(artifacts.catalog_table(books)), interactions
+
+
+def _dense_ratings(interactions, catalog):
+    users = np.unique(interactions["user_id"])
+    matrix = np.zeros((len(users), len(catalog)))
+    matrix[np.searchsorted(users, interactions["user_id"]), interactions["isbn"].map(catalog.isbn_to_pos)] = \
+        interactions["rating"]
+    return users, matrix
+
+
+def _dense_similarities(matrix, neighbours):
+    norms = np.linalg.norm(matrix, axis=0)
+    normalized = matrix / np.where(norms > 0, norms, 1)
+    similarities = normalized.T @ normalized
+    np.fill_diagonal(similarities, 0)
+    pruned = np.zeros_like(similarities)
+    for row in range(len(similarities)):
+        top = np.argsort(-similarities[row], kind="stable")[:neighbours]
+        top = top[similarities[row, top] > 0]
+        pruned[row, top] = similarities[row, top]
+    return pruned
+
+
+def _dense_recommendations(matrix, similarities, live, n):
+    recommendations = []
+    for user_ratings in matrix:
+        scores = user_ratings @ similarities
+        scores[(user_ratings > 0) | ~live] = 0
+        top = np.lexsort((np.arange(len(scores)), -scores))[:n]
+        recommendations.append(top[scores[top] > 0])
+    return recommendations
+
+
+def test_similarities_match_a_dense_reference(ratings):
+    catalog, interactions = ratings
+    model = item_cf.ItemCF.fit(interactions, catalog, neighbours=NEIGHBOURS, block_size=7)
+
+    _, matrix = _dense_ratings(interactions, catalog)
+    np.testing.assert_allclose(model.similarities.toarray(), _dense_similarities(matrix, NEIGHBOURS), atol=1e-6)
+
+
+def test_recommend_matches_dense_scoring(ratings):
+    catalog, interactions = ratings
+    model = item_cf.ItemCF.fit(interactions, catalog, neighbours=NEIGHBOURS, block_size=7)
+    users, matrix = _dense_ratings(interactions, catalog)
+    removed = catalog.position("isbn3")
+    catalog.remove(["isbn3"])
+    model.refresh_live(catalog)
+
+    query, item, score, rank = model.recommend(users.tolist() + [-1], n=5)
+
+    assert not np.any(query == len(users))
+    assert not np.any(item == removed)
+    similarities = model.similarities.toarray().astype(np.float64)
+    expected = _dense_recommendations(matrix, similarities, model.live, 5)
+    for row, books in enumerate(expected):
+        assert item[query == row].tolist() == books.tolist()
+        np.testing.assert_allclose(score[query == row], (matrix[row] @ similarities)[books], rtol=1e-5)
+        assert rank[query == row].tolist() == list(range(len(books)))
+
+
+def test_update_users_matches_a_refit(ratings):
+    catalog, interactions = ratings
+    model = item_cf.ItemCF.fit(interactions, catalog, neighbours=NEIGHBOURS)
+
+    # User 2 re-rates their books, user 5 drops one, user 7 leaves and user 99 arrives.
+    changed = pd.concat([
+        interactions[interactions["user_id"] == 2].assign(rating=lambda frame: frame["rating"][::-1].to_numpy()),
+        interactions[interactions["user_id"] == 5].iloc[1:],
+        interactions[interactions["user_id"] == 1].assign(user_id=99),
+    ], ignore_index=True)
+    model.update_users([2, 5, 7, 99], changed, catalog)
+    interactions = pd.concat([interactions[~interactions["user_id"].isin([2, 5, 7])], changed], ignore_index=True)
+
+    refit = item_cf.ItemCF(model.similarities, item_cf.ItemCF.fit(interactions, catalog).ratings, model.live)
+    users = np.unique(interactions["user_id"]).tolist() + [7]
+    assert 7 not in model and 99 in model
+    for got, expected in zip(model.recommend(users), refit.recommend(users)):
+        np.testing.assert_array_equal(got, expected)
+
+
+def test_top_per_row_keeps_ties_in_index_order_and_respects_row_boundaries():
+    matrix = sp.csr_matrix((
+        np.array([3, 1, 3, 2, 0, -1, 5, 2, 2, 2, 1e9, 1e-9, 4], dtype=np.float32),
+        np.array([0, 1, 2, 3, 0, 1, 2, 0, 1, 2, 0, 1, 0]),
+        # Row 1 is empty; row 2 only has one positive entry.
+        np.array([0, 4, 4, 7, 10, 12, 13]),
+    ), shape=(6, 4))
+
+    row, col, value, rank = item_cf._top_per_row(matrix, 2)
+
+    assert row.tolist() == [0, 0, 2, 3, 3, 4, 4, 5]
+    assert col.tolist() == [0, 2, 2, 0, 1, 0, 1, 0]
+    assert rank.tolist() == [0, 1, 0, 0, 1, 0, 1, 0]
+    np.testing.assert_array_equal(value, matrix.data[[0, 2, 6, 7, 8, 10, 11, 12]])
+
+
+def test_top_per_row_of_a_matrix_without_positive_entries_is_empty():
+    matrix = sp.csr_matrix((np.array([0, -2], dtype=np.float32), np.array([0, 1]), np.array([0, 1, 2])),
+                           shape=(2, 2))
+
+    row, col, value, rank = item_cf._top_per_row(matrix, 3)
+
+    assert len(row) == len(col) == len(value) == len(rank) == 0